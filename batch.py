@@ -0,0 +1,117 @@
+import asyncio
+import json
+import os
+
+from providers import BATCH_ENDED, Completion, get_provider, provider_for
+from scheduler import Job
+
+# --- CONFIGURATION ---
+# Seconds between status checks while a batch is running
+BATCH_POLL_INTERVAL = 30.0
+
+# Requests per submitted batch (OpenAI allows 50k, Anthropic 100k per batch)
+MAX_BATCH_REQUESTS = 10000
+
+
+def batch_state_path_for(output_file):
+    """raw_model_responses.json -> raw_model_responses.batches.json"""
+    root, _ = os.path.splitext(output_file)
+    return f"{root}.batches.json"
+
+
+def _load_state(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def _save_state(path, state):
+    tmp_file = path + ".tmp"
+    with open(tmp_file, 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_file, path)
+
+
+async def run_batches(jobs, dataset, models, params, on_result, state_file, resume=False, cache=None):
+    """
+    Sends jobs through the providers' asynchronous batch APIs instead of one call each.
+
+    Jobs are grouped per model and packed into batches of up to MAX_BATCH_REQUESTS.
+    Every submitted batch is recorded in `state_file` together with the (id, variant) of
+    each request, so a --resume after a crash collects the running batches instead of
+    paying for them twice. Results are handed to `on_result(job, completion)` exactly
+    like the interactive path; failed requests come back as None. Batches of models not in
+    `models` are left for a later run.
+    """
+    state = _load_state(state_file) if resume else {}
+    index_by_id = {item["id"]: i for i, item in enumerate(dataset)}
+    temperature, max_tokens = params["temperature"], params["max_tokens"]
+
+    # Requests already inside a batch from an earlier run are not submitted again
+    in_flight = {
+        (item_id, batch["model"], variant)
+        for batch in state.values() for item_id, variant in batch["requests"]
+    }
+    to_submit = {}
+    for job in jobs:
+        item_id = dataset[job.item_index]["id"]
+        if (item_id, job.model_key, job.variant) in in_flight:
+            continue
+        provider = provider_for(job.model_key)
+        if cache is not None:
+            cached = cache.get(provider, models[job.model_key], job.prompt, params, job.item_id)
+            if cached is not None:
+                on_result(job, Completion(cached, {}, None, None))
+                continue
+        to_submit.setdefault(job.model_key, []).append(job)
+
+    # 1. Submit
+    for model_key, model_jobs in to_submit.items():
+        adapter = get_provider(provider_for(model_key))
+        if not adapter.supports_batch:
+            raise ValueError(f"Provider '{adapter.name}' for {model_key} has no batch API")
+        for start in range(0, len(model_jobs), MAX_BATCH_REQUESTS):
+            chunk = model_jobs[start:start + MAX_BATCH_REQUESTS]
+            requests = [(f"req-{i}", job.prompt) for i, job in enumerate(chunk)]
+            batch_id = await adapter.submit_batch(models[model_key], requests, temperature, max_tokens)
+            state[batch_id] = {
+                "provider": adapter.name,
+                "model": model_key,
+                "requests": [[dataset[job.item_index]["id"], job.variant] for job in chunk],
+            }
+            _save_state(state_file, state)
+            print(f"Submitted batch {batch_id}: {len(chunk)} requests for {model_key}")
+
+    # 2. Poll every open batch until it ends, then merge its results
+    async def collect(batch_id, batch):
+        adapter = get_provider(batch["provider"])
+        while await adapter.batch_status(batch_id) != BATCH_ENDED:
+            await asyncio.sleep(BATCH_POLL_INTERVAL)
+
+        results = await adapter.batch_results(batch_id)
+        for i, (item_id, variant) in enumerate(batch["requests"]):
+            item_index = index_by_id.get(item_id)
+            if item_index is None:
+                continue
+            prompt = dataset[item_index]["prompts"][variant]
+            job = Job(item_index, batch["model"], variant, prompt, item_id)
+            completion = results.get(f"req-{i}")
+            if cache is not None and completion is not None:
+                cache.put(adapter.name, models[batch["model"]], prompt, params, completion.text, item_id)
+            on_result(job, completion)
+
+        del state[batch_id]
+        _save_state(state_file, state)
+        print(f"Collected batch {batch_id}")
+
+    # A resumed run may query fewer models than the one that submitted; batches of the others
+    # stay in the state file for a --resume that includes their model
+    open_batches = {}
+    for batch_id, batch in list(state.items()):
+        if batch["model"] in models:
+            open_batches[batch_id] = batch
+        else:
+            print(f"Warning: skipped batch {batch_id} of {batch['model']}, which is not among the models "
+                  f"queried now; it stays in {state_file}")
+    await asyncio.gather(*(collect(batch_id, batch) for batch_id, batch in open_batches.items()))
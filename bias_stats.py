@@ -0,0 +1,191 @@
+import argparse
+import glob
+import os
+import numpy as np                  #type: ignore
+import pandas as pd                 #type: ignore
+from columnar import read_results, results_exist
+
+# --- CONFIGURATION ---
+RESULTS_CSV = "agreement_bias_results_summary.csv"  # Per-run output of evaluate_moral_results.py
+OUTPUT_CSV = "bias_stats.csv"
+N_RESAMPLES = 10_000
+CONFIDENCE = 0.95
+SEED = 0
+
+# Resampling matrices are built CHUNK_CELLS cells (resamples x distinct items) at a time,
+# so memory stays bounded however many resamples are asked for
+CHUNK_CELLS = 1 << 24
+
+# Item-level statistics: name -> (framed flag, baseline flag). Effects are paired differences
+# (framed - baseline) and get a permutation test; plain rates (baseline None) only a CI.
+STATISTICS = {
+    "positive_bias_effect": ("agreed_positive", "agreed_neutral"),
+    "negative_bias_effect": ("agreed_negative", "agreed_neutral"),
+    "flip_rate_positive": ("flipped_positive", None),
+    "flip_rate_negative": ("flipped_negative", None),
+    "backfire_rate_positive": ("backfire_positive", None),
+    "backfire_rate_negative": ("backfire_negative", None),
+}
+FLAG_COLUMNS = sorted({c for pair in STATISTICS.values() for c in pair if c})
+
+
+def item_values(df):
+    """(items x statistics) float matrix: paired differences for effects, 0/1 for rates."""
+    columns = []
+    for framed, baseline in STATISTICS.values():
+        values = df[framed].to_numpy(dtype=np.float64)
+        if baseline:
+            values = values - df[baseline].to_numpy(dtype=np.float64)
+        columns.append(values)
+    return np.column_stack(columns)
+
+
+def item_means(df):
+    """
+    (items x statistics) per-item means over the runs. Repeats of an item are not independent
+    (same prompt, often the same answer), so the item is the resampling unit: a CI over these
+    narrows with more repeats only as far as the answers actually vary between them.
+    """
+    values = pd.DataFrame(item_values(df), columns=list(STATISTICS))
+    return values.groupby(df["id"].to_numpy(), sort=False).mean()
+
+
+def _chunks(n_resamples, width):
+    rows = max(1, CHUNK_CELLS // max(width, 1))
+    for start in range(0, n_resamples, rows):
+        yield min(rows, n_resamples - start)
+
+
+def _patterns(values):
+    """
+    Distinct item rows and how many items share each. Agreement flags take only a few
+    combinations, so resampling these counts instead of items is exact and much cheaper.
+    """
+    patterns, counts = np.unique(np.asarray(values, dtype=np.float64), axis=0, return_counts=True)
+    return patterns, counts
+
+
+def bootstrap_means(values, n_resamples=N_RESAMPLES, seed=SEED):
+    """
+    Bootstrap distribution of the column means of values (items x statistics).
+
+    Resampling n items with replacement is the same as drawing multinomial counts over the
+    distinct item rows, so each chunk draws a (resamples x patterns) count matrix and gets
+    every resample mean of every statistic with a single matrix product.
+    """
+    rng = np.random.default_rng(seed)
+    patterns, counts = _patterns(values)
+    n_items = counts.sum()
+    means = []
+    for rows in _chunks(n_resamples, len(patterns)):
+        draws = rng.multinomial(n_items, counts / n_items, size=rows)
+        means.append(draws @ patterns / n_items)
+    return np.concatenate(means)
+
+
+def bootstrap_ci(values, n_resamples=N_RESAMPLES, confidence=CONFIDENCE, seed=SEED):
+    """Percentile bootstrap interval for each column mean: (low, high) arrays."""
+    alpha = (1 - confidence) / 2
+    means = bootstrap_means(values, n_resamples, seed)
+    return np.quantile(means, alpha, axis=0), np.quantile(means, 1 - alpha, axis=0)
+
+
+def paired_permutation_test(differences, n_resamples=N_RESAMPLES, seed=SEED):
+    """
+    Two-sided sign-flip test of mean(differences) == 0 for each column of paired differences.
+
+    Under the null, framed and baseline answers of an item are exchangeable, so each difference
+    keeps or flips its sign at random. For c items sharing a difference row the signs sum to
+    2 * Binomial(c, 1/2) - c, so one binomial draw per distinct row replaces c coin flips.
+    """
+    differences = np.asarray(differences, dtype=np.float64)
+    if differences.ndim == 1:
+        differences = differences[:, None]
+    if len(differences) == 0:
+        return np.ones(differences.shape[1])
+    observed = np.abs(differences.sum(axis=0))
+
+    # All-zero rows cannot change the statistic
+    patterns, counts = _patterns(differences[np.any(differences != 0, axis=1)])
+    rng = np.random.default_rng(seed)
+    extreme = np.zeros(differences.shape[1])
+    for rows in _chunks(n_resamples, len(patterns)):
+        sign_sums = 2 * rng.binomial(counts, 0.5, size=(rows, len(counts))) - counts
+        # Small tolerance so ties with the observed statistic count as extreme
+        extreme += (np.abs(sign_sums @ patterns) >= observed - 1e-9).sum(axis=0)
+    return (extreme + 1) / (n_resamples + 1)
+
+
+def effect_table(df, by=("model",), n_resamples=N_RESAMPLES, confidence=CONFIDENCE, seed=SEED):
+    """
+    One row per group and statistic: estimate, bootstrap CI and (for effects) permutation p-value,
+    all in percentage points. Rows are first averaged per item over the runs (item_means), and
+    items are resampled and sign-flipped, not item x run rows.
+    """
+    effects = [name for name, (_, baseline) in STATISTICS.items() if baseline]
+    effect_columns = [list(STATISTICS).index(name) for name in effects]
+
+    rows = []
+    for keys, group in df.groupby(list(by), sort=False, observed=True):
+        keys = keys if isinstance(keys, tuple) else (keys,)
+        values = item_means(group).to_numpy()
+        low, high = bootstrap_ci(values, n_resamples, confidence, seed)
+        p_values = dict(zip(effects, paired_permutation_test(values[:, effect_columns], n_resamples, seed)))
+        for i, name in enumerate(STATISTICS):
+            rows.append({
+                **dict(zip(by, keys)),
+                "statistic": name,
+                "items": len(values),
+                "estimate": values[:, i].mean() * 100,
+                "ci_low": low[i] * 100,
+                "ci_high": high[i] * 100,
+                "p_value": p_values.get(name, np.nan),
+            })
+    return pd.DataFrame(rows)
+
+
+def load_results(patterns, models=None):
+    """Per-row results of every run matching patterns (CSV or Parquet), tagged with the run and item id."""
+    frames = []
+    for pattern in patterns:
+        for run_dir in sorted(glob.glob(pattern)):
+            path = os.path.join(run_dir, RESULTS_CSV)
+            if not results_exist(path):
+                continue
+            df = read_results(path, columns=["id", "model", *FLAG_COLUMNS], filters={"model": models})
+            frames.append(df.astype({"model": str}).assign(run=os.path.basename(os.path.normpath(run_dir))))
+    if not frames:
+        return None
+    return pd.concat(frames, ignore_index=True)
+
+
+def print_table(table, by):
+    print(f"\n=== BIAS STATISTICS ({CONFIDENCE:.0%} bootstrap CI, paired permutation p) ===")
+    for keys, group in table.groupby(list(by), sort=False):
+        keys = keys if isinstance(keys, tuple) else (keys,)
+        print(f"\n{'  '.join(f'{k}: {v}' for k, v in zip(by, keys))}  ({group['items'].iloc[0]} items)")
+        for _, row in group.iterrows():
+            p = "" if np.isnan(row["p_value"]) else f"  p={row['p_value']:.4f}"
+            print(f"  {row['statistic']:<24} {row['estimate']:+6.1f}%  [{row['ci_low']:+6.1f}, {row['ci_high']:+6.1f}]{p}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bootstrap CIs and permutation tests for agreement bias effects.")
+    parser.add_argument("--runs", nargs="+", default=["results/subjective*"],
+                        help=f"run directories or glob patterns containing {RESULTS_CSV} (or its Parquet dataset)")
+    parser.add_argument("--models", nargs="+", help="only these models")
+    parser.add_argument("--by", nargs="+", default=["model"], choices=["model", "run"],
+                        help="group statistics by model (pooling runs) and/or run")
+    parser.add_argument("--resamples", type=int, default=N_RESAMPLES)
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--out", default=OUTPUT_CSV)
+    args = parser.parse_args()
+
+    df = load_results(args.runs, args.models)
+    if df is None:
+        print(f"Error: Could not find {RESULTS_CSV} in {args.runs}")
+    else:
+        table = effect_table(df, args.by, args.resamples, seed=args.seed)
+        table.to_csv(args.out, index=False)
+        print_table(table, args.by)
+        print(f"\nStatistics saved to {args.out}")
@@ -0,0 +1,115 @@
+import os
+import shutil
+
+import pandas as pd                 #type: ignore
+
+# --- CONFIGURATION ---
+# Output formats understood by the evaluators and the summariser
+FORMATS = ["csv", "parquet"]
+
+# Label columns stored as categoricals (dictionary-encoded in Parquet)
+CATEGORY_COLUMNS = [
+    "model", "target_stance", "category",
+    "neutral_response", "positive_response", "negative_response", "framed_response",
+]
+
+
+def _pyarrow():
+    """pyarrow is only needed for --format parquet, so it is imported on first use."""
+    try:
+        import pyarrow as pa                # type: ignore
+        import pyarrow.dataset as ds        # type: ignore
+        import pyarrow.parquet as pq        # type: ignore
+    except ImportError:
+        raise SystemExit("Error: --format parquet needs pyarrow (pip install pyarrow)")
+    return pa, ds, pq
+
+
+def dataset_path_for(csv_path):
+    """agreement_bias_results_summary.csv -> agreement_bias_results_summary.parquet (a directory)"""
+    root, _ = os.path.splitext(csv_path)
+    return f"{root}.parquet"
+
+
+def results_exist(csv_path):
+    return os.path.exists(csv_path) or os.path.exists(dataset_path_for(csv_path))
+
+
+def typed(df):
+    """Label columns as categoricals, flag columns as real booleans."""
+    df = df.copy()
+    for column in df.columns:
+        if column in CATEGORY_COLUMNS:
+            df[column] = df[column].astype("category")
+        elif column.startswith(("agreed_", "flipped_", "backfire_", "truthful_")):
+            df[column] = df[column].astype(bool)
+    return df
+
+
+def clear_dataset(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def write_partitioned(df, path, partition_cols=("model",), part=0):
+    """
+    Appends df to a hive-partitioned Parquet dataset (path/model=gpt-4o/part-0-0.parquet).
+    Each call writes new files named after `part`, so chunks can be added one at a time.
+    """
+    pa, _, pq = _pyarrow()
+    table = pa.Table.from_pandas(typed(df), preserve_index=False)
+    pq.write_to_dataset(
+        table, path,
+        partition_cols=list(partition_cols),
+        basename_template=f"part-{part}-{{i}}.parquet",
+        existing_data_behavior="overwrite_or_ignore",
+    )
+
+
+def write_table(df, path):
+    """Small tables (summaries) go to a single Parquet file."""
+    pa, _, pq = _pyarrow()
+    pq.write_table(pa.Table.from_pandas(typed(df), preserve_index=False), path)
+
+
+def _filter_expression(ds, filters):
+    expression = None
+    for column, values in (filters or {}).items():
+        if values is None:
+            continue
+        term = ds.field(column).isin(list(values))
+        expression = term if expression is None else expression & term
+    return expression
+
+
+def read_dataset(path, columns=None, filters=None):
+    """
+    Reads a Parquet file or partitioned dataset into a DataFrame.
+
+    Only `columns` are decoded, and `filters` ({"model": [...], "target_stance": [...]})
+    are pushed down: partitions of other models are never opened and row groups are
+    skipped from their statistics.
+    """
+    _, ds, _ = _pyarrow()
+    dataset = ds.dataset(path, format="parquet", partitioning="hive")
+    table = dataset.to_table(columns=columns, filter=_filter_expression(ds, filters))
+    return table.to_pandas()
+
+
+def read_results(csv_path, columns=None, filters=None):
+    """
+    Per-row or summary results from whichever format was written last: the Parquet
+    dataset next to csv_path or the CSV itself. Filters apply to both.
+    """
+    parquet_path = dataset_path_for(csv_path)
+    if os.path.exists(parquet_path) and (not os.path.exists(csv_path) or
+                                         os.path.getmtime(parquet_path) >= os.path.getmtime(csv_path)):
+        return read_dataset(parquet_path, columns, filters)
+
+    df = pd.read_csv(csv_path, usecols=columns)
+    for column, values in (filters or {}).items():
+        if values is not None:
+            df = df[df[column].isin(list(values))]
+    return df
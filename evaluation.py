@@ -0,0 +1,104 @@
+import argparse
+import glob
+import os
+from collections import Counter
+import pandas as pd                 #type: ignore
+from columnar import FORMATS, clear_dataset, dataset_path_for, write_partitioned
+
+# --- CONFIGURATION ---
+# Rows scored per vectorised pass; bounds memory on very large runs
+CHUNK_ROWS = 200_000
+
+
+def find_runs(patterns, input_file):
+    """Expands run directories / glob patterns to the directories that contain input_file."""
+    run_dirs = []
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern)):
+            if os.path.isfile(os.path.join(path, input_file)) and path not in run_dirs:
+                run_dirs.append(path)
+    return run_dirs
+
+
+def iter_chunks(rows, columns, chunk_rows=CHUNK_ROWS):
+    """Groups a row stream into DataFrames of at most chunk_rows rows (spanning runs)."""
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_rows:
+            yield pd.DataFrame(chunk, columns=columns)
+            chunk = []
+    if chunk:
+        yield pd.DataFrame(chunk, columns=columns)
+
+
+def write_results(chunks, score, count, output_csv, output_columns, output_format="csv", missing=None):
+    """
+    Scores the runs chunk by chunk and appends each run's rows to <run>/<output_csv> (or its
+    Parquet dataset), so memory stays flat however many items and runs there are.
+
+    `score(df)` adds the flags, `count(scored)` returns per (run, model) counts that are summed
+    over the chunks, and `output_columns(run_df)` picks a run's columns from its first chunk.
+    `missing` counts the rows the evaluator's row stream left out per run. Returns the summed
+    counts, or None if there was nothing to score.
+    """
+    written = {}
+    counts = []
+    total_rows = 0
+    for chunk_no, chunk in enumerate(chunks):
+        scored = score(chunk)
+        total_rows += len(scored)
+        for run_dir, run_df in scored.groupby("run", sort=False):
+            # Save detailed row-by-row results next to each run's responses
+            path = os.path.join(run_dir, output_csv)
+            first = run_dir not in written
+            if first:
+                written[run_dir] = output_columns(run_df)
+            columns = written[run_dir]
+            if output_format == "parquet":
+                # Typed columns, one partition per model: run_dir/<name>.parquet/model=<model>/
+                if first:
+                    clear_dataset(dataset_path_for(path))
+                write_partitioned(run_df[columns], dataset_path_for(path), part=chunk_no)
+            else:
+                run_df[columns].to_csv(path, mode='w' if first else 'a', header=first, index=False)
+        counts.append(count(scored))
+
+    for run_dir, count_missing in (missing or Counter()).items():
+        print(f"Warning: skipped {count_missing} rows of {run_dir} with failed requests "
+              f"(see its dead-letter file; the generators' --replay-dead-letters sends them again)")
+    if not counts:
+        return None
+    print(f"Scored {total_rows} rows from {len(written)} run(s).")
+    for run_dir in written:
+        path = os.path.join(run_dir, output_csv)
+        print(f"Detailed results saved to {dataset_path_for(path) if output_format == 'parquet' else path}")
+    return pd.concat(counts).groupby(level=["run", "model"], sort=False).sum()
+
+
+def run_cli(description, input_file, example_pattern, main):
+    """
+    Command line shared by the evaluators: finds the --runs (or reads them from a run store)
+    and calls main(run_dirs, output_format, store).
+    """
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--runs", nargs="+", default=["."],
+                        help=f"run directories or glob patterns (e.g. '{example_pattern}') containing {input_file}")
+    parser.add_argument("--format", choices=FORMATS, default="csv",
+                        help="per-row results as CSV, or as a Parquet dataset partitioned by model (needs pyarrow)")
+    parser.add_argument("--store", nargs="?", const=True, metavar="DIR",
+                        help="read the --runs (run names or patterns) from a run store (run_store.py, default "
+                             "results/store) instead of responses files; results go to results/<run>/")
+    args = parser.parse_args()
+
+    store = None
+    if args.store:
+        from run_store import STORE_DIR, RunStore
+        store = RunStore(STORE_DIR if args.store is True else args.store)
+        run_dirs = store.run_dirs(args.runs)
+    else:
+        run_dirs = find_runs(args.runs, input_file)
+    if not run_dirs:
+        print(f"Error: Could not find {input_file} in {args.runs}")
+    else:
+        main(run_dirs, args.format, store)
@@ -1,19 +1,40 @@
+import argparse
 import json
 import os
 import asyncio
+from functools import partial
 from tqdm import tqdm
-from dotenv import load_dotenv          # type: ignore
-from openai import AsyncOpenAI          # type: ignore
-from anthropic import AsyncAnthropic    # type: ignore
-from groq import AsyncGroq              # type: ignore
+from scheduler import build_jobs, concurrency_limits, run_jobs
+from providers import (LOGPROB_MAX_TOKENS, PROVIDER_ENV_VAR, Completion, choice_label, close_providers, get_provider,
+                       provider_for, select_models)
+from rate_limiter import RateLimiter, estimate_tokens
+from response_cache import CACHE_FILE, ResponseCache
+from journal import Journal, compact_journal, completed_keys, journal_path_for, usage_fields
+from batch import batch_state_path_for, run_batches
+from prompts import load_dataset
+from telemetry import Telemetry, note, print_summary, telemetry_path_for
+from response_classifier import stream_decision
+from retry import UNKNOWN, DeadLetters, Failure, RequestFailed, dead_letters_path_for, split_dead_letters
 
-# Load environment variables
-load_dotenv()
+# Load environment variables from .env (optional: keys can also be set in the environment)
+try:
+    from dotenv import load_dotenv      # type: ignore
+    load_dotenv()
+except ImportError:
+    pass
 
 # --- CONFIGURATION ---
 # Make sure this matches the filename output by your builder script
 INPUT_FILE = "agreement_bias_subjective_dataset_triplets.json"
 OUTPUT_FILE = "raw_model_responses_triplets.json"
+# Append-only log of every completed request; OUTPUT_FILE is rebuilt from it at the end
+JOURNAL_FILE = journal_path_for(OUTPUT_FILE)
+# Per-call latency, token usage and errors (see telemetry.py)
+TELEMETRY_FILE = telemetry_path_for(OUTPUT_FILE)
+# Requests that failed for good (after retries); replay them with --replay-dead-letters
+DEAD_LETTER_FILE = dead_letters_path_for(OUTPUT_FILE)
+# Batches submitted in --batch mode, so a resumed run can collect them instead of resubmitting
+BATCH_STATE_FILE = batch_state_path_for(OUTPUT_FILE)
 
 # --- MODEL CONFIGURATIONS ---
 MODELS = {
@@ -27,108 +48,258 @@ MODELS = {
     "llama-3-70b": "llama-3.3-70b-versatile" 
 }
 
-# --- CLIENT INITIALIZATION ---
-# Ensure you have OPENAI_API_KEY, ANTHROPIC_API_KEY, and GROQ_API_KEY in your .env file
-try:
-    openai_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-    anthropic_client = AsyncAnthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
-    groq_client = AsyncGroq(api_key=os.getenv("GROQ_API_KEY"))
-except Exception as e:
-    print(f"Error initializing clients. Missing keys? {e}")
+# --- PROMPT VARIANTS ---
+# Sent to every model; responses are stored as "<variant>_response"
+PROMPT_VARIANTS = ["neutral", "framed_positive", "framed_negative"]
+
+# --- THROUGHPUT ---
+# Requests in flight per provider (see scheduler.DEFAULT_CONCURRENCY for defaults)
+CONCURRENCY = {}
+
+# Requests / tokens per minute per model (see rate_limiter.DEFAULT_LIMITS for defaults).
+# The limiter adapts to the providers' rate-limit headers and backs off on 429s.
+RATE_LIMITS = {
+    "llama-3-70b": {"rpm": 30, "tpm": 6000},
+}
+rate_limiter = RateLimiter(RATE_LIMITS)
+
+# Sampling parameters (part of the response cache key)
+TEMPERATURE = 0.1
+MAX_TOKENS = 300
+
+# --stream: stop reading once the answer names a case, or after this many output tokens
+STREAM_TOKEN_BUDGET = 50
+# Version of the early-stop rule; part of the cache key, since it decides where answers are cut
+STREAM_DECIDE_RULE = "classifier-2"
+
+# --score: instead of generating an answer, read P(Case 1) and P(Case 2) from the token
+# log-probabilities of a greedy answer at most providers.LOGPROB_MAX_TOKENS long
+SCORE_CHOICES = ["Case 1", "Case 2"]
 
-async def query_model(model_family, prompt):
+# Responses already paid for are reused from here (see response_cache.py). Opened in __main__,
+# so importing this module leaves the cache file alone; None sends every request
+response_cache = None
+
+async def unscored_answer(model_family, prompt, item_id):
+    """The full answer to a prompt whose scoring found no case (cached as an ordinary answer)."""
+    print(f"\n[!] {model_family} named no case within {LOGPROB_MAX_TOKENS} tokens for {item_id}; "
+          "generating the full answer unscored")
+    return await query_model(model_family, prompt, item_id)
+
+async def query_model(model_family, prompt, item_id=None, stream=False, score=False):
     """
-    Sends a prompt to the specified model family and returns the text response.
-    Includes basic error handling to prevent the whole script from crashing.
+    Sends a prompt to the specified model family and returns a providers.Completion.
+    Transient errors are retried by the rate limiter; a request that fails for good
+    returns a retry.Failure instead of crashing the whole script.
+    With stream=True the answer is streamed and cut off as soon as it names a case (see
+    response_classifier.stream_decision for when that differs from the full answer's label).
+    With score=True the Completion carries P(Case 1) / P(Case 2) as choice_probs instead. An
+    answer that names neither case within its first LOGPROB_MAX_TOKENS tokens ("I would choose
+    ...") is generated in full instead, for the text classifier, and left unscored.
     """
     if not prompt: 
-        return ""
+        return Completion("", {}, 0, 0)
         
+    # Identical requests for the same item are answered from the on-disk cache (items with
+    # the same prompt are sampled separately).
+    # Streamed answers are truncated, so they are cached separately from full ones.
+    provider = provider_for(model_family)
+    params = {"temperature": TEMPERATURE, "max_tokens": MAX_TOKENS}
+    if stream:
+        params["stream_token_budget"] = STREAM_TOKEN_BUDGET
+        params["stream_decide_rule"] = STREAM_DECIDE_RULE
+    if score:
+        # Scores are cached as their probabilities
+        params = {"score_choices": SCORE_CHOICES, "max_tokens": LOGPROB_MAX_TOKENS}
+    cached = response_cache.get(provider, MODELS[model_family], prompt, params, item_id) if response_cache is not None else None
+    if cached is not None:
+        note(cache_hit=True)
+        if score:
+            probs = json.loads(cached)
+            if not choice_label(probs):
+                return await unscored_answer(model_family, prompt, item_id)
+            return Completion(choice_label(probs), {}, None, None, choice_probs=probs)
+        return Completion(cached, {}, None, None)
+
+    # The adapter owns the pooled client for its API (see providers.py)
+    adapter = get_provider(provider)
+    if stream:
+        send = lambda: adapter.stream_complete(
+            MODELS[model_family], prompt, TEMPERATURE, MAX_TOKENS,
+            decide=stream_decision, token_budget=STREAM_TOKEN_BUDGET
+        )
+        budget = STREAM_TOKEN_BUDGET
+    elif score:
+        send = lambda: adapter.score_choices(MODELS[model_family], prompt, SCORE_CHOICES, LOGPROB_MAX_TOKENS)
+        budget = LOGPROB_MAX_TOKENS
+    else:
+        send = lambda: adapter.complete(MODELS[model_family], prompt, TEMPERATURE, MAX_TOKENS)
+        budget = MAX_TOKENS
+
     try:
-        if "gpt" in model_family:
-            response = await openai_client.chat.completions.create(
-                model=MODELS[model_family],
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.1, # Low temp for reproducibility
-                max_tokens=300
-            )
-            return response.choices[0].message.content
-            
-        elif "claude" in model_family:
-            response = await anthropic_client.messages.create(
-                model=MODELS[model_family],
-                max_tokens=300,
-                temperature=0.1,
-                messages=[{"role": "user", "content": prompt}]
-            )
-            return response.content[0].text
-            
-        elif "llama" in model_family:
-            response = await groq_client.chat.completions.create(
-                model=MODELS[model_family],
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.1,
-                max_tokens=300
-            )
-            return response.choices[0].message.content
-            
-    except Exception as e:
+        completion = await rate_limiter.run(model_family, estimate_tokens(prompt, budget), send)
+    except RequestFailed as e:
         print(f"\n[!] Error calling {model_family}: {e}")
-        return None
+        return e.failure
+    if score and not choice_label(completion.choice_probs):
+        return await unscored_answer(model_family, prompt, item_id)
 
-async def main():
+    if response_cache is not None:
+        response_cache.put(provider, MODELS[model_family], prompt, params,
+                           json.dumps(completion.choice_probs) if score else completion.text, item_id)
+    return completion
+
+async def main(resume=False, batch=False, stream=False, replay=None, score=False):
     # 1. Load Data
     if not os.path.exists(INPUT_FILE):
         print(f"Error: Could not find {INPUT_FILE}. Did you run the builder script?")
         return
 
-    with open(INPUT_FILE, 'r') as f:
-        dataset = json.load(f)
+    # JSON array or JSONL (e.g. one shard of a larger dataset); prompts keep their shared prefix
+    # separate so providers can cache it
+    dataset = load_dataset(INPUT_FILE)
 
-    results = []
     print(f"Starting evaluation on {len(dataset)} items...")
     print(f"Models: {list(MODELS.keys())}")
 
+    # Scoring needs every model's API to return token log-probabilities
+    if score:
+        unsupported = [m for m in MODELS if not get_provider(provider_for(m)).supports_logprobs]
+        if unsupported:
+            print(f"Error: --score needs token log-probabilities, which the APIs of {unsupported} do not return")
+            return
+
     # 2. Processing Loop
-    for item in tqdm(dataset):
-        item_result = item.copy() 
-        item_result["responses"] = {}
-        
-        # We will collect tasks for all models and all 3 prompt types here
-        tasks = []
-        model_keys = list(MODELS.keys())
-        
-        # Create Async Tasks
-        for model_key in model_keys:
-            prompts = item["prompts"]
-            # Append 3 tasks per model (Neutral, Positive, Negative)
-            tasks.append(query_model(model_key, prompts["neutral"]))
-            tasks.append(query_model(model_key, prompts["framed_positive"]))
-            tasks.append(query_model(model_key, prompts["framed_negative"]))
-        
-        # Run all tasks in parallel for this item
-        # Total tasks = (Num Models) * 3
-        responses = await asyncio.gather(*tasks)
-        
-        # 3. Map Results Back
-        # We must unpack in the exact same order we appended them
-        idx = 0
-        for model_key in model_keys:
-            item_result["responses"][model_key] = {
-                "neutral_response": responses[idx],
-                "framed_positive_response": responses[idx+1],
-                "framed_negative_response": responses[idx+2]
-            }
-            idx += 3 # Move index forward by 3 for the next model
-            
-        results.append(item_result)
-
-        # 4. Save Incrementally (Overwrite file after every item)
-        # This prevents total data loss if the script crashes halfway
-        with open(OUTPUT_FILE, 'w') as f:
-            json.dump(results, f, indent=2)
+    # Every (item, model, prompt variant) becomes one job in a shared queue.
+    # Each provider keeps its own number of requests in flight, so one slow API
+    # no longer stalls the others.
+    model_keys = list(MODELS.keys())
+    jobs = build_jobs(dataset, model_keys, PROMPT_VARIANTS)
+
+    def key(job):
+        return dataset[job.item_index]["id"], job.model_key, job.variant
+
+    # On resume, skip every (id, model, variant) that already has a response in the journal
+    if resume:
+        done = completed_keys(JOURNAL_FILE)
+        jobs = [job for job in jobs if key(job) not in done]
+        print(f"Resuming: {len(done)} responses already in {JOURNAL_FILE}, {len(jobs)} left to query")
+
+    # Replaying only sends the dead-lettered requests (of the chosen error classes) again
+    kept_failures = []
+    if replay is not None:
+        replay_keys, kept_failures = split_dead_letters(DEAD_LETTER_FILE, replay)
+        jobs = [job for job in jobs if key(job) in replay_keys]
+        print(f"Replaying {len(jobs)} failed requests from {DEAD_LETTER_FILE}")
+
+    journal = Journal(JOURNAL_FILE, resume=resume or replay is not None)
+    telemetry = Telemetry(TELEMETRY_FILE, MODELS, resume=resume or replay is not None)
+    dead_letters = DeadLetters(DEAD_LETTER_FILE, keep=kept_failures)
+    progress = tqdm(total=len(jobs))
+
+    def on_result(job, completion):
+        # 3. Record Results
+        # Each finished request is appended to the journal as soon as it arrives,
+        # so a crash only loses the requests that were still in flight.
+        # Failed calls go to the dead letters instead, so --resume or --replay-dead-letters
+        # retries them. Token usage is recorded too (run_store.py keeps it with the responses),
+        # streamed calls also record time to first token and time to decision, and scored
+        # calls the probability of each case.
+        if isinstance(completion, Completion):
+            extra = {"probs": completion.choice_probs} if completion.choice_probs is not None else {}
+            journal.write(*key(job), completion.text, **usage_fields(completion), **(completion.timings or {}),
+                          **extra)
+        else:
+            # Failed batch requests come back as None
+            dead_letters.write(*key(job), completion or Failure(UNKNOWN, "no result", 1))
+        if batch:
+            # Interactive calls are recorded by the scheduler
+            telemetry.record_batch_result(job, provider_for(job.model_key), completion)
+        progress.update(1)
 
+    # One pooled client per provider, sized to the number of requests kept in flight
+    limits = concurrency_limits(CONCURRENCY)
+    for model_key in model_keys:
+        provider = provider_for(model_key)
+        get_provider(provider, pool_size=limits.get(provider, 1))
+
+    try:
+        if batch:
+            # Asynchronous batch jobs: no interactive latency, lower cost, no rate-limit pressure
+            params = {"temperature": TEMPERATURE, "max_tokens": MAX_TOKENS}
+            await run_batches(jobs, dataset, MODELS, params, on_result, BATCH_STATE_FILE,
+                              resume=resume, cache=response_cache)
+        else:
+            await run_jobs(jobs, partial(query_model, stream=stream, score=score), on_result, CONCURRENCY, telemetry)
+    finally:
+        progress.close()
+        journal.close()
+        dead_letters.close()
+        await close_providers()
+        print_summary(telemetry.close())
+    if dead_letters.count:
+        print(f"\n[!] {dead_letters.count} requests failed for good, see {DEAD_LETTER_FILE} "
+              f"(send them again with --replay-dead-letters)")
+
+    # 4. Compact the journal into the usual item-per-entry layout for the evaluator
+    compact_journal(JOURNAL_FILE, dataset, model_keys, PROMPT_VARIANTS, OUTPUT_FILE)
     print(f"\nSuccess! Saved responses to {OUTPUT_FILE}")
 
+
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Query all models with the subjective triplet dataset.")
+    parser.add_argument("--resume", action="store_true",
+                        help=f"continue from {JOURNAL_FILE} and only send the missing requests")
+    parser.add_argument("--sample", type=int, default=0,
+                        help="repeat-run number; each sample has its own cached responses")
+    parser.add_argument("--bypass-cache", action="store_true",
+                        help="always query the APIs for a fresh sample (new responses still refresh the cache)")
+    parser.add_argument("--batch", action="store_true",
+                        help="submit all prompts through the providers' batch APIs and wait for the results")
+    parser.add_argument("--stream", action="store_true",
+                        help="stream answers and stop as soon as they name a case (records TTFT / time to decision)")
+    parser.add_argument("--score", action="store_true",
+                        help="store P(Case 1) / P(Case 2) from token log-probabilities instead of generating "
+                             f"answers (at most {LOGPROB_MAX_TOKENS} output tokens; OpenAI and mock models)")
+    parser.add_argument("--provider",
+                        help="send every model to this provider instead, e.g. 'mock' for an offline run")
+    parser.add_argument("--input", default=INPUT_FILE,
+                        help="dataset to query, e.g. one JSONL shard written by setup/convert_scenario_csv.py --shard-size")
+    parser.add_argument("--output", default=OUTPUT_FILE,
+                        help="responses file (its journal and batch state files are named after it)")
+    parser.add_argument("--models", nargs="+", metavar="MODEL",
+                        help="query only these MODELS keys (KEY=MODEL_ID adds a model that is not listed)")
+    parser.add_argument("--temperature", type=float, default=TEMPERATURE)
+    parser.add_argument("--max-tokens", type=int, default=MAX_TOKENS)
+    parser.add_argument("--replay-dead-letters", nargs="*", metavar="ERROR_CLASS",
+                        help="only send the requests in the dead-letter file again (optionally just these "
+                             "error classes, e.g. timeout server_error)")
+    args = parser.parse_args()
+    if args.score and (args.batch or args.stream):
+        parser.error("--score cannot be combined with --batch or --stream")
+    if args.batch and args.stream:
+        parser.error("--stream cannot be combined with --batch (batch APIs do not stream)")
+
+    # One shard per process: each gets its own output, journal and batch state
+    INPUT_FILE = args.input
+    OUTPUT_FILE = args.output
+    JOURNAL_FILE = journal_path_for(OUTPUT_FILE)
+    TELEMETRY_FILE = telemetry_path_for(OUTPUT_FILE)
+    DEAD_LETTER_FILE = dead_letters_path_for(OUTPUT_FILE)
+    BATCH_STATE_FILE = batch_state_path_for(OUTPUT_FILE)
+    if args.models:
+        MODELS = select_models(args.models, MODELS)
+    TEMPERATURE = args.temperature
+    MAX_TOKENS = args.max_tokens
+
+    if args.provider:
+        os.environ[PROVIDER_ENV_VAR] = args.provider
+    response_cache = ResponseCache(CACHE_FILE)
+    response_cache.sample = args.sample
+    response_cache.bypass = args.bypass_cache
+    try:
+        asyncio.run(main(resume=args.resume, batch=args.batch, stream=args.stream, replay=args.replay_dead_letters,
+                         score=args.score))
+    finally:
+        print(f"Response cache: {response_cache.hits} hits, {response_cache.misses} misses")
+        response_cache.close()
\ No newline at end of file
@@ -1,23 +1,34 @@
-from dotenv import load_dotenv          # type: ignore
-load_dotenv()
-
-import json
+# Load environment variables from .env (optional: keys can also be set in the environment)
+try:
+    from dotenv import load_dotenv      # type: ignore
+    load_dotenv()
+except ImportError:
+    pass
+
+import argparse
 import os
 import asyncio
 from tqdm import tqdm
-from openai import AsyncOpenAI          # type: ignore
-from anthropic import AsyncAnthropic    # type: ignore
-from groq import AsyncGroq              # type: ignore
-
-# Load API Keys (ensure these are in your environment variables)
-openai_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-anthropic_client = AsyncAnthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
-# Llama 3 via Hugging Face (requires a Pro account or dedicated endpoint usually, 
-# or use a provider like Groq/Together if you have those keys)
-groq_client = AsyncGroq(api_key=os.getenv("GROQ_API_KEY"))
+from scheduler import build_jobs, concurrency_limits, run_jobs
+from providers import PROVIDER_ENV_VAR, Completion, close_providers, get_provider, provider_for, select_models
+from rate_limiter import RateLimiter, estimate_tokens
+from response_cache import CACHE_FILE, ResponseCache
+from journal import Journal, compact_journal, completed_keys, journal_path_for, usage_fields
+from batch import batch_state_path_for, run_batches
+from prompts import load_dataset
+from telemetry import Telemetry, note, print_summary, telemetry_path_for
+from retry import UNKNOWN, DeadLetters, Failure, RequestFailed, dead_letters_path_for, split_dead_letters
 
 INPUT_FILE = "agreement_bias_objective_dataset_v2.json"
 OUTPUT_FILE = "raw_model_responses.json"
+# Append-only log of every completed request; OUTPUT_FILE is rebuilt from it at the end
+JOURNAL_FILE = journal_path_for(OUTPUT_FILE)
+# Per-call latency, token usage and errors (see telemetry.py)
+TELEMETRY_FILE = telemetry_path_for(OUTPUT_FILE)
+# Requests that failed for good (after retries); replay them with --replay-dead-letters
+DEAD_LETTER_FILE = dead_letters_path_for(OUTPUT_FILE)
+# Batches submitted in --batch mode, so a resumed run can collect them instead of resubmitting
+BATCH_STATE_FILE = batch_state_path_for(OUTPUT_FILE)
 
 # Model Configurations (As per your paper Section 3.4)
 MODELS = {
@@ -30,87 +41,169 @@ MODELS = {
     # Llama 3.3 (via Groq): 70B Model
     "llama-3-70b": "llama-3.3-70b-versatile" 
 }
-async def query_model(model_family, prompt):
-    """Generic wrapper to call different model APIs"""
+
+# Prompt variants sent to every model; responses are stored as "<variant>_response"
+PROMPT_VARIANTS = ["neutral", "framed"]
+
+# Requests in flight per provider (see scheduler.DEFAULT_CONCURRENCY for defaults).
+CONCURRENCY = {}
+
+# Requests / tokens per minute per model (see rate_limiter.DEFAULT_LIMITS for defaults).
+# The limiter adapts to the providers' rate-limit headers and backs off on 429s,
+# so this replaces the old sleep for the llama free tier.
+RATE_LIMITS = {
+    "llama-3-70b": {"rpm": 30, "tpm": 6000},
+}
+rate_limiter = RateLimiter(RATE_LIMITS)
+
+# Sampling parameters (part of the response cache key)
+TEMPERATURE = 0.1
+MAX_TOKENS = 300
+
+# Responses already paid for are reused from here (see response_cache.py). Opened in __main__,
+# so importing this module leaves the cache file alone; None sends every request
+response_cache = None
+
+async def query_model(model_family, prompt, item_id=None):
+    """Generic wrapper to call different model APIs; returns a providers.Completion or, if it failed for good, a retry.Failure"""
+    # Identical requests for the same item are answered from the on-disk cache
+    provider = provider_for(model_family)
+    params = {"temperature": TEMPERATURE, "max_tokens": MAX_TOKENS}
+    cached = response_cache.get(provider, MODELS[model_family], prompt, params, item_id) if response_cache is not None else None
+    if cached is not None:
+        note(cache_hit=True)
+        return Completion(cached, {}, None, None)
+
+    # The adapter owns the pooled client for its API (see providers.py)
+    adapter = get_provider(provider)
     try:
-        if "gpt" in model_family:
-            response = await openai_client.chat.completions.create(
-                model=MODELS[model_family],
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.1, # Low temp as per Sec 3.4
-                max_tokens=300
-            )
-            return response.choices[0].message.content
-            
-        elif "claude" in model_family:
-            response = await anthropic_client.messages.create(
-                model=MODELS[model_family],
-                max_tokens=300,
-                temperature=0.1,
-                messages=[{"role": "user", "content": prompt}]
-            )
-            return response.content[0].text
-            
-        elif "llama" in model_family:
-            response = await groq_client.chat.completions.create(
-                model=MODELS[model_family],
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.1,
-                max_tokens=300
-            )
-            return response.choices[0].message.content
-
-    except Exception as e:
+        completion = await rate_limiter.run(
+            model_family,
+            estimate_tokens(prompt, MAX_TOKENS),
+            lambda: adapter.complete(MODELS[model_family], prompt, TEMPERATURE, MAX_TOKENS)
+        )
+    except RequestFailed as e:
         print(f"Error calling {model_family}: {e}")
-        return None
+        return e.failure
 
-async def main():
-    with open(INPUT_FILE, 'r') as f:
-        dataset = json.load(f)
+    if response_cache is not None:
+        response_cache.put(provider, MODELS[model_family], prompt, params, completion.text, item_id)
+    return completion
 
-    results = []
+async def main(resume=False, batch=False, replay=None):
+    # JSON array or JSONL (e.g. one shard of a larger dataset); prompts keep their shared prefix
+    # separate so providers can cache it
+    dataset = load_dataset(INPUT_FILE)
 
     print(f"Starting evaluation on {len(dataset)} items across {len(MODELS)} models...")
 
-    for item in tqdm(dataset):
-        # We process one item at a time, but run all models/prompts concurrently for speed
-        tasks = []
-        
-        # Structure to hold this item's results
-        item_result = item.copy() 
-        item_result["responses"] = {}
-
-        for model_key in MODELS.keys():
-            # 1. Query Neutral
-            tasks.append(query_model(model_key, item["prompts"]["neutral"]))
-            # 2. Query Framed
-            tasks.append(query_model(model_key, item["prompts"]["framed"]))
-        
-        # Wait for all API calls for this item
-        responses = await asyncio.gather(*tasks)
-        
-        # Unpack results
-        # The order matches how we appended tasks: Model A Neutral, Model A Framed, Model B Neutral...
-        idx = 0
-        for model_key in MODELS.keys():
-            item_result["responses"][model_key] = {
-                "neutral_response": responses[idx],
-                "framed_response": responses[idx+1]
-            }
-            idx += 2
-            
-        results.append(item_result)
-
-        #sleep so I don't hit the llama free tier limit
-        #await asyncio.sleep(4)
-
-
-        # Save intermediate results
-        with open(OUTPUT_FILE, 'w') as f:
-            json.dump(results, f, indent=2)
-    print(f"Saved raw responses to {OUTPUT_FILE}")
+    # Every (item, model, prompt variant) becomes one job in a shared queue, so requests
+    # for later items start as soon as a slot for that provider frees up
+    model_keys = list(MODELS.keys())
+    jobs = build_jobs(dataset, model_keys, PROMPT_VARIANTS)
+
+    def key(job):
+        return dataset[job.item_index]["id"], job.model_key, job.variant
+
+    # On resume, only issue the calls that have no response in the journal yet
+    if resume:
+        done = completed_keys(JOURNAL_FILE)
+        jobs = [job for job in jobs if key(job) not in done]
+        print(f"Resuming: {len(done)} responses already in {JOURNAL_FILE}, {len(jobs)} left to query")
+
+    # Replaying only sends the dead-lettered requests (of the chosen error classes) again
+    kept_failures = []
+    if replay is not None:
+        replay_keys, kept_failures = split_dead_letters(DEAD_LETTER_FILE, replay)
+        jobs = [job for job in jobs if key(job) in replay_keys]
+        print(f"Replaying {len(jobs)} failed requests from {DEAD_LETTER_FILE}")
+
+    journal = Journal(JOURNAL_FILE, resume=resume or replay is not None)
+    telemetry = Telemetry(TELEMETRY_FILE, MODELS, resume=resume or replay is not None)
+    dead_letters = DeadLetters(DEAD_LETTER_FILE, keep=kept_failures)
+    progress = tqdm(total=len(jobs))
+
+    def on_result(job, completion):
+        # Failed calls are dead-lettered instead of journaled, so a resume or replay retries them
+        if isinstance(completion, Completion):
+            journal.write(*key(job), completion.text, **usage_fields(completion))
+        else:
+            # Failed batch requests come back as None
+            dead_letters.write(*key(job), completion or Failure(UNKNOWN, "no result", 1))
+        if batch:
+            telemetry.record_batch_result(job, provider_for(job.model_key), completion)
+        progress.update(1)
+
+    # One pooled client per provider, sized to the number of requests kept in flight
+    limits = concurrency_limits(CONCURRENCY)
+    for model_key in model_keys:
+        provider = provider_for(model_key)
+        get_provider(provider, pool_size=limits.get(provider, 1))
 
+    try:
+        if batch:
+            # Asynchronous batch jobs: no interactive latency, lower cost, no rate-limit pressure
+            params = {"temperature": TEMPERATURE, "max_tokens": MAX_TOKENS}
+            await run_batches(jobs, dataset, MODELS, params, on_result, BATCH_STATE_FILE,
+                              resume=resume, cache=response_cache)
+        else:
+            await run_jobs(jobs, query_model, on_result, CONCURRENCY, telemetry)
+    finally:
+        progress.close()
+        journal.close()
+        dead_letters.close()
+        await close_providers()
+        print_summary(telemetry.close())
+    if dead_letters.count:
+        print(f"{dead_letters.count} requests failed for good, see {DEAD_LETTER_FILE} "
+              f"(send them again with --replay-dead-letters)")
+
+    compact_journal(JOURNAL_FILE, dataset, model_keys, PROMPT_VARIANTS, OUTPUT_FILE)
+    print(f"Saved raw responses to {OUTPUT_FILE}")
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Query all models with the objective dataset.")
+    parser.add_argument("--resume", action="store_true",
+                        help=f"continue from {JOURNAL_FILE} and only send the missing requests")
+    parser.add_argument("--sample", type=int, default=0,
+                        help="repeat-run number; each sample has its own cached responses")
+    parser.add_argument("--bypass-cache", action="store_true",
+                        help="always query the APIs for a fresh sample (new responses still refresh the cache)")
+    parser.add_argument("--batch", action="store_true",
+                        help="submit all prompts through the providers' batch APIs and wait for the results")
+    parser.add_argument("--provider",
+                        help="send every model to this provider instead, e.g. 'mock' for an offline run")
+    parser.add_argument("--input", default=INPUT_FILE, help="dataset to query")
+    parser.add_argument("--output", default=OUTPUT_FILE,
+                        help="responses file (its journal, telemetry and batch state files are named after it)")
+    parser.add_argument("--models", nargs="+", metavar="MODEL",
+                        help="query only these MODELS keys (KEY=MODEL_ID adds a model that is not listed)")
+    parser.add_argument("--temperature", type=float, default=TEMPERATURE)
+    parser.add_argument("--max-tokens", type=int, default=MAX_TOKENS)
+    parser.add_argument("--replay-dead-letters", nargs="*", metavar="ERROR_CLASS",
+                        help="only send the requests in the dead-letter file again (optionally just these "
+                             "error classes, e.g. timeout server_error)")
+    args = parser.parse_args()
+
+    INPUT_FILE = args.input
+    OUTPUT_FILE = args.output
+    JOURNAL_FILE = journal_path_for(OUTPUT_FILE)
+    TELEMETRY_FILE = telemetry_path_for(OUTPUT_FILE)
+    DEAD_LETTER_FILE = dead_letters_path_for(OUTPUT_FILE)
+    BATCH_STATE_FILE = batch_state_path_for(OUTPUT_FILE)
+    if args.models:
+        MODELS = select_models(args.models, MODELS)
+    TEMPERATURE = args.temperature
+    MAX_TOKENS = args.max_tokens
+
+    if args.provider:
+        os.environ[PROVIDER_ENV_VAR] = args.provider
+    response_cache = ResponseCache(CACHE_FILE)
+    response_cache.sample = args.sample
+    response_cache.bypass = args.bypass_cache
+    try:
+        asyncio.run(main(resume=args.resume, batch=args.batch, replay=args.replay_dead_letters))
+    finally:
+        print(f"Response cache: {response_cache.hits} hits, {response_cache.misses} misses")
+        response_cache.close()
\ No newline at end of file
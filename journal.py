@@ -0,0 +1,132 @@
+import json
+import os
+import time
+
+from json_stream import ItemWriter
+from prompts import compact_item, save_prefixes
+from scheduler import empty_result
+
+# --- CONFIGURATION ---
+# fsync the journal after this many records or this many seconds, whichever comes first.
+# Every record is still handed to the OS straight away, so only a machine crash can lose
+# the last unsynced batch.
+FSYNC_EVERY = 50
+FSYNC_INTERVAL = 2.0
+
+
+def journal_path_for(output_file):
+    """raw_model_responses.json -> raw_model_responses.journal.jsonl"""
+    root, _ = os.path.splitext(output_file)
+    return f"{root}.journal.jsonl"
+
+
+class Journal:
+    """
+    Append-only log of completed requests, one JSON record per line:
+    {"id": ..., "model": ..., "variant": ..., "response": ...}
+
+    Writing a record costs one line instead of re-serialising the whole result list,
+    and a crash loses at most the requests that were still in flight.
+    """
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.pending = 0
+        self.last_sync = time.monotonic()
+        self.file = open(path, "a" if resume else "w", encoding="utf-8")
+
+        # A crash can leave a half-written last line; start the next record on a fresh one
+        if resume and self.file.tell() > 0:
+            with open(path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    self.file.write("\n")
+
+    def write(self, item_id, model_key, variant, response, **extra):
+        record = {"id": item_id, "model": model_key, "variant": variant, "response": response}
+        record.update(extra)
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.file.flush()
+        self.pending += 1
+        if self.pending >= FSYNC_EVERY or time.monotonic() - self.last_sync >= FSYNC_INTERVAL:
+            self.sync()
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.pending = 0
+        self.last_sync = time.monotonic()
+
+    def close(self):
+        self.sync()
+        self.file.close()
+
+
+def usage_fields(completion):
+    """Token usage of a providers.Completion as journal fields; cache hits carry none."""
+    usage = {
+        "input_tokens": completion.input_tokens,
+        "cached_input_tokens": completion.cached_input_tokens,
+        "output_tokens": completion.output_tokens,
+    }
+    return {field: value for field, value in usage.items() if value is not None}
+
+
+def read_journal(path):
+    """
+    Yields every record in the journal. A truncated final line (crash mid-write) is skipped.
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+
+def completed_keys(path):
+    """Set of (id, model, variant) that already have a response in the journal."""
+    return {(r["id"], r["model"], r["variant"]) for r in read_journal(path)}
+
+
+def compact_journal(path, dataset, model_keys, variants, output_file):
+    """
+    Rebuilds the usual raw_model_responses*.json layout (dataset items with a
+    "responses" block per model) from the journal. Later records win, missing ones stay None.
+    Items are written one at a time, so only the journaled responses are held in memory.
+    Items loaded from a compact dataset are written compact too, with the prefix table saved
+    next to output_file. Scored requests also get their choice probabilities as "<variant>_probs".
+    """
+    responses, probs = {}, {}
+    for record in read_journal(path):
+        if record["model"] in model_keys and record["variant"] in variants:
+            key = (record["id"], record["model"], record["variant"])
+            responses[key] = record["response"]
+            if record.get("probs") is not None:
+                probs[key] = record["probs"]
+            else:
+                probs.pop(key, None)
+
+    # Write to a temp file first so a crash here never leaves a half-written output
+    tmp_file = output_file + ".tmp"
+    prefixes = {}
+    with ItemWriter(tmp_file) as writer:
+        for item in dataset:
+            item_result = empty_result(item, model_keys, variants)
+            for model_key, model_responses in item_result["responses"].items():
+                for variant in variants:
+                    model_responses[f"{variant}_response"] = responses.get((item["id"], model_key, variant))
+                    if (item["id"], model_key, variant) in probs:
+                        model_responses[f"{variant}_probs"] = probs[(item["id"], model_key, variant)]
+            if "prompt_prefix" in item:
+                item_result = compact_item(item_result, prefixes)
+            writer.write(item_result)
+    if prefixes:
+        save_prefixes(output_file, prefixes)
+    os.replace(tmp_file, output_file)
+    return writer.count
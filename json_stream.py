@@ -0,0 +1,93 @@
+import json
+
+# --- CONFIGURATION ---
+# Bytes read from disk at a time while scanning a JSON array
+READ_CHUNK_SIZE = 1 << 16
+
+_decoder = json.JSONDecoder()
+
+
+def is_jsonl(path):
+    return path.endswith((".jsonl", ".ndjson"))
+
+
+def iter_items(path, chunk_size=READ_CHUNK_SIZE):
+    """
+    Yields the records of a dataset / response file one at a time.
+
+    Works on the usual top-level JSON array (raw_model_responses*.json, the datasets)
+    as well as on JSONL with one record per line. Only the record being decoded and
+    one read chunk are held in memory, however large the file is.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        buffer = f.read(chunk_size)
+        start = len(buffer) - len(buffer.lstrip())
+        if buffer[start:start + 1] != "[":
+            # JSONL: one record per line
+            f.seek(0)
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+            return
+
+        buffer = buffer[start + 1:]
+        while True:
+            # Skip separators between records
+            buffer = buffer.lstrip().lstrip(",").lstrip()
+            if buffer.startswith("]"):
+                return
+            try:
+                item, end = _decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                # Record not complete yet: read more and try again
+                more = f.read(chunk_size)
+                if not more:
+                    raise
+                buffer += more
+                continue
+            yield item
+            buffer = buffer[end:]
+
+
+def load_items(path):
+    """All records of a JSON array or JSONL file as a list."""
+    return list(iter_items(path))
+
+
+class ItemWriter:
+    """
+    Writes records one at a time, producing the same file json.dump(items, f, indent=2, ensure_ascii=...)
+    would (or one compact line per record for .jsonl paths) without ever holding the list.
+    """
+
+    def __init__(self, path, indent=2, ensure_ascii=True):
+        self.path = path
+        self.jsonl = is_jsonl(path)
+        self.indent = indent
+        self.ensure_ascii = ensure_ascii
+        self.count = 0
+        self.file = open(path, 'w', encoding='utf-8')
+        if not self.jsonl:
+            self.file.write("[")
+
+    def write(self, item):
+        if self.jsonl:
+            self.file.write(json.dumps(item, ensure_ascii=False) + "\n")
+        else:
+            # Newlines inside strings are escaped, so re-indenting every line is safe
+            pad = " " * self.indent
+            text = json.dumps(item, indent=self.indent, ensure_ascii=self.ensure_ascii)
+            self.file.write(("," if self.count else "") + "\n" + pad + text.replace("\n", "\n" + pad))
+        self.count += 1
+
+    def close(self):
+        if not self.jsonl:
+            self.file.write("\n]" if self.count else "]")
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,330 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+from collections import namedtuple
+
+# Only the standard library is imported here: every stage runs its script in a process of its
+# own, so pandas, seaborn and the provider SDKs are loaded by the stages that use them.
+
+# --- CONFIGURATION ---
+ROOT = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(ROOT, "results")
+# Content hashes of every stage's inputs and outputs from its last successful run
+STATE_FILE = os.path.join(ROOT, ".pipeline_state.json")
+HASH_CHUNK = 1 << 20
+
+# Per dataset: how it is built, generated and evaluated. Paths are relative to ROOT.
+DATASETS = {
+    "subjective": {
+        "build": "setup/convert_scenario_csv.py",
+        "build_args": ["--input", "setup/TableS1.csv"],
+        "build_inputs": ["setup/TableS1.csv", "prompts.py", "json_stream.py"],
+        "dataset": "agreement_bias_subjective_dataset_triplets.json",
+        "generator": "generate_moral_responses.py",
+        "responses": "raw_model_responses_triplets.json",
+        "evaluator": "evaluate_moral_results.py",
+        "results": "agreement_bias_results_summary.csv",
+    },
+    "objective": {
+        "build": "setup/truthful_prompts.py",
+        "build_args": [],
+        "build_inputs": ["truthful_qa_generation_validation.parquet", "json_stream.py"],
+        "dataset": "agreement_bias_objective_dataset_v2.json",
+        "generator": "generate_responses.py",
+        "responses": "raw_model_responses.json",
+        "evaluator": "evaluate_objective_results.py",
+        "results": "objective_bias_results_summary.csv",
+    },
+}
+# Library code the evaluators, summariser and chart run on; a change reruns them
+EVALUATE_CODE = ["response_classifier.py", "columnar.py", "json_stream.py"]
+SUMMARY_CODE = ["results/summarize_moral_results.py", "columnar.py"]
+CHART_CODE = ["results/summary_chart.py", "bias_stats.py", "columnar.py"]
+SUMMARY_OUTPUT = "results/summary_report.csv"
+CHART_OUTPUT = "results/bias_averages_chart.png"
+
+# One step of the pipeline. `inputs` (files or directories, relative to ROOT) and `args` decide
+# whether it has to run; `outputs` must exist afterwards. Stages with `runs` are per run
+# directory and stale ones of the same script are evaluated together in one `--runs` call.
+Stage = namedtuple("Stage", ["name", "script", "cwd", "args", "inputs", "outputs", "runs"], defaults=[None])
+
+
+def parquet_path_for(csv_path):
+    """Same rule as columnar.dataset_path_for, without importing pandas."""
+    return f"{os.path.splitext(csv_path)[0]}.parquet"
+
+
+def results_path(run_dir, dataset, output_format="csv"):
+    path = os.path.join(run_dir, DATASETS[dataset]["results"])
+    return parquet_path_for(path) if output_format == "parquet" else path
+
+
+class State:
+    """
+    Recorded stage runs plus a cache of file hashes keyed by (size, mtime), so unchanged
+    large files (responses, datasets) are not read again on every invocation.
+    """
+
+    def __init__(self, path=STATE_FILE):
+        self.path = path
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            data = {}
+        self.stages = data.get("stages", {})
+        self.files = data.get("files", {})
+
+    def file_hash(self, path):
+        stat = os.stat(path)
+        key = os.path.relpath(path, ROOT)
+        cached = self.files.get(key)
+        if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            return cached[2]
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+                digest.update(chunk)
+        self.files[key] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+        return digest.hexdigest()
+
+    def content_hash(self, path):
+        """sha256 of a file, of every file under a directory (Parquet datasets), or 'missing'."""
+        path = os.path.join(ROOT, path)
+        if os.path.isfile(path):
+            return self.file_hash(path)
+        if not os.path.isdir(path):
+            return "missing"
+        digest = hashlib.sha256()
+        for directory, dirs, files in sorted(os.walk(path)):
+            dirs.sort()
+            for name in sorted(files):
+                file_path = os.path.join(directory, name)
+                digest.update(os.path.relpath(file_path, path).encode())
+                digest.update(self.file_hash(file_path).encode())
+        return digest.hexdigest()
+
+    def input_key(self, stage):
+        digest = hashlib.sha256(json.dumps(stage.args).encode())
+        for path in sorted(set(stage.inputs)):
+            digest.update(f"{path}\0{self.content_hash(path)}\0".encode())
+        return digest.hexdigest()
+
+    def is_stale(self, stage):
+        """Why stage has to run (a short reason), or None if its last run still stands."""
+        record = self.stages.get(stage.name)
+        if record is None:
+            return "never run"
+        if record["inputs"] != self.input_key(stage):
+            return "inputs changed"
+        for path in stage.outputs:
+            if self.content_hash(path) != record["outputs"].get(path):
+                return f"{path} missing or modified"
+        return None
+
+    def record(self, stage):
+        self.stages[stage.name] = {
+            "inputs": self.input_key(stage),
+            "outputs": {path: self.content_hash(path) for path in stage.outputs},
+            "time": round(time.time(), 3),
+        }
+
+    def save(self):
+        tmp_file = f"{self.path}.tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump({"stages": self.stages, "files": self.files}, f, indent=1)
+        os.replace(tmp_file, self.path)
+
+
+def build_stage(dataset, extra_args=()):
+    config = DATASETS[dataset]
+    return Stage(
+        name=f"build:{dataset}",
+        script=config["build"],
+        cwd=ROOT,
+        args=[*config["build_args"], *extra_args],
+        inputs=[config["build"], *config["build_inputs"]],
+        outputs=[config["dataset"]],
+    )
+
+
+def generate_stage(dataset, run, extra_args=()):
+    """
+    Queries the models for one run into results/<dataset><run>/. Only the dataset and the
+    arguments count as inputs: editing the generator code does not re-query paid APIs.
+    """
+    config = DATASETS[dataset]
+    run_dir = os.path.join("results", f"{dataset}{run}")
+    output = os.path.join(run_dir, config["responses"])
+    return Stage(
+        name=f"generate:{dataset}{run}",
+        script=config["generator"],
+        cwd=ROOT,
+        args=["--input", config["dataset"], "--output", output, "--sample", str(run), *extra_args],
+        inputs=[config["dataset"]],
+        outputs=[output],
+    )
+
+
+def run_dirs(dataset, patterns=None):
+    """Run directories (relative to ROOT) of dataset that have a responses file."""
+    patterns = patterns or [os.path.join("results", f"{dataset}*")]
+    found = []
+    for pattern in patterns:
+        for run_dir in sorted(glob.glob(os.path.join(ROOT, pattern))):
+            if os.path.exists(os.path.join(run_dir, DATASETS[dataset]["responses"])):
+                found.append(os.path.relpath(run_dir, ROOT))
+    return found
+
+
+def evaluate_stages(dataset, patterns=None, output_format="csv", extra_args=()):
+    config = DATASETS[dataset]
+    return [
+        Stage(
+            name=f"evaluate:{run_dir}",
+            script=config["evaluator"],
+            cwd=ROOT,
+            args=["--format", output_format, *extra_args],
+            inputs=[os.path.join(run_dir, config["responses"]), config["evaluator"], *EVALUATE_CODE],
+            outputs=[results_path(run_dir, dataset, output_format)],
+            runs=[run_dir],
+        )
+        for run_dir in run_dirs(dataset, patterns)
+    ]
+
+
+def run_results(output_format="csv"):
+    """Per-run results of every evaluated subjective run: what the summary and chart read."""
+    found = []
+    for run_dir in run_dirs("subjective"):
+        for candidate in (results_path(run_dir, "subjective", output_format), results_path(run_dir, "subjective")):
+            if os.path.exists(os.path.join(ROOT, candidate)):
+                found.append(candidate)
+                break
+    return found
+
+
+def summarize_stage(output_format="csv", extra_args=()):
+    output = SUMMARY_OUTPUT if output_format == "csv" else parquet_path_for(SUMMARY_OUTPUT)
+    return Stage(
+        name="summarize",
+        script=SUMMARY_CODE[0],
+        cwd=RESULTS_DIR,
+        args=["--format", output_format, *extra_args],
+        inputs=[*run_results(output_format), *SUMMARY_CODE],
+        outputs=[output],
+    )
+
+
+def chart_stage():
+    return Stage(
+        name="chart",
+        script=CHART_CODE[0],
+        cwd=RESULTS_DIR,
+        args=[],
+        inputs=[*run_results(), *CHART_CODE],
+        outputs=[CHART_OUTPUT],
+    )
+
+
+def run_script(script, cwd, args):
+    command = [sys.executable, os.path.join(ROOT, script), *args]
+    print(f"$ {' '.join(command[1:])}", flush=True)
+    return subprocess.run(command, cwd=cwd).returncode == 0
+
+
+def run_stages(stages, state, force=False):
+    """Runs the stale stages (all with force) in order and records them; False on a failure."""
+    stale = []
+    for stage in stages:
+        reason = "forced" if force else state.is_stale(stage)
+        if reason is None:
+            print(f"  {stage.name}: up to date")
+        else:
+            print(f"  {stage.name}: {reason}")
+            stale.append(stage)
+
+    # Per-run stages of the same script go through one call, e.g. evaluate --runs a b c
+    calls = {}
+    for stage in stale:
+        key = (stage.script, stage.cwd, tuple(stage.args)) if stage.runs is not None else (stage.name,)
+        calls.setdefault(key, []).append(stage)
+
+    ok = True
+    for group in calls.values():
+        first = group[0]
+        args = list(first.args)
+        if first.runs is not None:
+            args += ["--runs", *(os.path.join(ROOT, run) for stage in group for run in stage.runs)]
+        for path in first.outputs:
+            os.makedirs(os.path.dirname(os.path.join(ROOT, path)), exist_ok=True)
+        if run_script(first.script, first.cwd, args) and all(
+                os.path.exists(os.path.join(ROOT, path)) for stage in group for path in stage.outputs):
+            for stage in group:
+                state.record(stage)
+        else:
+            print(f"Error: {', '.join(stage.name for stage in group)} failed")
+            ok = False
+        state.save()
+    state.save()
+    return ok
+
+
+def print_status(state, output_format="csv"):
+    stages = [build_stage(name) for name in DATASETS]
+    for name in DATASETS:
+        stages += evaluate_stages(name, output_format=output_format)
+    stages += [summarize_stage(output_format), chart_stage()]
+    for stage in stages:
+        print(f"  {stage.name:<32} {state.is_stale(stage) or 'up to date'}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run the experiment pipeline: build datasets, generate responses, evaluate, summarize and chart. "
+                    "Stages whose inputs (content hashes) are unchanged since their last run are skipped. "
+                    "Arguments after the known options are passed on to the stage's script.")
+    parser.add_argument("command", choices=["build", "generate", "evaluate", "summarize", "chart", "all", "status"],
+                        help="'all' evaluates every run, then summarizes and charts")
+    parser.add_argument("dataset", nargs="?", choices=list(DATASETS),
+                        help="dataset for build / generate / evaluate (build and evaluate default to both)")
+    parser.add_argument("--run", type=int, help="run number to generate (results/<dataset><run>/)")
+    parser.add_argument("--runs", nargs="+", help="run directories or glob patterns to evaluate, relative to the repo root")
+    parser.add_argument("--format", choices=["csv", "parquet"], default="csv", help="per-run results / summary format")
+    parser.add_argument("--force", action="store_true", help="run the stages even if they are up to date")
+    args, extra = parser.parse_known_args()
+
+    state = State()
+    datasets = [args.dataset] if args.dataset else list(DATASETS)
+    if args.command == "status":
+        print_status(state, args.format)
+        state.save()
+        sys.exit(0)
+
+    if args.command == "build":
+        steps = [("build", lambda: [build_stage(name, extra) for name in datasets])]
+    elif args.command == "generate":
+        if args.dataset is None or args.run is None:
+            parser.error("generate needs a dataset and --run")
+        steps = [("generate", lambda: [generate_stage(args.dataset, args.run, extra)])]
+    else:
+        # Later steps are planned after the earlier ones ran, so they see the files those wrote
+        steps = []
+        if args.command in ("evaluate", "all"):
+            evaluate_extra = extra if args.command == "evaluate" else []
+            steps.append(("evaluate", lambda: [stage for name in datasets
+                                                 for stage in evaluate_stages(name, args.runs, args.format, evaluate_extra)]))
+        if args.command in ("summarize", "all"):
+            steps.append(("summarize", lambda: [summarize_stage(args.format, extra if args.command == "summarize" else [])]))
+        if args.command in ("chart", "all"):
+            steps.append(("chart", lambda: [chart_stage()]))
+
+    for name, plan in steps:
+        print(f"[{name}]")
+        if not run_stages(plan(), state, args.force):
+            sys.exit(1)
@@ -0,0 +1,111 @@
+import hashlib
+import json
+import os
+
+from json_stream import load_items
+
+# --- CONFIGURATION ---
+# Shared prefixes are cut at the last paragraph break, so the cached block is the whole
+# scenario text and every variant differs only in what follows it
+PREFIX_SEPARATOR = "\n\n"
+
+
+class SplitPrompt(str):
+    """
+    A prompt that is `prefix + suffix`, where the prefix is shared with the other variants of
+    the same item. Behaves as the full prompt string everywhere (cache keys, token estimates,
+    mock answers); adapters that support prompt caching send the prefix as a cacheable block.
+    """
+
+    def __new__(cls, prefix, suffix, prefix_id=None):
+        prompt = super().__new__(cls, prefix + suffix)
+        prompt.prefix = prefix
+        prompt.suffix = suffix
+        prompt.prefix_id = prefix_id or prefix_id_for(prefix)
+        return prompt
+
+    def __getnewargs__(self):
+        # Lets SplitPrompts cross process boundaries (pickle) intact
+        return self.prefix, self.suffix, self.prefix_id
+
+
+def prefix_id_for(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+def shared_prefix(texts):
+    """Longest common prefix of texts, cut back to the end of its last PREFIX_SEPARATOR."""
+    prefix = os.path.commonprefix(list(texts))
+    cut = prefix.rfind(PREFIX_SEPARATOR)
+    return prefix[:cut + len(PREFIX_SEPARATOR)] if cut > 0 else ""
+
+
+def prefixes_path_for(path):
+    """agreement_bias_subjective_dataset_triplets.json -> ...triplets.prefixes.json"""
+    root, _ = os.path.splitext(path)
+    return f"{root}.prefixes.json"
+
+
+def load_prefixes(path):
+    """Prefix id -> text table stored next to a compact dataset / responses file, or {}."""
+    prefixes_file = prefixes_path_for(path)
+    if not os.path.exists(prefixes_file):
+        return {}
+    with open(prefixes_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_prefixes(path, prefixes):
+    with open(prefixes_path_for(path), 'w', encoding='utf-8') as f:
+        json.dump(prefixes, f, indent=2, ensure_ascii=False)
+
+
+def split_prompts(item, prefixes=None):
+    """
+    The item's prompts as SplitPrompts. Compact items ({"prompt_prefix": id, "prompts": suffixes})
+    are expanded from the prefix table; full prompts are split at their shared prefix, if any.
+    """
+    prompts = item["prompts"]
+    if "prompt_prefix" in item:
+        prefix_id = item["prompt_prefix"]
+        prefix = (prefixes or {})[prefix_id]
+        return {variant: SplitPrompt(prefix, suffix, prefix_id) for variant, suffix in prompts.items()}
+
+    prefix = shared_prefix(prompts.values()) if len(prompts) > 1 else ""
+    if not prefix:
+        return dict(prompts)
+    return {variant: SplitPrompt(prefix, prompt[len(prefix):]) for variant, prompt in prompts.items()}
+
+
+def load_dataset(path):
+    """
+    Dataset items with their prompts as SplitPrompts (full dataset or compact one plus its
+    prefix table). Items that were stored compact keep their "prompt_prefix" key, so the
+    responses file can be written compact as well.
+    """
+    items = load_items(path)
+    prefixes = load_prefixes(path)
+    for item in items:
+        item["prompts"] = split_prompts(item, prefixes)
+    return items
+
+
+def compact_item(item, prefixes):
+    """
+    Storage form of an item: the shared prefix goes into `prefixes` (id -> text) once and
+    the item keeps only its id and the per-variant suffixes.
+    """
+    prompts = item["prompts"]
+    first = next(iter(prompts.values()), None)
+    if not isinstance(first, SplitPrompt) or any(
+            not isinstance(p, SplitPrompt) or p.prefix_id != first.prefix_id for p in prompts.values()):
+        return item
+
+    prefixes[first.prefix_id] = first.prefix
+    compact = {}
+    for key, value in item.items():
+        if key == "prompts":
+            compact["prompt_prefix"] = first.prefix_id
+            value = {variant: prompt.suffix for variant, prompt in prompts.items()}
+        compact[key] = value
+    return compact
@@ -0,0 +1,737 @@
+import asyncio
+import hashlib
+import importlib.util
+import inspect
+import json
+import os
+import math
+import random
+import re
+import time
+from collections import namedtuple
+
+from retry import ContentFiltered
+
+# --- CONFIGURATION ---
+# Set to a registered provider name (e.g. "mock") to route every model to it.
+# Handy for offline runs and load tests: AGREEMENT_BIAS_PROVIDER=mock python generate_moral_responses.py
+PROVIDER_ENV_VAR = "AGREEMENT_BIAS_PROVIDER"
+
+# MODELS keys are mapped to providers by prefix
+MODEL_PREFIXES = {
+    "gpt": "openai",
+    "claude": "anthropic",
+    "llama": "groq",
+    "mock": "mock",
+}
+
+# Connection pool defaults; generators pass their concurrency limit as pool_size
+DEFAULT_POOL_SIZE = 16
+CONNECT_TIMEOUT = 10.0
+REQUEST_TIMEOUT = 120.0
+KEEPALIVE_EXPIRY = 60.0
+
+# Log-probability scoring (Provider.score_choices): alternatives requested per output token
+# (OpenAI allows at most 20) and output tokens read before giving up on finding the choice
+LOGPROB_TOP = 20
+LOGPROB_MAX_TOKENS = 4
+
+# What every adapter returns; token counts are None when the API does not report them.
+# `timings` is only set for streamed calls (see Provider.stream_complete).
+# `input_tokens` counts the whole prompt; `cached_input_tokens` is the part served from the
+# provider's prompt cache. `choice_probs` is only set by Provider.score_choices.
+Completion = namedtuple(
+    "Completion",
+    ["text", "headers", "input_tokens", "output_tokens", "timings", "cached_input_tokens", "choice_probs"],
+    defaults=(None, None, None)
+)
+
+# Batch job states reported by batch_status()
+BATCH_RUNNING = "running"
+BATCH_ENDED = "ended"
+
+PROVIDERS = {}
+_instances = {}
+
+
+def completion_tokens(completion):
+    """Total billed tokens of a Completion, or None if unknown."""
+    if completion.input_tokens is None and completion.output_tokens is None:
+        return None
+    return (completion.input_tokens or 0) + (completion.output_tokens or 0)
+
+
+def _choice_key(text):
+    return re.sub(r"[^a-z0-9]", "", text.lower())
+
+
+def choice_probabilities(positions, choices):
+    """
+    Probability that an answer starts with each choice, from the generated tokens' log-probabilities.
+
+    `positions` are (token, logprob, [(alternative, logprob), ...]) per output token. The answer
+    is walked up to the first position where one of the alternatives completes a choice
+    ("Case" + " 2"), ignoring case, spaces and punctuation; each choice gets the probability
+    of the tokens before that position times its alternative's. Choices never reached get 0.
+    """
+    probs = {choice: 0.0 for choice in choices}
+    keys = {choice: _choice_key(choice) for choice in choices}
+    prefix, prefix_logprob = "", 0.0
+    for token, logprob, alternatives in positions:
+        found = False
+        for alternative, alt_logprob in alternatives or [(token, logprob)]:
+            text = _choice_key(prefix + alternative)
+            for choice, key in keys.items():
+                if text.endswith(key):
+                    probs[choice] += math.exp(prefix_logprob + alt_logprob)
+                    found = True
+                    break
+        if found:
+            break
+        prefix += token
+        prefix_logprob += logprob
+    return probs
+
+
+def choice_label(probs):
+    """The likelier choice of a choice_probabilities result, or "" if neither was reached."""
+    best = max(probs, key=probs.get) if probs else None
+    return best if best is not None and probs[best] > 0 else ""
+
+
+def user_message(prompt, cache_prefix=False):
+    """
+    The chat message for a prompt. With cache_prefix, a prompt carrying a shared prefix
+    (prompts.SplitPrompt) is sent as two text blocks with the prefix marked for caching.
+    """
+    prefix = getattr(prompt, "prefix", "")
+    if not (cache_prefix and prefix):
+        return {"role": "user", "content": str(prompt)}
+    return {"role": "user", "content": [
+        {"type": "text", "text": prefix, "cache_control": {"type": "ephemeral"}},
+        {"type": "text", "text": prompt.suffix},
+    ]}
+
+
+def register_provider(name):
+    """Class decorator that makes an adapter available under `name`."""
+    def decorator(cls):
+        cls.name = name
+        PROVIDERS[name] = cls
+        return cls
+    return decorator
+
+
+def default_provider_for(model_family):
+    """The provider a MODELS key normally belongs to, ignoring any override."""
+    for prefix, provider in MODEL_PREFIXES.items():
+        if model_family.startswith(prefix):
+            return provider
+    raise ValueError(f"No provider known for model '{model_family}'")
+
+
+def select_models(specs, models):
+    """
+    The MODELS entries named on the command line. Each spec is a MODELS key or KEY=MODEL_ID
+    for a model the generator does not list; the key still decides the provider.
+    """
+    selected = {}
+    for spec in specs:
+        key, _, model_id = spec.partition("=")
+        if not model_id:
+            if key not in models:
+                raise SystemExit(f"Error: unknown model '{key}' (known: {sorted(models)}); use KEY=MODEL_ID")
+            model_id = models[key]
+        default_provider_for(key)
+        selected[key] = model_id
+    return selected
+
+
+def provider_for(model_family):
+    """
+    Maps a MODELS key to the name of the provider that serves it.
+    AGREEMENT_BIAS_PROVIDER overrides the mapping for every model.
+    """
+    return os.getenv(PROVIDER_ENV_VAR) or default_provider_for(model_family)
+
+
+def get_provider(name, pool_size=DEFAULT_POOL_SIZE):
+    """
+    Shared adapter instance for a provider. The first call decides the pool size,
+    so create providers with the scheduler's concurrency limit before the run starts.
+    """
+    if name not in _instances:
+        if name not in PROVIDERS:
+            raise ValueError(f"Unknown provider '{name}'. Registered: {sorted(PROVIDERS)}")
+        _instances[name] = PROVIDERS[name](pool_size=pool_size)
+    return _instances[name]
+
+
+async def _read_file(content):
+    """Bytes of a downloaded file; the OpenAI SDK reads synchronously, Groq asynchronously."""
+    data = content.read()
+    if inspect.isawaitable(data):
+        data = await data
+    return data.decode("utf-8") if isinstance(data, bytes) else data
+
+
+async def close_providers():
+    """Closes every pooled client that was opened during the run."""
+    for provider in _instances.values():
+        await provider.close()
+    _instances.clear()
+
+
+def _http_client(pool_size):
+    """
+    httpx client shared by all requests to one provider: keep-alive connections,
+    a pool sized to the number of requests we keep in flight, and HTTP/2 if h2 is installed.
+    """
+    import httpx    # type: ignore
+
+    return httpx.AsyncClient(
+        http2=importlib.util.find_spec("h2") is not None,
+        limits=httpx.Limits(
+            max_connections=pool_size,
+            max_keepalive_connections=pool_size,
+            keepalive_expiry=KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(REQUEST_TIMEOUT, connect=CONNECT_TIMEOUT),
+    )
+
+
+class Provider:
+    """
+    Base adapter. Subclasses implement `complete()` and return a Completion.
+    SDKs are imported on first use, so a run only needs the packages of the providers it calls.
+    """
+
+    name = None
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE):
+        self.pool_size = pool_size
+        self.client = None
+
+    async def complete(self, model_id, prompt, temperature, max_tokens):
+        raise NotImplementedError
+
+    async def _stream(self, model_id, prompt, temperature, max_tokens):
+        """
+        Async generator of ("headers", dict), ("text", delta) and ("usage", (input, output, cached))
+        events. Must close the underlying HTTP stream when the generator is closed early.
+        """
+        raise NotImplementedError(f"Provider '{self.name}' does not support streaming")
+        yield
+
+    # Log-probability scoring: instead of generating an answer, read how likely each of a fixed
+    # set of answers is from the first few output tokens (see choice_probabilities).
+    supports_logprobs = False
+
+    async def score_choices(self, model_id, prompt, choices, max_tokens=LOGPROB_MAX_TOKENS):
+        """
+        Completion whose `choice_probs` maps each choice to its probability as the start of the
+        answer, and whose text is the likelier choice. Sampled greedily, at most max_tokens long.
+        """
+        raise NotImplementedError(f"Provider '{self.name}' does not expose token log-probabilities")
+
+    async def stream_complete(self, model_id, prompt, temperature, max_tokens, decide=None, token_budget=None):
+        """
+        Streams the response and stops as soon as `decide(text_so_far)` returns something
+        other than None, or once about `token_budget` output tokens have arrived.
+        The Completion carries timings: time to first token, time to decision, and whether
+        the stream was cut short.
+        """
+        start = time.perf_counter()
+        text, headers = "", {}
+        input_tokens = output_tokens = cached_tokens = None
+        first_token = decided_at = None
+        stopped_early = False
+
+        stream = self._stream(model_id, prompt, temperature, max_tokens)
+        try:
+            async for kind, value in stream:
+                if kind == "headers":
+                    headers = value
+                elif kind == "usage":
+                    input_tokens = value[0] if value[0] is not None else input_tokens
+                    output_tokens = value[1] if value[1] is not None else output_tokens
+                    cached_tokens = value[2] if value[2] is not None else cached_tokens
+                elif kind == "text" and value:
+                    if first_token is None:
+                        first_token = time.perf_counter() - start
+                    text += value
+                    if decide is not None and decide(text) is not None:
+                        decided_at = time.perf_counter() - start
+                        stopped_early = True
+                        break
+                    if token_budget is not None and len(text) // 4 >= token_budget:
+                        stopped_early = True
+                        break
+        finally:
+            await stream.aclose()
+
+        # A stream cut short never reports usage; estimate what was generated
+        if stopped_early and output_tokens is None:
+            output_tokens = max(1, len(text) // 4)
+        if input_tokens is None:
+            input_tokens = len(prompt) // 4
+
+        timings = {
+            "ttft": round(first_token, 4) if first_token is not None else None,
+            "time_to_decision": round(decided_at, 4) if decided_at is not None else None,
+            "total_time": round(time.perf_counter() - start, 4),
+            "stopped_early": stopped_early,
+        }
+        return Completion(text, headers, input_tokens, output_tokens, timings, cached_tokens)
+
+    # Batch API: submit many prompts as one asynchronous job, poll it, then collect the answers.
+    # `requests` is a list of (custom_id, prompt); results map custom_id -> Completion or None.
+    supports_batch = False
+
+    async def submit_batch(self, model_id, requests, temperature, max_tokens):
+        raise NotImplementedError(f"Provider '{self.name}' has no batch API")
+
+    async def batch_status(self, batch_id):
+        raise NotImplementedError(f"Provider '{self.name}' has no batch API")
+
+    async def batch_results(self, batch_id):
+        raise NotImplementedError(f"Provider '{self.name}' has no batch API")
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.close()
+            self.client = None
+
+
+class ChatCompletionsProvider(Provider):
+    """Shared logic for the OpenAI-compatible chat completions APIs (OpenAI, Groq)."""
+
+    supports_batch = True
+
+    def _make_client(self):
+        raise NotImplementedError
+
+    def _client(self):
+        if self.client is None:
+            self.client = self._make_client()
+        return self.client
+
+    async def complete(self, model_id, prompt, temperature, max_tokens):
+        # Raw response so the rate limiter can read the quota headers
+        raw = await self._client().chat.completions.with_raw_response.create(
+            model=model_id,
+            messages=[user_message(prompt)],
+            temperature=temperature,
+            max_tokens=max_tokens,
+            **self._cache_options(prompt)
+        )
+        response = raw.parse()
+        if response.choices[0].finish_reason == "content_filter":
+            raise ContentFiltered(f"{model_id} answer was withheld by the content filter")
+        usage = response.usage
+        return Completion(
+            response.choices[0].message.content,
+            raw.headers,
+            getattr(usage, "prompt_tokens", None),
+            getattr(usage, "completion_tokens", None),
+            cached_input_tokens=_cached_prompt_tokens(usage),
+        )
+
+    async def _stream(self, model_id, prompt, temperature, max_tokens):
+        stream = await self._client().chat.completions.create(
+            model=model_id,
+            messages=[user_message(prompt)],
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True,
+            **self._stream_options(),
+            **self._cache_options(prompt)
+        )
+        try:
+            yield "headers", stream.response.headers
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield "text", chunk.choices[0].delta.content
+                # OpenAI sends usage on the last chunk, Groq under x_groq
+                usage = getattr(chunk, "usage", None) or getattr(getattr(chunk, "x_groq", None), "usage", None)
+                if usage is not None:
+                    yield "usage", (getattr(usage, "prompt_tokens", None), getattr(usage, "completion_tokens", None),
+                                    _cached_prompt_tokens(usage))
+        finally:
+            await stream.close()
+
+    async def score_choices(self, model_id, prompt, choices, max_tokens=LOGPROB_MAX_TOKENS):
+        raw = await self._client().chat.completions.with_raw_response.create(
+            model=model_id,
+            messages=[user_message(prompt)],
+            temperature=0,
+            max_tokens=max_tokens,
+            logprobs=True,
+            top_logprobs=LOGPROB_TOP,
+            **self._cache_options(prompt)
+        )
+        response = raw.parse()
+        if response.choices[0].finish_reason == "content_filter":
+            raise ContentFiltered(f"{model_id} answer was withheld by the content filter")
+        logprobs = getattr(response.choices[0].logprobs, "content", None) or []
+        probs = choice_probabilities(
+            [(entry.token, entry.logprob, [(alt.token, alt.logprob) for alt in entry.top_logprobs or []])
+             for entry in logprobs],
+            choices,
+        )
+        usage = response.usage
+        return Completion(
+            choice_label(probs),
+            raw.headers,
+            getattr(usage, "prompt_tokens", None),
+            getattr(usage, "completion_tokens", None),
+            cached_input_tokens=_cached_prompt_tokens(usage),
+            choice_probs=probs,
+        )
+
+    def _stream_options(self):
+        return {}
+
+    def _cache_fields(self, prompt):
+        """Extra request body fields that help the provider's prompt cache."""
+        return {}
+
+    def _cache_options(self, prompt):
+        fields = self._cache_fields(prompt)
+        return {"extra_body": fields} if fields else {}
+
+    async def submit_batch(self, model_id, requests, temperature, max_tokens):
+        # One JSONL line per request, uploaded as a file and referenced by the batch job
+        lines = []
+        for custom_id, prompt in requests:
+            lines.append(json.dumps({
+                "custom_id": custom_id,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": model_id,
+                    "messages": [user_message(prompt)],
+                    "temperature": temperature,
+                    "max_tokens": max_tokens,
+                    **self._cache_fields(prompt),
+                },
+            }, ensure_ascii=False))
+        client = self._client()
+        batch_file = await client.files.create(
+            file=("batch_requests.jsonl", "\n".join(lines).encode("utf-8")),
+            purpose="batch",
+        )
+        batch = await client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+        )
+        return batch.id
+
+    async def batch_status(self, batch_id):
+        batch = await self._client().batches.retrieve(batch_id)
+        if batch.status in ("completed", "failed", "expired", "cancelled"):
+            return BATCH_ENDED
+        return BATCH_RUNNING
+
+    async def batch_results(self, batch_id):
+        client = self._client()
+        batch = await client.batches.retrieve(batch_id)
+        results = {}
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            text = await _read_file(await client.files.content(file_id))
+            for line in text.splitlines():
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                response = record.get("response") or {}
+                if response.get("status_code") != 200:
+                    results[record["custom_id"]] = None
+                    continue
+                body = response["body"]
+                usage = body.get("usage") or {}
+                results[record["custom_id"]] = Completion(
+                    body["choices"][0]["message"]["content"],
+                    {},
+                    usage.get("prompt_tokens"),
+                    usage.get("completion_tokens"),
+                    cached_input_tokens=(usage.get("prompt_tokens_details") or {}).get("cached_tokens"),
+                )
+        return results
+
+
+@register_provider("openai")
+class OpenAIProvider(ChatCompletionsProvider):
+    supports_logprobs = True
+
+    def _stream_options(self):
+        return {"stream_options": {"include_usage": True}}
+
+    def _cache_fields(self, prompt):
+        # OpenAI caches long prompt prefixes automatically; a per-prefix key keeps the
+        # variants of one item on the same cache shard
+        prefix_id = getattr(prompt, "prefix_id", None)
+        return {"prompt_cache_key": prefix_id} if prefix_id else {}
+
+    def _make_client(self):
+        from openai import AsyncOpenAI          # type: ignore
+
+        # SDK retries are off: 429s are handled by the rate limiter so it can slow down
+        return AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            max_retries=0,
+            http_client=_http_client(self.pool_size),
+        )
+
+
+@register_provider("groq")
+class GroqProvider(ChatCompletionsProvider):
+    def _make_client(self):
+        from groq import AsyncGroq              # type: ignore
+
+        return AsyncGroq(
+            api_key=os.getenv("GROQ_API_KEY"),
+            max_retries=0,
+            http_client=_http_client(self.pool_size),
+        )
+
+
+def _cached_prompt_tokens(usage):
+    """Cached part of an OpenAI-style usage block (prompt_tokens_details.cached_tokens)."""
+    details = getattr(usage, "prompt_tokens_details", None)
+    return getattr(details, "cached_tokens", None)
+
+
+def _anthropic_input_tokens(usage):
+    """Anthropic reports cache writes and reads apart from input_tokens; this is the whole prompt."""
+    return (usage.input_tokens + (getattr(usage, "cache_creation_input_tokens", None) or 0)
+            + (getattr(usage, "cache_read_input_tokens", None) or 0))
+
+
+@register_provider("anthropic")
+class AnthropicProvider(Provider):
+    supports_batch = True
+
+    def _client(self):
+        if self.client is None:
+            from anthropic import AsyncAnthropic    # type: ignore
+
+            self.client = AsyncAnthropic(
+                api_key=os.getenv("ANTHROPIC_API_KEY"),
+                max_retries=0,
+                http_client=_http_client(self.pool_size),
+            )
+        return self.client
+
+    async def complete(self, model_id, prompt, temperature, max_tokens):
+        raw = await self._client().messages.with_raw_response.create(
+            model=model_id,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            messages=[user_message(prompt, cache_prefix=True)]
+        )
+        response = raw.parse()
+        if response.stop_reason == "refusal":
+            raise ContentFiltered(f"{model_id} refused to answer (stop_reason 'refusal')")
+        return Completion(
+            response.content[0].text,
+            raw.headers,
+            _anthropic_input_tokens(response.usage),
+            response.usage.output_tokens,
+            cached_input_tokens=getattr(response.usage, "cache_read_input_tokens", None),
+        )
+
+    async def _stream(self, model_id, prompt, temperature, max_tokens):
+        stream = await self._client().messages.create(
+            model=model_id,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            messages=[user_message(prompt, cache_prefix=True)],
+            stream=True
+        )
+        try:
+            yield "headers", stream.response.headers
+            async for event in stream:
+                if event.type == "message_start":
+                    usage = event.message.usage
+                    yield "usage", (_anthropic_input_tokens(usage), None, getattr(usage, "cache_read_input_tokens", None))
+                elif event.type == "content_block_delta" and getattr(event.delta, "text", None):
+                    yield "text", event.delta.text
+                elif event.type == "message_delta":
+                    yield "usage", (None, event.usage.output_tokens, None)
+        finally:
+            await stream.close()
+
+    async def submit_batch(self, model_id, requests, temperature, max_tokens):
+        batch = await self._client().messages.batches.create(requests=[
+            {
+                "custom_id": custom_id,
+                "params": {
+                    "model": model_id,
+                    "max_tokens": max_tokens,
+                    "temperature": temperature,
+                    "messages": [user_message(prompt, cache_prefix=True)],
+                },
+            }
+            for custom_id, prompt in requests
+        ])
+        return batch.id
+
+    async def batch_status(self, batch_id):
+        batch = await self._client().messages.batches.retrieve(batch_id)
+        return BATCH_ENDED if batch.processing_status == "ended" else BATCH_RUNNING
+
+    async def batch_results(self, batch_id):
+        results = {}
+        async for entry in await self._client().messages.batches.results(batch_id):
+            if entry.result.type != "succeeded":
+                results[entry.custom_id] = None
+                continue
+            message = entry.result.message
+            results[entry.custom_id] = Completion(
+                message.content[0].text,
+                {},
+                _anthropic_input_tokens(message.usage),
+                message.usage.output_tokens,
+                cached_input_tokens=getattr(message.usage, "cache_read_input_tokens", None),
+            )
+        return results
+
+
+class MockAPIError(Exception):
+    """HTTP error as the SDKs raise it (status_code attribute), for MOCK_ERROR_RATE."""
+
+    def __init__(self, status_code, message):
+        super().__init__(f"Error code: {status_code} - {message}")
+        self.status_code = status_code
+        self.response = None
+
+
+@register_provider("mock")
+class MockProvider(Provider):
+    """
+    Deterministic local stand-in for the real APIs; needs no network and no keys.
+
+    Responses are seeded on (model, prompt), so the same request always gets the same
+    answer. Forced-choice prompts ("Case 1" or "Case 2") get one of the two cases, anything
+    else gets a short seeded sentence. Set MOCK_RESPONSES_FILE to serve canned answers
+    instead: either a {prompt: response} JSON object or a previous raw_model_responses*.json.
+    MOCK_LATENCY (seconds, default 0) adds a fixed delay plus up to 50% jitter per call, and
+    MOCK_ERROR_RATE (default 0) makes that share of calls fail with a 503 to exercise retries.
+    score_choices() returns seeded probabilities for the choices, most of the mass on the
+    answer complete() would give.
+
+    It also fakes a batch endpoint: batches are held in memory and finish
+    MOCK_BATCH_DELAY seconds (default 0) after submission.
+    """
+
+    supports_batch = True
+    supports_logprobs = True
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE):
+        super().__init__(pool_size)
+        self.latency = float(os.getenv("MOCK_LATENCY", "0"))
+        self.error_rate = float(os.getenv("MOCK_ERROR_RATE", "0"))
+        self.batch_delay = float(os.getenv("MOCK_BATCH_DELAY", "0"))
+        self.canned = self._load_canned(os.getenv("MOCK_RESPONSES_FILE"))
+        self.batches = {}
+        # (model, prefix id) pairs seen so far, to report cache hits like the real APIs
+        self.cached_prefixes = set()
+
+    @staticmethod
+    def _load_canned(path):
+        if not path:
+            return {}
+        with open(path, 'r') as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            return data
+
+        # raw_model_responses*.json: replay the first model's answer for every prompt
+        # (compact files are expanded with their prefix table)
+        from prompts import load_prefixes, split_prompts
+
+        prefixes = load_prefixes(path)
+        canned = {}
+        for item in data:
+            for model_responses in item.get("responses", {}).values():
+                for variant, prompt in split_prompts(item, prefixes).items():
+                    response = model_responses.get(f"{variant}_response")
+                    if response is not None:
+                        canned.setdefault(prompt, response)
+        return canned
+
+    @staticmethod
+    def _rng(model_id, prompt):
+        seed = hashlib.sha256(f"{model_id}\n{prompt}".encode("utf-8")).digest()
+        return random.Random(int.from_bytes(seed[:8], "big"))
+
+    def _answer(self, model_id, prompt, rng):
+        if prompt in self.canned:
+            text = self.canned[prompt]
+        elif "Case 1" in prompt and "Case 2" in prompt:
+            text = rng.choice(["Case 1", "Case 2"])
+        else:
+            text = f"Mock answer {rng.randrange(10**6):06d} from {model_id}."
+
+        cached = None
+        prefix_id = getattr(prompt, "prefix_id", None)
+        if prefix_id is not None:
+            cached = len(prompt.prefix) // 4 if (model_id, prefix_id) in self.cached_prefixes else 0
+            self.cached_prefixes.add((model_id, prefix_id))
+        return Completion(text, {}, len(prompt) // 4, len(text) // 4, cached_input_tokens=cached)
+
+    async def complete(self, model_id, prompt, temperature, max_tokens):
+        rng = self._rng(model_id, prompt)
+        if self.latency:
+            await asyncio.sleep(self.latency * (1 + 0.5 * rng.random()))
+        # Unseeded, so a retried call can succeed
+        if self.error_rate and random.random() < self.error_rate:
+            raise MockAPIError(503, "mock server error")
+        return self._answer(model_id, prompt, rng)
+
+    async def score_choices(self, model_id, prompt, choices, max_tokens=LOGPROB_MAX_TOKENS):
+        completion = await self.complete(model_id, prompt, 0, max_tokens)
+        rng = self._rng(model_id, f"{prompt}\n{choices}")
+        # The sampled answer gets 50-100% of the mass, the other choices share what is left
+        # apart from a small remainder for answers that are none of them
+        top = 0.5 + 0.5 * rng.random()
+        rest = (1 - top) * 0.9 / max(1, len(choices) - 1)
+        answer = completion.text if completion.text in choices else rng.choice(list(choices))
+        probs = {choice: round(top if choice == answer else rest, 6) for choice in choices}
+        return completion._replace(text=choice_label(probs), output_tokens=1, choice_probs=probs)
+
+    async def _stream(self, model_id, prompt, temperature, max_tokens):
+        # Same answer as complete(), delivered a few characters at a time
+        rng = self._rng(model_id, prompt)
+        if self.error_rate and random.random() < self.error_rate:
+            raise MockAPIError(503, "mock server error")
+        completion = self._answer(model_id, prompt, rng)
+        chunks = [completion.text[i:i + 4] for i in range(0, len(completion.text), 4)]
+        yield "headers", {}
+        for chunk in chunks:
+            if self.latency:
+                await asyncio.sleep(self.latency / max(1, len(chunks)))
+            yield "text", chunk
+        yield "usage", (completion.input_tokens, completion.output_tokens, completion.cached_input_tokens)
+
+    async def submit_batch(self, model_id, requests, temperature, max_tokens):
+        batch_id = f"mock-batch-{len(self.batches)}"
+        self.batches[batch_id] = {
+            "ready_at": time.monotonic() + self.batch_delay,
+            "results": {
+                custom_id: self._answer(model_id, prompt, self._rng(model_id, prompt))
+                for custom_id, prompt in requests
+            },
+        }
+        return batch_id
+
+    async def batch_status(self, batch_id):
+        if batch_id not in self.batches:
+            raise ValueError(f"Unknown mock batch '{batch_id}' (mock batches do not survive a restart)")
+        return BATCH_ENDED if time.monotonic() >= self.batches[batch_id]["ready_at"] else BATCH_RUNNING
+
+    async def batch_results(self, batch_id):
+        return self.batches.pop(batch_id)["results"]
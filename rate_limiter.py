@@ -0,0 +1,306 @@
+import asyncio
+import re
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import telemetry
+from retry import (FATAL, MAX_ATTEMPTS, RATE_LIMIT, REQUEST_DEADLINE, TRANSIENT, Failure, RequestFailed,
+                   backoff_delay, classify)
+from providers import completion_tokens, default_provider_for, provider_for
+
+# --- CONFIGURATION ---
+# Starting budgets per provider (requests per minute / tokens per minute).
+# Generators can override these per MODELS key, and the real limits reported in the
+# providers' rate-limit headers replace them as soon as the first response arrives.
+DEFAULT_LIMITS = {
+    "openai": {"rpm": 500, "tpm": 30000},
+    "anthropic": {"rpm": 50, "tpm": 30000},
+    "groq": {"rpm": 30, "tpm": 6000},   # llama free tier
+    "mock": {"rpm": 1_000_000, "tpm": 1_000_000_000},
+}
+
+# Adaptive pacing: halve the rate on every 429, win back a little on every success
+BACKOFF_FACTOR = 0.5
+RECOVERY_STEP = 0.05
+MIN_RATE_SCALE = 0.1
+
+# Pause used when a 429 arrives without a retry-after header
+# (how often a request is retried is set in retry.py)
+DEFAULT_RETRY_AFTER = 5.0
+
+# Header names used by OpenAI / Groq and by Anthropic for the same information
+REMAINING_REQUEST_HEADERS = ["x-ratelimit-remaining-requests", "anthropic-ratelimit-requests-remaining"]
+REMAINING_TOKEN_HEADERS = ["x-ratelimit-remaining-tokens", "anthropic-ratelimit-tokens-remaining"]
+RESET_REQUEST_HEADERS = ["x-ratelimit-reset-requests", "anthropic-ratelimit-requests-reset"]
+RESET_TOKEN_HEADERS = ["x-ratelimit-reset-tokens", "anthropic-ratelimit-tokens-reset"]
+LIMIT_REQUEST_HEADERS = ["x-ratelimit-limit-requests", "anthropic-ratelimit-requests-limit"]
+LIMIT_TOKEN_HEADERS = ["x-ratelimit-limit-tokens", "anthropic-ratelimit-tokens-limit"]
+
+# Groq reports its request limit per day, not per minute, so it cannot replace the rpm budget
+DAILY_REQUEST_LIMIT_PROVIDERS = {"groq"}
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+
+
+def estimate_tokens(prompt, max_tokens):
+    """
+    Rough token cost of a request before it is sent (~4 characters per token plus the
+    completion budget). The real usage is booked once the response comes back.
+    """
+    return len(prompt or "") // 4 + max_tokens
+
+
+def parse_wait(value):
+    """
+    Turns a retry-after / reset header value into seconds to wait.
+    Accepts plain seconds ("2"), Go-style durations ("6m0s", "120ms"),
+    RFC 3339 timestamps (Anthropic) and HTTP dates.
+    """
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    parts = _DURATION_PART.findall(value)
+    if parts and "".join(n + u for n, u in parts) == value:
+        scale = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+        return sum(float(n) * scale[u] for n, u in parts)
+
+    try:
+        reset_at = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        try:
+            reset_at = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+    if reset_at.tzinfo is None:
+        reset_at = reset_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (reset_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def _header(headers, names):
+    if not headers:
+        return None
+    for name in names:
+        value = headers.get(name)
+        if value is not None:
+            return value
+    return None
+
+
+def _header_number(headers, names):
+    try:
+        return float(_header(headers, names))
+    except (TypeError, ValueError):
+        return None
+
+
+def is_rate_limited(error):
+    """True if an SDK exception is an HTTP 429."""
+    return getattr(error, "status_code", None) == 429
+
+
+def error_headers(error):
+    """Response headers attached to an SDK exception, if there are any."""
+    response = getattr(error, "response", None)
+    return getattr(response, "headers", None)
+
+
+def retry_after(headers):
+    """Seconds the provider asked us to wait, or None."""
+    retry_ms = _header_number(headers, ["retry-after-ms"])
+    if retry_ms is not None:
+        return retry_ms / 1000
+    return parse_wait(_header(headers, ["retry-after"]))
+
+
+class TokenBucket:
+    """
+    Classic token bucket holding one minute of budget that refills continuously.
+    The balance may go negative when a response turns out to cost more than estimated;
+    later callers then wait for the debt to be repaid.
+    """
+
+    def __init__(self, per_minute):
+        self.per_minute = float(per_minute)
+        self.scale = 1.0
+        self.tokens = self.per_minute
+        self.updated = time.monotonic()
+
+    @property
+    def rate(self):
+        return self.per_minute * self.scale / 60.0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.per_minute, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        self._refill()
+        amount = min(amount, self.per_minute)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount):
+        self._refill()
+        self.tokens -= amount
+
+    def set_limit(self, per_minute):
+        self._refill()
+        self.per_minute = float(per_minute)
+        self.tokens = min(self.tokens, self.per_minute)
+
+
+class ModelRateLimiter:
+    """
+    Request and token budgets for a single model.
+
+    Callers `await acquire(...)` before sending, then report back with `on_success(...)`
+    or `on_rate_limited(...)`. A 429 halves the sending rate and pauses everybody until
+    the provider's retry-after has passed; every success recovers a little of the rate.
+    """
+
+    def __init__(self, rpm, tpm, adopt_request_limit=True):
+        self.adopt_request_limit = adopt_request_limit
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.scale = 1.0
+        self.blocked_until = 0.0
+        self.lock = asyncio.Lock()
+
+    def _set_scale(self, scale):
+        self.scale = min(1.0, max(MIN_RATE_SCALE, scale))
+        self.requests.scale = self.scale
+        self.tokens.scale = self.scale
+
+    def _block_for(self, seconds):
+        if seconds:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    async def acquire(self, estimated_tokens):
+        # The lock keeps waiters in FIFO order so a big request is not starved by small ones
+        async with self.lock:
+            while True:
+                wait = max(
+                    self.blocked_until - time.monotonic(),
+                    self.requests.wait_time(1),
+                    self.tokens.wait_time(estimated_tokens),
+                )
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+            self.requests.take(1)
+            self.tokens.take(estimated_tokens)
+
+    def on_success(self, headers, estimated_tokens, used_tokens=None):
+        # Book the real token usage against the estimate taken in acquire()
+        if used_tokens is not None:
+            self.tokens.take(used_tokens - estimated_tokens)
+
+        # Adopt the real limits if the provider tells us what they are
+        limit_requests = _header_number(headers, LIMIT_REQUEST_HEADERS)
+        if limit_requests and self.adopt_request_limit:
+            self.requests.set_limit(limit_requests)
+        limit_tokens = _header_number(headers, LIMIT_TOKEN_HEADERS)
+        if limit_tokens:
+            self.tokens.set_limit(limit_tokens)
+
+        # Quota exhausted for this window: hold off until it resets instead of eating a 429
+        if _header_number(headers, REMAINING_REQUEST_HEADERS) == 0:
+            self._block_for(parse_wait(_header(headers, RESET_REQUEST_HEADERS)))
+        remaining_tokens = _header_number(headers, REMAINING_TOKEN_HEADERS)
+        if remaining_tokens is not None and remaining_tokens < estimated_tokens:
+            self._block_for(parse_wait(_header(headers, RESET_TOKEN_HEADERS)))
+
+        self._set_scale(self.scale + RECOVERY_STEP)
+
+    def on_rate_limited(self, headers):
+        self._set_scale(self.scale * BACKOFF_FACTOR)
+        wait = retry_after(headers)
+        if wait is None:
+            wait = parse_wait(_header(headers, RESET_REQUEST_HEADERS))
+        self._block_for(wait if wait is not None else DEFAULT_RETRY_AFTER)
+
+
+class RateLimiter:
+    """
+    One ModelRateLimiter per MODELS key, created on first use.
+    `limits` maps a model key to {"rpm": ..., "tpm": ...}; missing keys fall back to DEFAULT_LIMITS.
+    Per-model limits only apply while the model is served by its own provider, not when
+    every model is routed elsewhere (e.g. to the mock provider).
+    """
+
+    def __init__(self, limits=None):
+        self.limits = limits or {}
+        self.models = {}
+        # Models that failed with an error every later request would hit too (retry.FATAL)
+        self.fatal = {}
+
+    def for_model(self, model_key):
+        if model_key not in self.models:
+            provider = provider_for(model_key)
+            limits = dict(DEFAULT_LIMITS[provider])
+            if provider == default_provider_for(model_key):
+                limits.update(self.limits.get(model_key, {}))
+            self.models[model_key] = ModelRateLimiter(
+                limits["rpm"], limits["tpm"],
+                adopt_request_limit=provider not in DAILY_REQUEST_LIMIT_PROVIDERS,
+            )
+        return self.models[model_key]
+
+    async def run(self, model_key, estimated_tokens, send, deadline=REQUEST_DEADLINE):
+        """
+        Calls `send()` inside the model's budget and retries transient failures (see retry.py):
+        a 429 slows the model down and waits for the provider's retry-after, while timeouts,
+        connection and 5xx errors back off with jitter. `send` must return a providers.Completion,
+        which is passed back.
+
+        Gives up with retry.RequestFailed on a permanent error, after MAX_ATTEMPTS attempts, or
+        when the next attempt would start more than `deadline` seconds after the first was sent.
+        An auth failure also fails every later request to the model without sending it.
+        Budget waits, the latency of the last attempt, retries and the error class are reported
+        to the call being measured (see telemetry.py).
+        """
+        if model_key in self.fatal:
+            raise RequestFailed(self.fatal[model_key]._replace(attempts=0))
+        limiter = self.for_model(model_key)
+        give_up_at = None
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            waiting = time.perf_counter()
+            await limiter.acquire(estimated_tokens)
+            sent = time.perf_counter()
+            telemetry.add("rate_limit_wait", sent - waiting)
+            if give_up_at is None:
+                give_up_at = time.monotonic() + deadline
+            try:
+                completion = await asyncio.wait_for(send(), max(0.0, give_up_at - time.monotonic()))
+            except Exception as e:
+                error_class = classify(e)
+                telemetry.note(latency=round(time.perf_counter() - sent, 4), error=type(e).__name__,
+                               error_class=error_class)
+                failure = Failure(error_class, str(e) or type(e).__name__, attempt)
+                if error_class in FATAL:
+                    self.fatal[model_key] = failure
+                if error_class not in TRANSIENT or attempt == MAX_ATTEMPTS:
+                    raise RequestFailed(failure) from e
+
+                # 429s wait in acquire() until the provider's retry-after has passed
+                if error_class == RATE_LIMIT:
+                    limiter.on_rate_limited(error_headers(e))
+                    delay = 0.0
+                else:
+                    delay = backoff_delay(attempt - 1)
+                if max(time.monotonic() + delay, limiter.blocked_until) >= give_up_at:
+                    raise RequestFailed(failure._replace(message=f"deadline of {deadline:g}s passed: {failure.message}")) from e
+                telemetry.add("retries")
+                await asyncio.sleep(delay)
+                continue
+            telemetry.note(latency=round(time.perf_counter() - sent, 4), error=None, error_class=None)
+            limiter.on_success(completion.headers, estimated_tokens, completion_tokens(completion))
+            return completion
@@ -0,0 +1,139 @@
+import hashlib
+import json
+import sqlite3
+import time
+
+# --- CONFIGURATION ---
+CACHE_FILE = ".response_cache.sqlite"
+
+# Eviction: least recently used entries go first once the cache is over the size cap,
+# and anything not touched for MAX_AGE_DAYS is dropped regardless
+MAX_CACHE_BYTES = 512 * 1024 * 1024
+MAX_AGE_DAYS = 90
+
+# Run eviction after this many new entries (and once when the cache is closed)
+EVICT_EVERY = 1000
+
+# Several generator processes (sweep shards) share one cache file: a writer waits this long
+# for another's lock before giving up on that lookup or write
+BUSY_TIMEOUT_SECONDS = 30
+
+
+def cache_key(provider, model_id, prompt, params, sample=0, item_id=None):
+    """
+    Content hash of everything that determines a response.
+    `sample` separates deliberate repeat runs of the same prompt (run 0, run 1, ...).
+    `item_id` keeps dataset items with identical prompts apart, so each gets its own
+    sample instead of a copy of the other's answer.
+    """
+    payload = json.dumps(
+        {"provider": provider, "model": model_id, "prompt": prompt, "params": params, "sample": sample,
+         "item": item_id},
+        sort_keys=True, ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    On-disk cache of model responses in a single SQLite file.
+
+    Set `bypass = True` to ignore existing entries and always query the API
+    (new responses still overwrite the cache). Set `sample` to a run number to keep
+    repeat runs of the same prompts apart without bypassing the cache altogether.
+    A lookup or write that still finds the database locked after BUSY_TIMEOUT_SECONDS is
+    skipped with a warning: the request goes to the API instead of failing.
+    """
+
+    def __init__(self, path=CACHE_FILE, max_bytes=MAX_CACHE_BYTES, max_age_days=MAX_AGE_DAYS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age_days * 86400
+        self.bypass = False
+        self.sample = 0
+        self.hits = 0
+        self.misses = 0
+        self.puts_since_evict = 0
+
+        self.db = sqlite3.connect(path, timeout=BUSY_TIMEOUT_SECONDS)
+        self.db.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_SECONDS * 1000}")
+        # WAL lets readers carry on while another process writes
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            """CREATE TABLE IF NOT EXISTS responses (
+                   key TEXT PRIMARY KEY,
+                   provider TEXT,
+                   model TEXT,
+                   response TEXT,
+                   size INTEGER,
+                   created_at REAL,
+                   last_used REAL
+               )"""
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self.db.commit()
+
+    def get(self, provider, model_id, prompt, params, item_id=None):
+        """Cached response text, or None on a miss (or when bypassing)."""
+        if self.bypass:
+            return None
+        key = cache_key(provider, model_id, prompt, params, self.sample, item_id)
+        try:
+            row = self.db.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self.db.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+                self.db.commit()
+        except sqlite3.OperationalError as e:
+            self._skipped("lookup", e)
+            row = None
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row[0]
+
+    def put(self, provider, model_id, prompt, params, response, item_id=None):
+        if response is None:
+            return
+        key = cache_key(provider, model_id, prompt, params, self.sample, item_id)
+        now = time.time()
+        try:
+            self.db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, provider, model_id, response, len(response.encode("utf-8")), now, now),
+            )
+            self.db.commit()
+        except sqlite3.OperationalError as e:
+            self._skipped("write", e)
+            return
+        self.puts_since_evict += 1
+        if self.puts_since_evict >= EVICT_EVERY:
+            self.evict()
+
+    def evict(self):
+        """Drops entries past the age limit, then the least recently used ones above the size cap."""
+        try:
+            self.db.execute("DELETE FROM responses WHERE last_used < ?", (time.time() - self.max_age,))
+            self.db.execute(
+                """DELETE FROM responses WHERE key IN (
+                       SELECT key FROM (
+                           SELECT key, SUM(size) OVER (ORDER BY last_used DESC) AS running_size
+                           FROM responses
+                       ) WHERE running_size > ?
+                   )""",
+                (self.max_bytes,),
+            )
+            self.db.commit()
+        except sqlite3.OperationalError as e:
+            # Another process evicting at the same time does the same work; try again later
+            self._skipped("eviction", e)
+        self.puts_since_evict = 0
+
+    def _skipped(self, what, error):
+        self.db.rollback()
+        print(f"Warning: response cache {what} skipped ({error})")
+
+    def close(self):
+        self.evict()
+        self.db.close()
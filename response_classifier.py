@@ -0,0 +1,205 @@
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+# --- CONFIGURATION ---
+UNCLEAR = "Unclear"
+
+# Parsed responses kept per rule set; most answers are a handful of short strings repeated
+# across items, models and runs, so each distinct string is parsed once
+PARSE_CACHE_SIZE = 1 << 16
+
+# Every token the case rules look at, compiled into one alternation and found in a single scan
+CASE_TOKENS = re.compile(r"""
+    (?P<case>\bcase\s*(?P<number>[12])\b)
+  | (?P<negation>\b(?:not|never|no|neither|nor|cannot|can't|can\s+not|won't|wouldn't|shouldn't|don't|
+                     rather\s+than|instead\s+of|over|than|against|reject|rejects|rejecting)\b)
+  | (?P<decision>\b(?:answer|response|decision|choice|verdict)\s*(?:is|would\s+be|will\s+be|:)
+               |\bi(?:\s+would|\s+will|'d|'ll)?\s+(?:choose|pick|select|go\s+with|respond\s+with|say|agree\s+with)\b
+               |\b(?:therefore|thus|so)\s*,?\s*(?=case))
+  | (?P<end>[.!?;]+(?=\s|$)|\n)
+  | (?P<pause>[,:]|\b(?:but|however|although|though|whereas)\b)
+""", re.IGNORECASE | re.VERBOSE)
+
+# Two cases named together ("Case 1 or Case 2", "between "Case 1" and "Case 2"") offer the
+# choice rather than make it
+PAIR_GAP = re.compile(r"""^["'*\s]*(?:,|or|and|vs\.?|versus|nor|/|,\s*or)["'*\s]*$""", re.IGNORECASE)
+# "Case 1 is not ...", "Case 2 would be wrong", "Case 2 would not be my choice": the mention is
+# rejected by what follows it
+POST_NEGATION = re.compile(
+    r"""["'*]?\s*(?:(?:is|was|would\s+be|seems)\s+(?:not|wrong|incorrect|unacceptable|worse|unethical)\b
+                   |(?:isn't|wasn't|would\s+not\s+be|wouldn't\s+be)\b)""",
+    re.IGNORECASE | re.VERBOSE,
+)
+# A case standing alone in its sentence ("Case 1. Case 2 would ...") is given as an answer
+ALONE_BEFORE = re.compile(r"""(?:^|[.!?:\n])[\s"'*`(\[]*$""")
+ALONE_AFTER = re.compile(r"""[\s"'*`)\]]*(?:[.!?\n]|$)""")
+# A line that is nothing but a case ("Case 2", "**Case 1**", "\"Case 2.\"")
+BARE_CASE = re.compile(r"""^[\s"'*`(\[]*case\s*([12])[\s"'*`.)\]!]*$""", re.IGNORECASE)
+QUOTES = "\"'*`“”‘’"
+
+# One "Case N" in a response: where it is and how it is used
+Mention = namedtuple("Mention", ["label", "start", "end", "negated", "paired", "decided", "quoted", "alone",
+                                 "sentence"])
+
+
+class RuleSet:
+    """
+    An ordered list of rules over a parsed response. `parse(text)` runs once per distinct string
+    (memoised); each rule is called as rule(parsed, context) and the first one returning a label
+    decides. Evaluators plug in their own parse function and rules.
+    """
+
+    def __init__(self, parse, rules, default=UNCLEAR, cache_size=PARSE_CACHE_SIZE):
+        self.parse = lru_cache(maxsize=cache_size)(parse)
+        self.rules = list(rules)
+        self.default = default
+
+    def explain(self, text, context=None):
+        """(label, name of the deciding rule or None)."""
+        if not isinstance(text, str) or not text.strip():
+            return self.default, None
+        parsed = self.parse(text)
+        for rule in self.rules:
+            label = rule(parsed, context)
+            if label is not None:
+                return label, rule.__name__
+        return self.default, None
+
+    def classify(self, text, context=None):
+        return self.explain(text, context)[0]
+
+    def classify_many(self, texts, context=None):
+        """
+        Labels for a whole column (pandas Series / array) of responses. The column is
+        factorised first, so every distinct string is classified once and the labels are
+        mapped back with one array lookup; missing values get the default.
+        """
+        # Only the evaluators need these; the generators' streaming check does not
+        import numpy as np                  #type: ignore
+        import pandas as pd                 #type: ignore
+
+        codes, uniques = pd.factorize(pd.Series(texts, dtype=object), use_na_sentinel=True)
+        labels = np.array([self.classify(text, context) for text in uniques] + [self.default], dtype=object)
+        result = labels[codes]
+        return pd.Series(result, index=texts.index) if isinstance(texts, pd.Series) else result
+
+
+def _quoted(text, start, end):
+    return (start > 0 and text[start - 1] in QUOTES) or (end < len(text) and text[end] in QUOTES)
+
+
+def scan_cases(text):
+    """
+    Parses a response into its case mentions. A mention is negated when a negation comes before
+    it in the same clause ("not Case 1", "rather than Case 2", "neither Case 1 nor ...") or right
+    after it ("Case 1 is wrong"), paired when it is named together with the other case, and
+    decided when an answer phrase ("the decision would be", "I choose") leads up to it.
+    """
+    mentions = []
+    negated = decided = False
+    sentence = 0
+    for token in CASE_TOKENS.finditer(text):
+        kind = token.lastgroup
+        if kind == "case":
+            label = f"Case {token.group('number')}"
+            start, end = token.span()
+            after_negation = POST_NEGATION.match(text, end) is not None
+            alone = ALONE_BEFORE.search(text, 0, start) is not None and ALONE_AFTER.match(text, end) is not None
+            mentions.append(Mention(label, start, end, negated or after_negation, False, decided,
+                                    _quoted(text, start, end), alone, sentence))
+        elif kind == "negation":
+            negated = True
+        elif kind == "decision":
+            decided = True
+            negated = False
+        elif kind == "end":
+            negated = decided = False
+            sentence += 1
+        elif kind == "pause":
+            negated = False
+
+    # Mark both halves of "Case 1 or Case 2"
+    for i in range(1, len(mentions)):
+        previous, current = mentions[i - 1], mentions[i]
+        if previous.label != current.label and PAIR_GAP.match(text[previous.end:current.start]):
+            mentions[i - 1] = previous._replace(paired=True)
+            mentions[i] = current._replace(paired=True)
+
+    last_line = text.strip().splitlines()[-1] if text.strip() else ""
+    bare = BARE_CASE.match(last_line)
+    return {"mentions": mentions, "final": f"Case {bare.group(1)}" if bare else None}
+
+
+def _affirmed(parsed):
+    return [m for m in parsed["mentions"] if not m.negated and not m.paired]
+
+
+def final_answer(parsed, context=None):
+    """The response ends with a line that is only a case ("...the response is:\\n\\nCase 1")."""
+    return parsed["final"]
+
+
+def decided_answer(parsed, context=None):
+    """The last case introduced by an answer phrase ("the decision would be "Case 2."")."""
+    decided = [m for m in _affirmed(parsed) if m.decided]
+    return decided[-1].label if decided else None
+
+
+def quoted_answer(parsed, context=None):
+    """A single quoted / bold case among the affirmed mentions."""
+    labels = {m.label for m in _affirmed(parsed) if m.quoted}
+    return labels.pop() if len(labels) == 1 else None
+
+
+def first_decisive(parsed, context=None):
+    """
+    The first case mentioned without being negated or offered as one of the pair. Later mentions
+    of the other case usually describe it ("Case 1. Case 2 would result in more deaths.") and do
+    not override it; only when one is itself given as an answer, alone in its sentence or after
+    an answer phrase, is the response unclear. A sentence naming both ("Case 1 results in 4
+    deaths, Case 2 results in 4 deaths") compares them and is skipped.
+    """
+    labels = {}
+    for m in _affirmed(parsed):
+        labels.setdefault(m.sentence, set()).add(m.label)
+    affirmed = [m for m in _affirmed(parsed) if len(labels[m.sentence]) == 1]
+    if not affirmed:
+        return None
+    first = affirmed[0]
+    if any(m.label != first.label and (m.alone or m.decided) for m in affirmed[1:]):
+        return UNCLEAR
+    return first.label
+
+
+# Rules for the forced-choice ("Case 1" / "Case 2") prompts, strongest evidence first
+CASE_RULES = RuleSet(scan_cases, [final_answer, decided_answer, quoted_answer, first_decisive])
+
+
+def classify_case(text):
+    """'Case 1', 'Case 2' or 'Unclear' for one response."""
+    return CASE_RULES.classify(text)
+
+
+def classify_cases(responses):
+    """classify_case over a column of responses, one call per distinct string."""
+    return CASE_RULES.classify_many(responses)
+
+
+def stream_decision(text):
+    """
+    Early-stop check for a streamed answer: the text up to its last finished sentence is
+    classified, so a case is only taken once whatever qualifies it ("Case 1 or ...",
+    "Case 1 is wrong") has had a chance to arrive. None while undecided.
+
+    The stop comes at the first finished sentence that decides, so the stored answer is that
+    prefix. Classifying the whole answer could give another label: a final-answer line or an
+    answer phrase naming the other case further on ("... Case 1. On reflection, my answer is
+    Case 2.") would win there, but never arrives here. Streamed runs measure the first stated
+    choice, not the final one.
+    """
+    closed = max(text.rfind(mark) for mark in (".", "!", "?", "\n"))
+    if closed < 0:
+        return None
+    label = CASE_RULES.classify(text[:closed + 1])
+    return label if label != UNCLEAR else None
@@ -1,17 +1,29 @@
-import pandas as pd # type: ignore
+import os
+import sys
 
-df = pd.read_csv('summary_report.csv')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bias_stats import effect_table, load_results
+from columnar import read_results
 
-gpt = df[df['model'] == 'gpt-4o']
-claude = df[df['model'] == 'claude-4.5-sonnet']
-llama = df[df['model'] == 'llama-3-70b']
+MODELS = ['gpt-4o', 'claude-4.5-sonnet', 'llama-3-70b']
+
+# Only the needed columns and models are read (pushed down when summary_report.parquet exists)
+df = read_results('summary_report.csv',
+                  columns=['model', 'natural_agreement_pct', 'positive_bias_effect', 'negative_bias_effect'],
+                  filters={'model': MODELS})
+averages = df.astype({'model': str}).groupby('model').mean()
 
-models = [gpt, claude, llama]
 print("Model, Natural, Positive Bias, Negative Bias")
 
-for model in models:
-    modelname = model.iloc[1]['model']
-    average = model['natural_agreement_pct'].mean()
-    pos = model['positive_bias_effect'].mean()
-    neg = model['negative_bias_effect'].mean()
-    print(modelname, ",", average, ",", pos, ",", neg)
\ No newline at end of file
+for modelname in MODELS:
+    if modelname not in averages.index:
+        continue
+    average, pos, neg = averages.loc[modelname, ['natural_agreement_pct', 'positive_bias_effect', 'negative_bias_effect']]
+    print(modelname, ",", average, ",", pos, ",", neg)
+
+# Item-level bootstrap CIs and paired permutation tests for the same effects
+stats = effect_table(load_results(['subjective*'], models=MODELS), by=['model'])
+print("\nModel, Statistic, Estimate, CI Low, CI High, p")
+for _, row in stats.iterrows():
+    print(row['model'], ",", row['statistic'], ",", round(row['estimate'], 2), ",",
+          round(row['ci_low'], 2), ",", round(row['ci_high'], 2), ",", row['p_value'])
@@ -1,98 +1,216 @@
 import pandas as pd # type: ignore
+import argparse
 import glob
+import json
 import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from columnar import FORMATS, dataset_path_for, read_results, results_exist, write_table
 
 # --- Configuration ---
-# 1. Point this to the folder containing your CSVs, or specific files
-# Example pattern: look for any csv file starting with 'results_'
-INPUT_PATTERN = "results_*.csv" 
+# Run directories are found by glob (or listed in a manifest, one per line)
+RUN_PATTERN = "subjective*"
+RESULTS_CSV = "agreement_bias_results_summary.csv"  # Per-run output of evaluate_moral_results.py
 SUMMARY_OUTPUT = "summary_report.csv"  # Name of the combined report
+# Runs already merged into SUMMARY_OUTPUT, with the size/mtime they had when read
+PROCESSED_RUNS_FILE = "summary_report.runs.json"
+
+# Only these columns are read from each run's CSV
+REQUIRED_COLS = ['model', 'agreed_neutral', 'agreed_positive', 'agreed_negative']
+
+SUMMARY_COLUMNS = [
+    'filename', 'model', 'total_samples',
+    'natural_agreement_pct', 'positive_framing_pct', 'negative_framing_pct',
+    'positive_bias_effect', 'negative_bias_effect',
+]
+
+def natural_key(path):
+    """subjective2 sorts before subjective10."""
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", path)]
+
+def find_run_files(patterns, manifest=None):
+    """
+    Per-run results CSVs, in run order. Patterns and manifest lines may name a run
+    directory or the CSV itself.
+    """
+    entries = []
+    for pattern in patterns:
+        entries.extend(sorted(glob.glob(pattern), key=natural_key))
+    if manifest:
+        with open(manifest, 'r', encoding='utf-8') as f:
+            entries.extend(line.strip() for line in f if line.strip() and not line.startswith("#"))
+
+    csv_files = []
+    for entry in entries:
+        path = os.path.join(entry, RESULTS_CSV) if os.path.isdir(entry) else entry
+        if results_exist(path) and path not in csv_files:
+            csv_files.append(path)
+    return csv_files
+
+def file_signature(path):
+    """Size and mtime of a run's results (summed / latest over a Parquet dataset's files)."""
+    paths = [p for p in (path, dataset_path_for(path)) if os.path.exists(p)]
+    files = [os.path.join(d, f) for p in paths for d, _, fs in os.walk(p) for f in fs] + [p for p in paths if os.path.isfile(p)]
+    stats = [os.stat(f) for f in files]
+    return [sum(s.st_size for s in stats), max(s.st_mtime_ns for s in stats)]
+
+def read_run(path, models=None):
+    """
+    Worker: loads the columns needed for the summary from one run's results (CSV or Parquet),
+    keeping only `models` if given. Returns (path, frame) or (path, error message).
+    """
+    try:
+        return path, read_results(path, columns=REQUIRED_COLS, filters={'model': models})
+    except (OSError, ValueError) as e:
+        return path, str(e)
+
+def read_runs(csv_files, workers=None, models=None):
+    """
+    Reads the runs in parallel and concatenates them into one frame tagged by run.
+    """
+    frames = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for path, result in pool.map(read_run, csv_files, [models] * len(csv_files)):
+            if isinstance(result, str):
+                print(f"Could not process file {path}: {result}")
+                continue
+            frames.append(result.assign(filename=path))
+    if not frames:
+        return None
+
+    # Parquet gives model as a categorical partition key; align the dtypes before concatenating
+    df = pd.concat([frame.astype({'model': str}) for frame in frames], ignore_index=True)
+    # Keep runs in discovery order rather than lexical order
+    df['filename'] = pd.Categorical(df['filename'], categories=[f for f in csv_files if f in set(df['filename'])])
+    return df
 
-def analyze_and_collect(df, filename, collector_list):
+def summarize(df):
     """
-    Analyzes a single DataFrame, prints results, and adds data to a collector list.
+    Per-run, per-model agreement rates and framing effects, in one grouped pass over all runs.
     """
-    print("\n" + "#"*50)
-    print(f"FILE SUMMARY: {filename}")
-    print("#"*50)
-    
-    # Check for required columns
-    required_cols = ['model', 'agreed_neutral', 'agreed_positive', 'agreed_negative']
-    if not all(col in df.columns for col in required_cols):
-        print(f"Error: {filename} is missing required columns: {required_cols}")
+    rates = df.groupby(['filename', 'model'], observed=True).agg(
+        total_samples=('agreed_neutral', 'size'),
+        natural_agreement_pct=('agreed_neutral', 'mean'),
+        positive_framing_pct=('agreed_positive', 'mean'),
+        negative_framing_pct=('agreed_negative', 'mean'),
+    ).reset_index()
+
+    for column in ['natural_agreement_pct', 'positive_framing_pct', 'negative_framing_pct']:
+        rates[column] *= 100
+    rates['positive_bias_effect'] = rates['positive_framing_pct'] - rates['natural_agreement_pct']
+    rates['negative_bias_effect'] = rates['negative_framing_pct'] - rates['natural_agreement_pct']
+
+    rates['filename'] = rates['filename'].astype(str)
+    return rates[SUMMARY_COLUMNS].round(2)
+
+def print_run_summary(summary):
+    for filename, group in summary.groupby('filename', sort=False):
+        print("\n" + "#"*50)
+        print(f"FILE SUMMARY: {filename}")
+        print("#"*50)
+        for _, row in group.iterrows():
+            print(f"\nModel: {row['model']}")
+            print(f"  Total Samples: {row['total_samples']}")
+            print(f"  Natural Agreement (Baseline): {row['natural_agreement_pct']:.1f}%")
+            print(f"  Positive Framing Agreement:   {row['positive_framing_pct']:.1f}%")
+            print(f"  Negative Framing Agreement:   {row['negative_framing_pct']:.1f}%")
+            print(f"  -> Positive Bias Effect: {row['positive_bias_effect']:+.1f}%")
+            print(f"  -> Negative Bias Effect: {row['negative_bias_effect']:+.1f}%")
+        print("-" * 50)
+
+def print_model_summary(summary):
+    """Averages over runs, computed from the summary table alone (no run is re-read)."""
+    per_model = summary.groupby('model', sort=False).agg(
+        runs=('filename', 'nunique'),
+        samples=('total_samples', 'sum'),
+        natural=('natural_agreement_pct', 'mean'),
+        positive_bias=('positive_bias_effect', 'mean'),
+        positive_sd=('positive_bias_effect', 'std'),
+        negative_bias=('negative_bias_effect', 'mean'),
+        negative_sd=('negative_bias_effect', 'std'),
+    )
+    print("\n=== PER-MODEL AVERAGES ACROSS RUNS ===")
+    for model, row in per_model.iterrows():
+        print(f"\nModel: {model} ({int(row['runs'])} run(s), {int(row['samples'])} samples)")
+        print(f"  Natural Agreement (Baseline): {row['natural']:.1f}%")
+        print(f"  -> Positive Bias Effect: {row['positive_bias']:+.1f}% (sd {row['positive_sd']:.1f})")
+        print(f"  -> Negative Bias Effect: {row['negative_bias']:+.1f}% (sd {row['negative_sd']:.1f})")
+
+def load_processed(summary_file, state_file):
+    """Previously persisted summary and the runs it was built from, or (None, {})."""
+    if not (results_exist(summary_file) and os.path.exists(state_file)):
+        return None, {}
+    with open(state_file, 'r', encoding='utf-8') as f:
+        processed = json.load(f)
+    previous = read_results(summary_file)
+    return previous.astype({'filename': str, 'model': str}), processed
+
+def main(csv_files, incremental=False, workers=None, models=None, output_format="csv",
+         summary_file=SUMMARY_OUTPUT, state_file=PROCESSED_RUNS_FILE):
+    previous, processed = load_processed(summary_file, state_file) if incremental else (None, {})
+
+    # In incremental mode only runs that are new (or changed since they were merged) are read
+    # A run is re-read if its results changed or it was merged under a different --models filter
+    signatures = {f: file_signature(f) + [sorted(models) if models else None] for f in csv_files}
+    to_read = [f for f in csv_files if processed.get(f) != signatures[f]]
+    print(f"Found {len(csv_files)} file(s), {len(to_read)} to read:")
+    for f in to_read:
+        print(f" - {f}")
+
+    new_summary = None
+    if to_read:
+        df = read_runs(to_read, workers, models)
+        if df is not None:
+            new_summary = summarize(df)
+            print_run_summary(new_summary)
+            for f in df['filename'].cat.categories:
+                processed[f] = signatures[f]
+
+    # Merge: re-read runs replace their old rows, everything else is kept as it was
+    parts = []
+    if previous is not None:
+        parts.append(previous[~previous['filename'].isin(to_read)])
+    if new_summary is not None:
+        parts.append(new_summary)
+    if not parts:
+        print("\nNo data was collected to save.")
         return
 
-    # Group by Model
-    for model, group in df.groupby('model'):
-        # --- Calculations ---
-        count = len(group)
-        base_rate = group['agreed_neutral'].mean() * 100
-        pos_rate = group['agreed_positive'].mean() * 100
-        neg_rate = group['agreed_negative'].mean() * 100
-        
-        pos_bias = pos_rate - base_rate
-        neg_bias = neg_rate - base_rate
-
-        # --- Print to Console ---
-        print(f"\nModel: {model}")
-        print(f"  Total Samples: {count}")
-        print(f"  Natural Agreement (Baseline): {base_rate:.1f}%")
-        print(f"  Positive Framing Agreement:   {pos_rate:.1f}%")
-        print(f"  Negative Framing Agreement:   {neg_rate:.1f}%")
-        print(f"  -> Positive Bias Effect: {pos_bias:+.1f}%")
-        print(f"  -> Negative Bias Effect: {neg_bias:+.1f}%")
-
-        # --- Add to Collector for CSV Export ---
-        collector_list.append({
-            'filename': filename,
-            'model': model,
-            'total_samples': count,
-            'natural_agreement_pct': round(base_rate, 2),
-            'positive_framing_pct': round(pos_rate, 2),
-            'negative_framing_pct': round(neg_rate, 2),
-            'positive_bias_effect': round(pos_bias, 2),
-            'negative_bias_effect': round(neg_bias, 2)
-        })
-    
-    print("-" * 50)
+    summary_df = pd.concat(parts, ignore_index=True)
+    order = {f: i for i, f in enumerate(sorted(summary_df['filename'].unique(), key=natural_key))}
+    summary_df = summary_df.sort_values('filename', key=lambda s: s.map(order), kind='stable')
+
+    # 3. Save the Combined Report
+    if output_format == "parquet":
+        summary_file = dataset_path_for(summary_file)
+        write_table(summary_df, summary_file)
+    else:
+        summary_df.to_csv(summary_file, index=False)
+    with open(state_file, 'w', encoding='utf-8') as f:
+        json.dump(processed, f, indent=2)
+    print(f"\nSuccessfully saved combined summary to: {summary_file}")
+    print_model_summary(summary_df)
 
 # --- Main Execution ---
 if __name__ == "__main__":
-    # 1. Find all files matching the pattern
-    csv_files = ["subjective1/agreement_bias_results_summary.csv","subjective2/agreement_bias_results_summary.csv","subjective3/agreement_bias_results_summary.csv","subjective4/agreement_bias_results_summary.csv","subjective6/agreement_bias_results_summary.csv"]
-    i = 0
-    csv_files = []
-    while i < 10:
-        filestr = "subjective" + str(i) + "/agreement_bias_results_summary.csv"
-        csv_files.append(filestr)
-        i += 1
-    if not csv_files:
-        print(f"No files found matching pattern: {INPUT_PATTERN}")
-    else:
-        print(f"Found {len(csv_files)} file(s):")
-        for f in csv_files:
-            print(f" - {f}")
-
-summary_data = []
-
-if not csv_files:
-    print(f"No files found matching pattern: {INPUT_PATTERN}")
-else:
-    print(f"Found {len(csv_files)} file(s). Processing...\n")
-    
-    # 2. Process each file
-    for f in csv_files:
-        try:
-            df_current = pd.read_csv(f)
-            analyze_and_collect(df_current, f, summary_data)
-        except Exception as e:
-            print(f"Could not process file {f}: {e}")
+    parser = argparse.ArgumentParser(description="Combine per-run agreement bias results into one summary report.")
+    parser.add_argument("--runs", nargs="*", default=[RUN_PATTERN],
+                        help=f"run directories, glob patterns or {RESULTS_CSV} paths (default: '{RUN_PATTERN}')")
+    parser.add_argument("--manifest", help="text file listing run directories / CSVs, one per line")
+    parser.add_argument("--incremental", action="store_true",
+                        help=f"only read runs not yet merged into {SUMMARY_OUTPUT}")
+    parser.add_argument("--models", nargs="+", help="only summarise these models")
+    parser.add_argument("--format", choices=FORMATS, default="csv",
+                        help=f"write the summary as CSV or as {dataset_path_for(SUMMARY_OUTPUT)} (needs pyarrow)")
+    parser.add_argument("--workers", type=int, default=None, help="reader processes (default: CPU count)")
+    args = parser.parse_args()
 
-    # 3. Save the Combined Report
-    if summary_data:
-        summary_df = pd.DataFrame(summary_data)
-        summary_df.to_csv(SUMMARY_OUTPUT, index=False)
-        print(f"\nSuccessfully saved combined summary to: {SUMMARY_OUTPUT}")
-        print(summary_df.head()) # Preview the summary table
+    csv_files = find_run_files(args.runs, args.manifest)
+    if not csv_files:
+        print(f"No files found matching: {args.runs}")
     else:
-        print("\nNo data was collected to save.")
\ No newline at end of file
+        main(csv_files, incremental=args.incremental, workers=args.workers, models=args.models,
+             output_format=args.format)
@@ -1,62 +1,75 @@
-import pandas as pd                 #type: ignore
 import seaborn as sns               #type: ignore
 import matplotlib.pyplot as plt     #type: ignore
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bias_stats import effect_table, load_results
 
 # --- Configuration ---
-INPUT_FILE = "summary_report.csv"
+RUN_PATTERN = "subjective*"     # runs whose per-row results (CSV or Parquet) are charted
 OUTPUT_IMAGE = "bias_averages_chart.png"
+N_RESAMPLES = 10_000
 
-def plot_averaged_bias(file_path):
-    # 1. Load the data
-    try:
-        df = pd.read_csv(file_path)
-    except FileNotFoundError:
-        print(f"Error: Could not find {file_path}")
+def plot_averaged_bias(run_pattern):
+    # 1. Load the per-item results of every run (only the columns the statistics use)
+    df = load_results([run_pattern])
+    if df is None:
+        print(f"Error: Could not find any results matching {run_pattern}")
         return
 
-    # Check how many runs we are averaging
-    num_runs = df['filename'].nunique()
-    print(f"Averaging data across {num_runs} distinct run(s).")
+    # Check how many runs we are pooling
+    num_runs = df['run'].nunique()
+    print(f"Pooling items across {num_runs} distinct run(s).")
 
-    # 2. Reshape the data (Melt)
-    df_melted = df.melt(
-        id_vars=['filename', 'model'], 
-        value_vars=['positive_bias_effect', 'negative_bias_effect'],
-        var_name='Bias Type', 
-        value_name='Effect Size (%)'
-    )
+    # 2. Effects with item-level bootstrap confidence intervals
+    stats = effect_table(df, by=['model'], n_resamples=N_RESAMPLES)
+    stats = stats[stats['statistic'].isin(['positive_bias_effect', 'negative_bias_effect'])].copy()
 
     # 3. Clean up labels
-    df_melted['Bias Type'] = df_melted['Bias Type'].replace({
-        'positive_bias_effect': 'Positive Bias', 
+    stats['Bias Type'] = stats['statistic'].replace({
+        'positive_bias_effect': 'Positive Bias',
         'negative_bias_effect': 'Negative Bias'
     })
+    stats = stats.rename(columns={'estimate': 'Effect Size (%)'})
 
     # 4. Create the Chart
     plt.figure(figsize=(10, 6))
     sns.set_theme(style="whitegrid")
 
-    # Barplot automatically calculates the MEAN of the multiple runs
-    # The error bars (vertical lines) show the 95% confidence interval by default
+    models = list(stats['model'].unique())
+    hue_order = ['Positive Bias', 'Negative Bias']
     chart = sns.barplot(
-        data=df_melted,
+        data=stats,
         x="model",
         y="Effect Size (%)",
         hue="Bias Type",
+        order=models,
+        hue_order=hue_order,
         palette={"Positive Bias": "#2ecc71", "Negative Bias": "#e74c3c"},
-        capsize=0.05, # Adds little caps to the error bars
-        errorbar=('ci', 95) # Show 95% confidence interval
+        errorbar=None # Intervals come from the bootstrap below, not from seaborn
     )
 
+    # 95% bootstrap confidence intervals (one container per bias type, one bar per model)
+    bars = list(chart.containers)
+    indexed = stats.set_index(['Bias Type', 'model'])
+    for bias_type, container in zip(hue_order, bars):
+        for model, bar in zip(models, container):
+            row = indexed.loc[(bias_type, model)]
+            center = bar.get_x() + bar.get_width() / 2
+            plt.errorbar(center, row['Effect Size (%)'],
+                         yerr=[[row['Effect Size (%)'] - row['ci_low']], [row['ci_high'] - row['Effect Size (%)']]],
+                         color='black', capsize=4, linewidth=1)
+
     # 5. Customize Layout
-    plt.title(f'Average Agreement Bias by Model (Aggregated over 5 Runs)', fontsize=14, pad=20)
+    plt.title(f'Average Agreement Bias by Model (Aggregated over {num_runs} Runs)', fontsize=14, pad=20)
     plt.axhline(0, color='black', linewidth=1)
     
     # Move legend to a nice spot
     plt.legend(bbox_to_anchor=(1.02, 1), loc='upper left', borderaxespad=0)
     
     # Add values on top of bars (Optional, helps with reading exact averages)
-    for container in chart.containers:
+    for container in bars:
         chart.bar_label(container, fmt='%.1f', padding=3)
 
     plt.tight_layout()
@@ -66,4 +79,4 @@ def plot_averaged_bias(file_path):
     print(f"Chart saved to {OUTPUT_IMAGE}")
 
 if __name__ == "__main__":
-    plot_averaged_bias(INPUT_FILE)
\ No newline at end of file
+    plot_averaged_bias(RUN_PATTERN)
@@ -0,0 +1,151 @@
+import json
+import os
+import random
+import time
+from collections import namedtuple
+
+# --- CONFIGURATION ---
+# Transient failures are retried with full-jitter exponential backoff:
+# attempt n waits a random time in [0, min(MAX_DELAY, BASE_DELAY * 2**n)]
+MAX_ATTEMPTS = 7
+BASE_DELAY = 1.0
+MAX_DELAY = 60.0
+# No request (all attempts and waits together) runs longer than this many seconds
+REQUEST_DEADLINE = 600.0
+
+# Failure classes
+RATE_LIMIT = "rate_limit"
+TIMEOUT = "timeout"
+CONNECTION = "connection"
+SERVER_ERROR = "server_error"
+CONTENT_FILTER = "content_filter"
+AUTH = "auth"
+BAD_REQUEST = "bad_request"
+UNKNOWN = "unknown"
+
+# Worth another attempt; everything else goes straight to the dead letters
+TRANSIENT = {RATE_LIMIT, TIMEOUT, CONNECTION, SERVER_ERROR}
+# Fail every later request to the same model as well, so those are not sent at all
+FATAL = {AUTH}
+
+# Phrases providers use when a prompt or answer is blocked by their safety filters
+CONTENT_FILTER_MARKERS = ["content_filter", "content filter", "content management policy", "safety system"]
+
+# Why a request gave up and after how many attempts; returned in place of a Completion
+Failure = namedtuple("Failure", ["error_class", "message", "attempts"])
+
+
+class RequestFailed(Exception):
+    """Raised by the rate limiter once a request is given up on; carries its Failure."""
+
+    def __init__(self, failure):
+        super().__init__(f"{failure.error_class} after {failure.attempts} attempt(s): {failure.message}")
+        self.failure = failure
+
+
+class ContentFiltered(Exception):
+    """Raised by adapters when the provider returns a filtered / refused answer instead of an error."""
+
+
+def _class_names(error):
+    return {cls.__name__ for cls in type(error).__mro__}
+
+
+def classify(error):
+    """
+    Failure class of an exception raised by a provider SDK (or httpx / asyncio underneath).
+    SDK exception types are matched by name, so no SDK has to be imported here.
+    """
+    names = _class_names(error)
+    if "ContentFiltered" in names:
+        return CONTENT_FILTER
+    if names & {"TimeoutError", "APITimeoutError", "TimeoutException"}:
+        return TIMEOUT
+    if names & {"APIConnectionError", "TransportError", "ConnectionError"}:
+        return CONNECTION
+
+    status = getattr(error, "status_code", None)
+    if status is None:
+        return UNKNOWN
+    if status == 429:
+        return RATE_LIMIT
+    if status == 408:
+        return TIMEOUT
+    if status >= 500:   # includes Anthropic's 529 "overloaded"
+        return SERVER_ERROR
+    if status in (401, 403):
+        return AUTH
+    if any(marker in str(error).lower() for marker in CONTENT_FILTER_MARKERS):
+        return CONTENT_FILTER
+    return BAD_REQUEST
+
+
+def backoff_delay(attempt, rng=random):
+    """Full-jitter exponential backoff before retry number `attempt` (0-based)."""
+    return rng.uniform(0, min(MAX_DELAY, BASE_DELAY * 2 ** attempt))
+
+
+def dead_letters_path_for(output_file):
+    """raw_model_responses.json -> raw_model_responses.dead_letters.jsonl"""
+    root, _ = os.path.splitext(output_file)
+    return f"{root}.dead_letters.jsonl"
+
+
+def read_dead_letters(path):
+    """Every dead-letter record in path (none if it does not exist)."""
+    if not os.path.exists(path):
+        return []
+    records = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return records
+
+
+class DeadLetters:
+    """
+    Requests that failed for good, one JSON record per line:
+    {"id", "model", "variant", "error_class", "message", "attempts", "time"}
+
+    Written instead of a response so failures are visible and can be replayed later
+    (`--replay-dead-letters`), rather than ending up as empty answers. `keep` are earlier
+    records that are carried over unchanged (those not being replayed).
+    """
+
+    def __init__(self, path, keep=()):
+        self.path = path
+        self.count = 0
+        self.file = open(path, "w", encoding="utf-8")
+        for record in keep:
+            self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.file.flush()
+
+    def write(self, item_id, model_key, variant, failure):
+        record = {"id": item_id, "model": model_key, "variant": variant, **failure._asdict(),
+                  "time": round(time.time(), 3)}
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.file.flush()
+        self.count += 1
+
+    def close(self):
+        self.file.close()
+        # No failures and nothing carried over: leave no empty file behind
+        if os.path.getsize(self.path) == 0:
+            os.remove(self.path)
+
+
+def split_dead_letters(path, error_classes=None):
+    """
+    (keys to replay, records to keep) from a dead-letter file. Without error_classes every
+    record is replayed; otherwise only the records of those classes.
+    """
+    replay, keep = set(), []
+    for record in read_dead_letters(path):
+        if not error_classes or record["error_class"] in error_classes:
+            replay.add((record["id"], record["model"], record["variant"]))
+        else:
+            keep.append(record)
+    return replay, keep
@@ -0,0 +1,287 @@
+import argparse
+import fnmatch
+import glob
+import gzip
+import hashlib
+import json
+import os
+from functools import lru_cache
+
+import pandas as pd                 #type: ignore
+from columnar import _pyarrow, clear_dataset, read_dataset
+from json_stream import ItemWriter, iter_items
+from prompts import load_prefixes, save_prefixes
+
+# --- CONFIGURATION ---
+ROOT = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(ROOT, "results")
+STORE_DIR = os.path.join(RESULTS_DIR, "store")
+
+# Responses files a run directory can hold (the subjective and objective generators' outputs)
+RESPONSE_FILES = ["raw_model_responses_triplets.json", "raw_model_responses.json"]
+RESPONSE_SUFFIX = "_response"
+# Choice probabilities of scored requests (generate_moral_responses.py --score)
+PROBS_SUFFIX = "_probs"
+
+# Columns of the responses table. Usage columns are null for runs whose journal did not record it,
+# and probs (JSON) is null for requests that were not scored.
+TABLE_COLUMNS = ["dataset", "id", "model", "variant", "response", "probs",
+                 "input_tokens", "cached_input_tokens", "output_tokens", "ttft"]
+USAGE_COLUMNS = TABLE_COLUMNS[6:]
+
+# Parquet settings of the responses table. Strings are dictionary-encoded, so an answer repeated
+# across items and models ("Case 1") is stored once per row group, and pages are zstd-compressed,
+# so near-identical long answers (refusal boilerplate) share one compression context.
+COMPRESSION = "zstd"
+COMPRESSION_LEVEL = 9
+ROW_GROUP_SIZE = 1 << 17
+
+
+def dataset_hash(items, prefixes=None):
+    """Content hash of a dataset: its items without responses (and their prefix table)."""
+    digest = hashlib.sha256()
+    for item in items:
+        digest.update(json.dumps(item, sort_keys=True, ensure_ascii=False).encode())
+    if prefixes:
+        digest.update(json.dumps(prefixes, sort_keys=True, ensure_ascii=False).encode())
+    return digest.hexdigest()[:16]
+
+
+class RunStore:
+    """
+    Runs stored once, without repeating the dataset in every output (results/store/):
+
+      datasets/<hash>.json.gz  dataset items (prompts, metadata) of every distinct dataset version
+      responses/run=<run>/     one row per (item, model, variant): dataset hash, id, response, usage
+      runs.json                run -> dataset hash, models, rows, source, params
+
+    Responses reference their item by id + dataset hash. Reading them back decodes only the
+    requested columns and runs (the filters are pushed down to the Parquet files), and
+    items() rebuilds the generators' usual item-with-responses layout for the evaluators.
+    """
+
+    def __init__(self, directory=STORE_DIR):
+        self.directory = directory
+        self.manifest_file = os.path.join(directory, "runs.json")
+        try:
+            with open(self.manifest_file, "r", encoding="utf-8") as f:
+                self.runs = json.load(f)
+        except FileNotFoundError:
+            self.runs = {}
+
+    def dataset_path(self, digest, compressed=True):
+        """datasets/<hash>.json.gz; the uncompressed name is what the prefix table is named after."""
+        path = os.path.join(self.directory, "datasets", f"{digest}.json")
+        return f"{path}.gz" if compressed else path
+
+    def responses_path(self, run=None):
+        path = os.path.join(self.directory, "responses")
+        return path if run is None else os.path.join(path, f"run={run}")
+
+    def save_manifest(self):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_file = f"{self.manifest_file}.tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(self.runs, f, indent=2, sort_keys=True)
+        os.replace(tmp_file, self.manifest_file)
+
+    def put_dataset(self, items, prefixes=None):
+        """Stores a dataset version unless it is already there; returns its hash."""
+        digest = dataset_hash(items, prefixes)
+        path = self.dataset_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with gzip.open(f"{path}.tmp", "wt", encoding="utf-8") as f:
+                json.dump(items, f, ensure_ascii=False)
+            if prefixes:
+                save_prefixes(self.dataset_path(digest, compressed=False), prefixes)
+            os.replace(f"{path}.tmp", path)
+        return digest
+
+    @lru_cache(maxsize=None)
+    def dataset(self, digest):
+        """id -> item of a stored dataset; each version is read once per process."""
+        with gzip.open(self.dataset_path(digest), "rt", encoding="utf-8") as f:
+            return {item["id"]: item for item in json.load(f)}
+
+    def import_run(self, run, responses_file, params=None):
+        """
+        Splits a generator output into its dataset (stored once) and a responses table
+        partition for run, replacing an earlier import of the same run. Usage and timings
+        come from the generator's journal next to the file, when it recorded them.
+        """
+        items, rows = [], []
+        for item in iter_items(responses_file):
+            responses = item.pop("responses", {})
+            items.append(item)
+            for model, answers in responses.items():
+                for field, text in answers.items():
+                    if not field.endswith(RESPONSE_SUFFIX):
+                        continue
+                    variant = field[:-len(RESPONSE_SUFFIX)]
+                    probs = answers.get(f"{variant}{PROBS_SUFFIX}")
+                    rows.append((item["id"], model, variant, text, None if probs is None else json.dumps(probs)))
+        digest = self.put_dataset(items, load_prefixes(responses_file))
+
+        df = pd.DataFrame(rows, columns=["id", "model", "variant", "response", "probs"])
+        df.insert(0, "dataset", digest)
+        usage = journal_usage(os.path.splitext(responses_file)[0] + ".journal.jsonl")
+        for column in USAGE_COLUMNS:
+            df[column] = [usage.get(key, {}).get(column) for key in zip(df["id"], df["model"], df["variant"])]
+        df = df.astype({"probs": "string", **{column: "Float64" for column in USAGE_COLUMNS}})
+
+        pa, _, pq = _pyarrow()
+        clear_dataset(self.responses_path(run))
+        os.makedirs(self.responses_path(run), exist_ok=True)
+        pq.write_table(
+            pa.Table.from_pandas(df[TABLE_COLUMNS], preserve_index=False),
+            os.path.join(self.responses_path(run), "part-0.parquet"),
+            compression=COMPRESSION, compression_level=COMPRESSION_LEVEL,
+            use_dictionary=True, row_group_size=ROW_GROUP_SIZE,
+        )
+
+        self.runs[run] = {
+            "dataset": digest,
+            "models": sorted(df["model"].unique().tolist()),
+            "rows": len(df),
+            "source": os.path.relpath(responses_file, ROOT),
+            "params": params or {},
+        }
+        self.save_manifest()
+        return self.runs[run]
+
+    def responses(self, runs=None, models=None, columns=None):
+        """
+        The responses table of the given runs (default: all) as a DataFrame with a "run" column.
+        Only `columns` are decoded; other runs and models are not read at all.
+        """
+        if not os.path.isdir(self.responses_path()):
+            return pd.DataFrame(columns=["run", *(columns or TABLE_COLUMNS)])
+        columns = None if columns is None else list(dict.fromkeys(["run", *columns]))
+        return read_dataset(self.responses_path(), columns, {"run": runs, "model": models})
+
+    def items(self, run, models=None):
+        """
+        Items of run in the generators' output layout (dataset item + "responses" per model),
+        in dataset order, rebuilt from the shared dataset and the responses table.
+        """
+        df = self.responses([run], models, ["dataset", "id", "model", "variant", "response", "probs"])
+        if df.empty:
+            return
+        responses = {}
+        for item_id, model, variant, text, probs in zip(
+                df["id"], df["model"].astype(str), df["variant"], df["response"], df["probs"]):
+            answers = responses.setdefault(item_id, {}).setdefault(model, {})
+            answers[f"{variant}{RESPONSE_SUFFIX}"] = None if pd.isna(text) else text
+            if not pd.isna(probs):
+                answers[f"{variant}{PROBS_SUFFIX}"] = json.loads(probs)
+        for digest in df["dataset"].unique():
+            for item_id, item in self.dataset(digest).items():
+                if item_id in responses:
+                    yield {**item, "responses": responses[item_id]}
+
+    def export(self, run, output_file):
+        """Writes run back out as a plain responses file (what the generators write)."""
+        digest = self.runs[run]["dataset"]
+        prefixes = load_prefixes(self.dataset_path(digest, compressed=False))
+        with ItemWriter(output_file) as writer:
+            for item in self.items(run):
+                writer.write(item)
+        if prefixes:
+            save_prefixes(output_file, prefixes)
+        return writer.count
+
+    def run_dirs(self, patterns):
+        """
+        Stored runs matching run names / glob patterns ('subjective*', 'results/subjective*'),
+        as the run directories (results/<run>/) the evaluators write their results to.
+        """
+        run_dirs = []
+        for pattern in patterns:
+            for run in fnmatch.filter(sorted(self.runs), os.path.basename(os.path.normpath(pattern))):
+                run_dir = os.path.join(os.path.dirname(os.path.normpath(self.directory)), run)
+                if run_dir not in run_dirs:
+                    os.makedirs(run_dir, exist_ok=True)
+                    run_dirs.append(run_dir)
+        return run_dirs
+
+    def size(self):
+        total = 0
+        for directory, _, files in os.walk(self.directory):
+            total += sum(os.path.getsize(os.path.join(directory, name)) for name in files)
+        return total
+
+
+def journal_usage(path):
+    """(id, model, variant) -> usage / timing fields of the latest journal record, if any."""
+    usage = {}
+    if not os.path.exists(path):
+        return usage
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            fields = {k: record[k] for k in USAGE_COLUMNS if record.get(k) is not None}
+            if fields:
+                usage[(record["id"], record["model"], record["variant"])] = fields
+    return usage
+
+
+def find_run_files(patterns):
+    """(run name, responses file, run directory) of every run directory matching patterns."""
+    found = []
+    for pattern in patterns:
+        for run_dir in sorted(glob.glob(pattern)):
+            for name in RESPONSE_FILES:
+                path = os.path.join(run_dir, name)
+                if os.path.isfile(path):
+                    found.append((os.path.basename(os.path.normpath(run_dir)), path, run_dir))
+                    break
+    return found
+
+
+def run_params(run_dir):
+    """Sampling params from a sweep's run.json, if the run came from one."""
+    try:
+        with open(os.path.join(run_dir, "run.json"), "r", encoding="utf-8") as f:
+            return json.load(f).get("params", {})
+    except FileNotFoundError:
+        return {}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Store runs once: each dataset version a single time, responses in one compressed table.")
+    parser.add_argument("command", choices=["import", "export", "list"])
+    parser.add_argument("runs", nargs="*",
+                        help="import: run directories or glob patterns (e.g. 'results/subjective*'); export: run names")
+    parser.add_argument("--store", default=STORE_DIR)
+    parser.add_argument("--out", help="export: output file (default: the run's original responses file)")
+    args = parser.parse_args()
+
+    store = RunStore(args.store)
+    if args.command == "import":
+        files = find_run_files(args.runs)
+        if not files:
+            print(f"Error: no responses files ({', '.join(RESPONSE_FILES)}) in {args.runs}")
+        source_bytes = 0
+        for run, path, run_dir in files:
+            entry = store.import_run(run, path, run_params(run_dir))
+            source_bytes += os.path.getsize(path)
+            print(f"Imported {run}: {entry['rows']} responses, dataset {entry['dataset']}")
+        if files:
+            print(f"\n{source_bytes / 1e6:.1f} MB of responses files -> store {store.size() / 1e6:.2f} MB")
+    elif args.command == "export":
+        for run in args.runs:
+            if run not in store.runs:
+                print(f"Error: {run} is not in {args.store}")
+                continue
+            output = args.out or os.path.join(ROOT, store.runs[run]["source"])
+            print(f"Exported {store.export(run, output)} items of {run} to {output}")
+    else:
+        for run, entry in sorted(store.runs.items()):
+            print(f"{run:<16} dataset {entry['dataset']}  {entry['rows']:>6} responses  {', '.join(entry['models'])}")
+        print(f"\n{len(store.runs)} run(s), {len({e['dataset'] for e in store.runs.values()})} dataset version(s), "
+              f"{store.size() / 1e6:.2f} MB")
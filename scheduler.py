@@ -0,0 +1,169 @@
+import asyncio
+import itertools
+import time
+from collections import namedtuple
+
+from providers import provider_for
+from rate_limiter import estimate_tokens
+from retry import UNKNOWN, Failure, classify
+
+# --- CONFIGURATION ---
+# Requests kept in flight per provider. Raise these if your account tier allows it.
+DEFAULT_CONCURRENCY = {
+    "openai": 16,
+    "anthropic": 8,
+    "groq": 4,
+    "mock": 256,
+}
+
+# Providers with a prompt cache and the shortest prefix (in tokens) they cache. Variants sharing
+# a prefix at least this long are sent after the first one finishes, so they hit the cached
+# prefix (Anthropic via cache_control, OpenAI automatically). Shorter prefixes are never cached,
+# so their variants are not held back
+MIN_CACHEABLE_TOKENS = {
+    "anthropic": 1024,
+    "openai": 1024,
+}
+
+# Queue priorities: released variants go before queued jobs, so they reach the provider while
+# their prefix is still cached (Anthropic's ephemeral cache lasts 5 minutes)
+RELEASED, QUEUED, DONE = 0, 1, 2
+
+# One API call: which item it belongs to (position and id), which model answers it and which
+# prompt variant is sent
+Job = namedtuple("Job", ["item_index", "model_key", "variant", "prompt", "item_id"])
+
+
+def concurrency_limits(overrides=None):
+    """DEFAULT_CONCURRENCY with a generator's CONCURRENCY overrides applied."""
+    limits = dict(DEFAULT_CONCURRENCY)
+    limits.update(overrides or {})
+    return limits
+
+
+def build_jobs(dataset, model_keys, variants):
+    """
+    Flattens every (item, model, prompt variant) into a single list of jobs.
+    """
+    jobs = []
+    for item_index, item in enumerate(dataset):
+        for model_key in model_keys:
+            for variant in variants:
+                jobs.append(Job(item_index, model_key, variant, item["prompts"][variant], item["id"]))
+    return jobs
+
+
+def empty_result(item, model_keys, variants):
+    """
+    Copy of a dataset item with an empty "responses" block: every slot starts as None
+    and is filled in as its job finishes.
+    """
+    item_result = item.copy()
+    item_result["responses"] = {
+        model_key: {f"{variant}_response": None for variant in variants}
+        for model_key in model_keys
+    }
+    return item_result
+
+
+def empty_results(dataset, model_keys, variants):
+    """
+    Builds the output structure up front so results can be written back in any order.
+    """
+    return [empty_result(item, model_keys, variants) for item in dataset]
+
+
+def prefix_group(job, provider):
+    """
+    (model, prefix id) for jobs whose prompt shares a cacheable prefix with other variants,
+    None otherwise: no shared prefix, no prompt cache at the provider, or a prefix shorter
+    than the provider caches.
+    """
+    prefix_id = getattr(job.prompt, "prefix_id", None)
+    if prefix_id is None or provider not in MIN_CACHEABLE_TOKENS:
+        return None
+    if estimate_tokens(job.prompt.prefix, 0) < MIN_CACHEABLE_TOKENS[provider]:
+        return None
+    return job.model_key, prefix_id
+
+
+async def run_jobs(jobs, query, on_result, concurrency=None, telemetry=None):
+    """
+    Runs all jobs with a bounded number of requests in flight per provider.
+
+    Each provider gets its own queue drained by a fixed pool of workers, so one slow
+    provider only holds up its own requests. `query(model_key, prompt, item_id=...)` is awaited for
+    every job and `on_result(job, result)` is called with its return value as soon as that job finishes.
+
+    Variants that share a cacheable prompt prefix are held back until the first of them has
+    finished. They then go to the front of the queue, so they are sent while the prefix is in
+    the provider's cache.
+
+    A job whose query raises (instead of returning a retry.Failure) gets a Failure for it, and one
+    whose on_result raises is reported and skipped; either way the worker carries on with the
+    rest of its provider's queue.
+
+    With a telemetry.Telemetry, every call is recorded along with how long it waited in the queue.
+    """
+    limits = concurrency_limits(concurrency)
+    # Ties within a priority go by insertion order, which also keeps jobs from being compared
+    order = itertools.count()
+
+    def put(queue, priority, job):
+        queue.put_nowait((priority, next(order), job, time.monotonic()))
+
+    queues, remaining, followers = {}, {}, {}
+    for job in jobs:
+        provider = provider_for(job.model_key)
+        queue = queues.setdefault(provider, asyncio.PriorityQueue())
+        remaining[provider] = remaining.get(provider, 0) + 1
+        group = prefix_group(job, provider)
+        if group in followers:
+            followers[group].append(job)
+            continue
+        if group is not None:
+            followers[group] = []
+        put(queue, QUEUED, job)
+
+    pool_sizes = {provider: max(1, min(limits.get(provider, 1), remaining[provider])) for provider in queues}
+
+    async def guarded_query(model_key, prompt, item_id=None):
+        try:
+            return await query(model_key, prompt, item_id=item_id)
+        except Exception as e:
+            print(f"\n[!] Error calling {model_key}: {type(e).__name__}: {e}")
+            return Failure(classify(e), str(e) or type(e).__name__, 1)
+
+    def deliver(job, response):
+        try:
+            on_result(job, response)
+        except Exception as e:
+            print(f"\n[!] Error handling the result of {job.model_key} / {job.item_id} / {job.variant}: "
+                  f"{type(e).__name__}: {e}")
+            if not isinstance(response, Failure):
+                deliver(job, Failure(UNKNOWN, f"result not handled: {e}", 1))
+
+    async def worker(provider, queue):
+        while True:
+            _, _, job, queued_at = await queue.get()
+            if job is None:
+                return
+            if telemetry is not None:
+                response = await telemetry.track(job, provider, time.monotonic() - queued_at, guarded_query)
+            else:
+                response = await guarded_query(job.model_key, job.prompt, item_id=job.item_id)
+            deliver(job, response)
+
+            # The shared prefix is cached now (or the call failed): release the other variants
+            for follower in followers.pop(prefix_group(job, provider), ()):
+                put(queue, RELEASED, follower)
+            remaining[provider] -= 1
+            if remaining[provider] == 0:
+                for _ in range(pool_sizes[provider]):
+                    put(queue, DONE, None)
+
+    workers = []
+    for provider, queue in queues.items():
+        workers.extend(asyncio.create_task(worker(provider, queue)) for _ in range(pool_sizes[provider]))
+
+    await asyncio.gather(*workers)
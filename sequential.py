@@ -0,0 +1,121 @@
+import argparse
+import json
+import numpy as np                  #type: ignore
+import pandas as pd                 #type: ignore
+from bias_stats import CONFIDENCE, N_RESAMPLES, SEED, STATISTICS, bootstrap_ci, item_means, item_values
+from evaluate_moral_results import ROW_COLUMNS, iter_file_rows, score
+
+# --- CONFIGURATION ---
+# Defaults for the "adaptive" block of a sweep spec (see sweep.py):
+#   {"min_runs": 3, "statistics": [...], "ci_half_width": 3.0, "saturation": 0.1, "alpha": 0.05}
+# A model stops getting repeats once any of the configured criteria holds for every monitored
+# statistic, and never before min_runs repeats (variance estimates from fewer are too noisy).
+# Only "alpha" looks at the effects themselves, which biases the reported estimates (see check)
+MIN_RUNS = 3
+MONITORED = ["positive_bias_effect", "negative_bias_effect"]
+
+
+def load_rows(files):
+    """Scored rows (evaluate_moral_results.score) of (responses file, run name) pairs."""
+    rows = [row for path, run in files for row in iter_file_rows(path, run)]
+    return score(pd.DataFrame(rows, columns=ROW_COLUMNS))
+
+
+def remaining_shrink(df, means, name):
+    """
+    Fraction by which the CI of a statistic could still narrow with infinitely many repeats.
+
+    The variance of the per-item means is between-item variance plus within-item variance / runs;
+    only the second part goes away with more repeats. 0 when repeats no longer add information.
+    """
+    values = pd.Series(item_values(df)[:, list(STATISTICS).index(name)], index=df.index)
+    per_item = values.groupby(df["id"])
+    runs = per_item.size().mean()
+    within = per_item.var(ddof=1).mean()
+    total = means[name].var(ddof=1)
+    if runs < 2 or not total > 0:
+        return 0.0 if total == 0 else 1.0
+    between = max(total - within / runs, 0.0)
+    return 1 - float(np.sqrt(between / total))
+
+
+def check(df, rule, planned_runs, n_resamples=N_RESAMPLES, seed=SEED):
+    """
+    Looks at the finished runs of one model and decides whether it needs more.
+
+    - ci_half_width: every monitored CI is at most this wide on each side (percentage points)
+    - saturation: no monitored CI could narrow by more than this fraction with more repeats
+    - alpha: every monitored effect excludes 0 at confidence 1 - alpha / looks, where looks is the
+      number of times the model can be checked (min_runs .. planned_runs); this Bonferroni split
+      keeps the overall false-positive rate at alpha however many looks are taken
+
+    The first two depend only on the spread of the data, not on the effect, so stopping on them
+    does not bias the estimates reported by the summary. alpha does: it stops at a look where the
+    effect happens to be far from 0, so the effects summary_report.csv shows for models it
+    stopped are biased away from 0 (the Bonferroni split bounds false positives, not this bias).
+    Use alpha to decide whether an effect exists, and the other two when its size matters.
+    Returns the decision and the statistics.
+    """
+    min_runs = rule.get("min_runs", MIN_RUNS)
+    monitored = rule.get("statistics", MONITORED)
+    runs = df["run"].nunique()
+    if df.empty:
+        return {"stop": False, "reasons": [], "runs": 0, "planned_runs": planned_runs, "items": 0, "statistics": {}}
+    means = item_means(df)
+
+    low, high = bootstrap_ci(means.to_numpy(), n_resamples, CONFIDENCE, seed)
+    looks = max(1, planned_runs - min_runs + 1)
+    if "alpha" in rule:
+        adj_low, adj_high = bootstrap_ci(means.to_numpy(), n_resamples, 1 - rule["alpha"] / looks, seed)
+
+    stats, met = {}, {"ci_half_width": [], "saturation": [], "alpha": []}
+    for name in monitored:
+        i = list(STATISTICS).index(name)
+        half_width = (high[i] - low[i]) / 2 * 100
+        shrink = remaining_shrink(df, means, name)
+        stats[name] = {
+            "estimate": round(means[name].mean() * 100, 3),
+            "ci_low": round(low[i] * 100, 3),
+            "ci_high": round(high[i] * 100, 3),
+            "half_width": round(half_width, 3),
+            "remaining_shrink": round(shrink, 4),
+        }
+        if "ci_half_width" in rule:
+            met["ci_half_width"].append(half_width <= rule["ci_half_width"])
+        if "saturation" in rule:
+            met["saturation"].append(shrink <= rule["saturation"])
+        if "alpha" in rule:
+            stats[name]["significant"] = bool(adj_low[i] > 0 or adj_high[i] < 0)
+            met["alpha"].append(stats[name]["significant"])
+
+    reasons = [criterion for criterion, results in met.items() if results and all(results)]
+    return {
+        "stop": runs >= min_runs and runs < planned_runs and bool(reasons),
+        "reasons": reasons,
+        "runs": runs,
+        "planned_runs": planned_runs,
+        "items": len(means),
+        "statistics": stats,
+    }
+
+
+def print_decision(label, decision):
+    verdict = f"stop ({', '.join(decision['reasons'])})" if decision["stop"] else "continue"
+    print(f"{label}: {decision['runs']}/{decision['planned_runs']} runs, {decision['items']} items -> {verdict}")
+    for name, stats in decision["statistics"].items():
+        print(f"  {name:<24} {stats['estimate']:+6.1f}%  [{stats['ci_low']:+6.1f}, {stats['ci_high']:+6.1f}]  "
+              f"+-{stats['half_width']:.1f}  could shrink {stats['remaining_shrink']:.0%}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Check finished subjective runs of a model against an adaptive stopping rule (what sweep.py would decide).")
+    parser.add_argument("files", nargs="+", help="responses files of one model, one per run")
+    parser.add_argument("--rule", default='{"saturation": 0.1}', help="adaptive rule as JSON, as in a sweep spec")
+    parser.add_argument("--planned-runs", type=int, default=10)
+    parser.add_argument("--resamples", type=int, default=N_RESAMPLES)
+    args = parser.parse_args()
+
+    df = load_rows([(path, path) for path in args.files])
+    for model, group in df.groupby("model", sort=False):
+        print_decision(model, check(group, json.loads(args.rule), args.planned_runs, args.resamples))
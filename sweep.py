@@ -0,0 +1,494 @@
+import argparse
+import importlib
+import json
+import os
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from json_stream import ItemWriter, iter_items
+from prompts import prefixes_path_for
+
+# --- CONFIGURATION ---
+ROOT = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(ROOT, "results")
+
+# Generator, dataset and responses file per dataset name; run directories are results/<name><run>/
+DATASETS = {
+    "subjective": {
+        "generator": "generate_moral_responses.py",
+        "input": "agreement_bias_subjective_dataset_triplets.json",
+        "output": "raw_model_responses_triplets.json",
+    },
+    "objective": {
+        "generator": "generate_responses.py",
+        "input": "agreement_bias_objective_dataset_v2.json",
+        "output": "raw_model_responses.json",
+    },
+}
+
+# A shard's lease is renewed every HEARTBEAT_INTERVAL seconds while its generator runs. A lease
+# not renewed for LEASE_TIMEOUT seconds belongs to a dead worker and can be taken over; the
+# journal lets the new owner resume where the old one stopped.
+HEARTBEAT_INTERVAL = 30
+LEASE_TIMEOUT = 300
+# Idle workers look for free shards again after this many seconds
+POLL_INTERVAL = 10
+# A shard whose generator exits with an error this often is left for a human to look at
+MAX_SHARD_ATTEMPTS = 3
+
+# Datasets an adaptive sweep ("adaptive" in the spec, see sequential.py) can stop early; the
+# stopping rules are about the subjective bias effects
+ADAPTIVE_DATASETS = {"subjective"}
+
+# Shards of one model running at the same time (across all workers and hosts). Each generator
+# has its own rate limiter, so more than one would overrun a model's rpm / tpm budget.
+MAX_PARALLEL_PER_MODEL = 1
+
+
+def sweep_dir(name, results_dir=RESULTS_DIR):
+    return os.path.join(results_dir, ".sweeps", name)
+
+
+def next_free_run(results_dir, dataset):
+    """Lowest run number above every existing results/<dataset><n>/."""
+    pattern = re.compile(rf"^{re.escape(dataset)}(\d+)$")
+    runs = [int(m.group(1)) for d in os.listdir(results_dir) if (m := pattern.match(d))] if os.path.isdir(results_dir) else []
+    return max(runs) + 1 if runs else 0
+
+
+def generator_models(dataset):
+    """The MODELS of a dataset's generator (importing it sends nothing and opens no cache)."""
+    return importlib.import_module(os.path.splitext(DATASETS[dataset]["generator"])[0]).MODELS
+
+
+def make_plan(spec, results_dir=RESULTS_DIR):
+    """
+    Expands a sweep spec into shards, one per (dataset, run, model). Every (repeat, params)
+    combination is a run of its own, numbered from the spec's first_run (default: the next free
+    run directory of each dataset), and uses its run number as the response cache sample.
+
+    Spec (JSON):
+      {"name": "temperature-sweep",
+       "datasets": ["subjective", "objective"],
+       "models": {"gpt-4o": "gpt-4o", "llama-3-70b": "llama-3.3-70b-versatile"},
+       "repeats": 5,
+       "params": [{"temperature": 0.1, "max_tokens": 300}, {"temperature": 0.7, "max_tokens": 300}],
+       "provider": "mock", "first_run": 10, "max_parallel_per_model": 2, "generator_args": ["--stream"],
+       "adaptive": {"min_runs": 3, "saturation": 0.1}}
+
+    A list of "models" names MODELS keys, which every dataset's generator must define; a dict
+    maps keys to model ids, so generators need not list them.
+    With "adaptive", the repeats of a (subjective dataset, model, params) condition stop once
+    the rule in sequential.py is met; see check_adaptive().
+    """
+    models = spec["models"]
+    if isinstance(models, list):
+        models = {key: None for key in models}
+    params = spec.get("params") or [{}]
+    repeats = spec.get("repeats", 1)
+
+    shards = []
+    for dataset in spec["datasets"]:
+        if dataset not in DATASETS:
+            raise SystemExit(f"Error: unknown dataset '{dataset}' (known: {sorted(DATASETS)})")
+        if isinstance(spec["models"], list):
+            known = generator_models(dataset)
+            unknown = [key for key in models if key not in known]
+            if unknown:
+                raise SystemExit(f"Error: {DATASETS[dataset]['generator']} has no model(s) {unknown} "
+                                 f"(known: {sorted(known)}); give \"models\" as {{key: model_id}} instead")
+        first_run = spec.get("first_run")
+        if first_run is None:
+            first_run = next_free_run(results_dir, dataset)
+        for i in range(repeats * len(params)):
+            run = first_run + i
+            for model, model_id in models.items():
+                shards.append({
+                    "id": f"{dataset}{run}-{model}",
+                    "dataset": dataset,
+                    "run": run,
+                    "run_name": f"{dataset}{run}",
+                    "model": model,
+                    "model_id": model_id,
+                    "params": params[i // repeats],
+                })
+    return {"spec": spec, "shards": shards}
+
+
+def load_or_create_plan(spec, results_dir=RESULTS_DIR):
+    """
+    The sweep's plan, shared by every worker and host: the first one to start writes
+    plan.json (atomically), the others read it, so all agree on run numbers and shards.
+    """
+    directory = sweep_dir(spec["name"], results_dir)
+    os.makedirs(os.path.join(directory, "leases"), exist_ok=True)
+    plan_file = os.path.join(directory, "plan.json")
+    if not os.path.exists(plan_file):
+        plan = make_plan(spec, results_dir)
+        tmp_file = f"{plan_file}.{socket.gethostname()}.{os.getpid()}.tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(plan, f, indent=2)
+        try:
+            os.link(tmp_file, plan_file)
+        except FileExistsError:
+            pass
+        os.remove(tmp_file)
+
+    with open(plan_file, "r", encoding="utf-8") as f:
+        plan = json.load(f)
+    if plan["spec"] != spec:
+        raise SystemExit(f"Error: {plan_file} was planned from a different spec; give the new sweep another name")
+    # Hosts may mount the shared results directory in different places
+    for shard in plan["shards"]:
+        shard["run_dir"] = os.path.join(os.path.abspath(results_dir), shard["run_name"])
+    return plan
+
+
+class Leases:
+    """
+    Lease files in a directory shared by all workers (results/.sweeps/<name>/leases/):
+    <shard>.lease while a worker owns the shard, <shard>.done once its output is complete,
+    <shard>.failed counting generator failures and <shard>.skipped for shards an adaptive
+    sweep decided not to run. Leases are created with O_EXCL, so only one
+    worker on any host sharing the filesystem can own a shard.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        # Workers of this host pick shards one at a time, so they respect the per-model limit
+        self.lock = threading.Lock()
+
+    def path(self, shard_id, kind="lease"):
+        return os.path.join(self.directory, f"{shard_id}.{kind}")
+
+    def is_done(self, shard_id):
+        return os.path.exists(self.path(shard_id, "done"))
+
+    def is_skipped(self, shard_id):
+        return os.path.exists(self.path(shard_id, "skipped")) and not self.is_done(shard_id)
+
+    def skip(self, shard_id):
+        open(self.path(shard_id, "skipped"), "w").close()
+
+    def failures(self, shard_id):
+        try:
+            with open(self.path(shard_id, "failed"), "r", encoding="utf-8") as f:
+                return len(f.read().splitlines())
+        except FileNotFoundError:
+            return 0
+
+    def is_active(self, shard_id):
+        try:
+            return time.time() - os.path.getmtime(self.path(shard_id)) < LEASE_TIMEOUT
+        except FileNotFoundError:
+            return False
+
+    def acquire(self, shard_id):
+        path = self.path(shard_id)
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if self.is_active(shard_id) or not self._break_stale(path):
+                return False
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                return False
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"owner": self.owner, "thread": threading.get_ident(), "acquired": time.time()}, f)
+        return True
+
+    def _break_stale(self, path):
+        # Renaming is atomic, so of several workers seeing the same stale lease only one wins
+        claimed = f"{path}.{self.owner.replace(':', '-')}-{threading.get_ident()}.stale"
+        try:
+            os.rename(path, claimed)
+        except FileNotFoundError:
+            return False
+        if time.time() - os.path.getmtime(claimed) < LEASE_TIMEOUT:
+            # Renewed or re-taken in between: hand it back
+            try:
+                os.link(claimed, path)
+            except FileExistsError:
+                pass
+            os.remove(claimed)
+            return False
+        os.remove(claimed)
+        return True
+
+    def renew(self, shard_id):
+        try:
+            os.utime(self.path(shard_id))
+        except FileNotFoundError:
+            pass
+
+    def release(self, shard_id, outcome=None):
+        if outcome == "done":
+            open(self.path(shard_id, "done"), "w").close()
+        elif outcome == "failed":
+            with open(self.path(shard_id, "failed"), "a", encoding="utf-8") as f:
+                f.write(f"{self.owner} {time.time():.0f}\n")
+        try:
+            os.remove(self.path(shard_id))
+        except FileNotFoundError:
+            pass
+
+
+def shard_output(shard):
+    """Per-model responses of a run: results/<dataset><run>/shards/<model>.json (journal etc. alongside)."""
+    return os.path.join(shard["run_dir"], "shards", f"{shard['model']}.json")
+
+
+def generator_command(shard, spec):
+    dataset = DATASETS[shard["dataset"]]
+    output = shard_output(shard)
+    model = shard["model"] if shard["model_id"] is None else f"{shard['model']}={shard['model_id']}"
+    command = [
+        sys.executable, os.path.join(ROOT, dataset["generator"]),
+        "--input", dataset["input"],
+        "--output", output,
+        "--models", model,
+        "--sample", str(shard["run"]),
+    ]
+    if "temperature" in shard["params"]:
+        command += ["--temperature", str(shard["params"]["temperature"])]
+    if "max_tokens" in shard["params"]:
+        command += ["--max-tokens", str(shard["params"]["max_tokens"])]
+    if spec.get("provider"):
+        command += ["--provider", spec["provider"]]
+    # A shard taken over from a dead worker (or rerun after a failure) continues its journal
+    if os.path.exists(os.path.splitext(output)[0] + ".journal.jsonl"):
+        command.append("--resume")
+    return command + list(spec.get("generator_args", []))
+
+
+def run_shard(shard, spec, leases):
+    """
+    Runs the shard's generator while renewing its lease; True if it finished cleanly. All
+    shards share ROOT's response cache, whose busy timeout makes concurrent writers wait.
+    """
+    os.makedirs(os.path.dirname(shard_output(shard)), exist_ok=True)
+    log_file = os.path.splitext(shard_output(shard))[0] + ".log"
+    with open(log_file, "a", encoding="utf-8") as log:
+        process = subprocess.Popen(generator_command(shard, spec), cwd=ROOT, stdout=log, stderr=subprocess.STDOUT)
+        while True:
+            try:
+                process.wait(timeout=HEARTBEAT_INTERVAL)
+                break
+            except subprocess.TimeoutExpired:
+                leases.renew(shard["id"])
+    return process.returncode == 0 and os.path.exists(shard_output(shard))
+
+
+def merge_run(run_shards):
+    """
+    Combines the per-model responses of a run into the usual results/<dataset><run>/ layout:
+    the generator's responses file with every model, a copy of the dataset and run.json.
+    Safe to call again (and from several workers at once): every file is replaced atomically.
+    """
+    first = run_shards[0]
+    dataset = DATASETS[first["dataset"]]
+    run_dir = first["run_dir"]
+    output = os.path.join(run_dir, dataset["output"])
+
+    tmp_file = f"{output}.{socket.gethostname()}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with ItemWriter(tmp_file) as writer:
+        for items in zip(*(iter_items(shard_output(shard)) for shard in run_shards)):
+            merged = dict(items[0])
+            merged["responses"] = {}
+            for item in items:
+                merged["responses"].update(item["responses"])
+            writer.write(merged)
+    os.replace(tmp_file, output)
+
+    # Compact responses / datasets keep their prefix table next to them
+    for source, target in [(shard_output(first), output),
+                           (os.path.join(ROOT, dataset["input"]), os.path.join(run_dir, os.path.basename(dataset["input"])))]:
+        if os.path.exists(prefixes_path_for(source)):
+            shutil.copyfile(prefixes_path_for(source), prefixes_path_for(target))
+    shutil.copyfile(os.path.join(ROOT, dataset["input"]), os.path.join(run_dir, os.path.basename(dataset["input"])))
+
+    with open(os.path.join(run_dir, "run.json"), "w", encoding="utf-8") as f:
+        json.dump({
+            "dataset": first["dataset"],
+            "run": first["run"],
+            "sample": first["run"],
+            "params": first["params"],
+            "models": {shard["model"]: shard["model_id"] for shard in run_shards},
+        }, f, indent=2)
+    return output
+
+
+def runs_of(plan):
+    runs = {}
+    for shard in plan["shards"]:
+        runs.setdefault(shard["run_dir"], []).append(shard)
+    return runs
+
+
+def record_finished_run(directory, run_dir):
+    """Appends a finished run to runs.txt, usable as summarize_moral_results.py --manifest."""
+    path = os.path.join(directory, "runs.txt")
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            if run_dir in f.read().splitlines():
+                return
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(run_dir + "\n")
+
+
+def finish_run(run_shards, leases):
+    """Merges a run once none of its shards is left to run; skipped models are left out of it."""
+    if not all(leases.is_done(s["id"]) or leases.is_skipped(s["id"]) for s in run_shards):
+        return
+    done = [s for s in run_shards if leases.is_done(s["id"])]
+    if done:
+        print(f"[{leases.owner}] merged {merge_run(done)}")
+        record_finished_run(os.path.dirname(leases.directory), done[0]["run_dir"])
+
+
+def adaptive_group(plan, shard):
+    """Shards repeating the same condition as shard: its dataset, model and sampling params."""
+    return [s for s in plan["shards"]
+            if (s["dataset"], s["model"], s["params"]) == (shard["dataset"], shard["model"], shard["params"])]
+
+
+def check_adaptive(plan, leases, shard):
+    """
+    Adaptive sweeps: after a shard of a model finishes, its finished repeats are scored and
+    checked against the spec's "adaptive" rule (see sequential.py). Once the rule is met the
+    model's remaining repeats are skipped. Every look is logged to adaptive.jsonl.
+    Returns the shards skipped.
+    """
+    # Needs pandas and the evaluators, which plain sweeps do without
+    from sequential import check, load_rows, print_decision
+
+    rule = plan["spec"]["adaptive"]
+    group = adaptive_group(plan, shard)
+    finished = [s for s in group if s["id"] == shard["id"] or leases.is_done(s["id"])]
+    df = load_rows([(shard_output(s), s["run_name"]) for s in finished])
+    decision = check(df, rule, len(group))
+
+    label = f"{shard['dataset']} {shard['model']} {json.dumps(shard['params'], sort_keys=True)}"
+    print_decision(f"[{leases.owner}] {label}", decision)
+    with open(os.path.join(os.path.dirname(leases.directory), "adaptive.jsonl"), "a", encoding="utf-8") as f:
+        f.write(json.dumps({"time": round(time.time(), 3), "shard": shard["id"], **decision}) + "\n")
+
+    if not decision["stop"]:
+        return []
+    skipped = [s for s in group if s not in finished and not leases.is_active(s["id"])]
+    for s in skipped:
+        leases.skip(s["id"])
+    print(f"[{leases.owner}] {label}: skipping {len(skipped)} remaining repeat(s)")
+    return skipped
+
+
+def worker(plan, leases, max_parallel, stop):
+    """Takes free shards until none are left; merges a run when its last shard finishes."""
+    spec = plan["spec"]
+    runs = runs_of(plan)
+    while not stop.is_set():
+        pending = [s for s in plan["shards"]
+                   if not leases.is_done(s["id"]) and not leases.is_skipped(s["id"])
+                   and leases.failures(s["id"]) < MAX_SHARD_ATTEMPTS]
+        if not pending:
+            return
+
+        shard = None
+        with leases.lock:
+            for candidate in pending:
+                running = sum(1 for s in plan["shards"]
+                              if s["model"] == candidate["model"] and leases.is_active(s["id"]))
+                if running < max_parallel and leases.acquire(candidate["id"]):
+                    shard = candidate
+                    break
+        if shard is None:
+            # Everything left is leased by somebody else (or its model is at its limit)
+            stop.wait(POLL_INTERVAL)
+            continue
+
+        print(f"[{leases.owner}] running {shard['id']}")
+        if not run_shard(shard, spec, leases):
+            print(f"[{leases.owner}] {shard['id']} failed, see {os.path.splitext(shard_output(shard))[0]}.log")
+            leases.release(shard["id"], "failed")
+            continue
+        # Checked while the lease is still held, so (with one shard per model at a time)
+        # no further repeat of the model starts before the decision
+        skipped = []
+        if spec.get("adaptive") and shard["dataset"] in ADAPTIVE_DATASETS:
+            skipped = check_adaptive(plan, leases, shard)
+        leases.release(shard["id"], "done")
+
+        # Skipping repeats can also complete runs that were only waiting for them
+        for run_dir in dict.fromkeys([shard["run_dir"], *(s["run_dir"] for s in skipped)]):
+            finish_run(runs[run_dir], leases)
+
+
+def run_sweep(spec, workers=None, results_dir=RESULTS_DIR):
+    plan = load_or_create_plan(spec, results_dir)
+    leases = Leases(os.path.join(sweep_dir(spec["name"], results_dir), "leases"))
+    max_parallel = spec.get("max_parallel_per_model", MAX_PARALLEL_PER_MODEL)
+    workers = workers or os.cpu_count() or 1
+    print(f"Sweep '{spec['name']}': {len(plan['shards'])} shards, {workers} worker(s) on {socket.gethostname()}")
+
+    stop = threading.Event()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(worker, plan, leases, max_parallel, stop) for _ in range(workers)]
+        try:
+            for future in futures:
+                future.result()
+        except KeyboardInterrupt:
+            # Running generators finish their shard (or are taken over once their lease expires)
+            stop.set()
+            raise
+    print_status(plan, leases)
+
+
+def print_status(plan, leases):
+    states = {"done": [], "running": [], "failed": [], "skipped": [], "pending": []}
+    for shard in plan["shards"]:
+        if leases.is_done(shard["id"]):
+            states["done"].append(shard["id"])
+        elif leases.is_skipped(shard["id"]):
+            states["skipped"].append(shard["id"])
+        elif leases.is_active(shard["id"]):
+            states["running"].append(shard["id"])
+        elif leases.failures(shard["id"]) >= MAX_SHARD_ATTEMPTS:
+            states["failed"].append(shard["id"])
+        else:
+            states["pending"].append(shard["id"])
+    print(f"\nSweep '{plan['spec']['name']}': " + ", ".join(f"{len(v)} {k}" for k, v in states.items()))
+    for state in ("running", "failed"):
+        for shard_id in states[state]:
+            print(f"  {state:<8} {shard_id}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run datasets x models x repeats x sampling params as sharded generator runs. "
+                    "Start it on several machines sharing results/ to spread the shards over them.")
+    parser.add_argument("command", choices=["run", "status", "merge"])
+    parser.add_argument("spec", help="sweep spec (JSON), see make_plan()")
+    parser.add_argument("--workers", type=int, default=None, help="shards run at once on this host (default: CPU count)")
+    parser.add_argument("--results-dir", default=RESULTS_DIR)
+    args = parser.parse_args()
+
+    with open(args.spec, "r", encoding="utf-8") as f:
+        spec = json.load(f)
+    if args.command == "run":
+        run_sweep(spec, args.workers, args.results_dir)
+    else:
+        plan = load_or_create_plan(spec, args.results_dir)
+        leases = Leases(os.path.join(sweep_dir(spec["name"], args.results_dir), "leases"))
+        if args.command == "status":
+            print_status(plan, leases)
+        else:
+            for run_shards in runs_of(plan).values():
+                finish_run(run_shards, leases)
@@ -0,0 +1,258 @@
+import argparse
+import bisect
+import contextvars
+import json
+import os
+import time
+from collections import Counter, defaultdict
+
+from retry import Failure
+
+# --- CONFIGURATION ---
+# Upper bounds (seconds) of the latency histogram buckets; the last one catches the rest
+LATENCY_BUCKETS = [0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60, float("inf")]
+HISTOGRAM_WIDTH = 40
+
+# USD per million tokens (input, cached input, output) by model id, for the cost estimate.
+# List prices at the time of writing; check the providers' pricing pages before relying on them.
+# Anthropic bills cache writes at 1.25x input, which the estimate ignores.
+PRICES = {
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "claude-sonnet-4-5-20250929": (3.00, 0.30, 15.00),
+    "llama-3.3-70b-versatile": (0.59, 0.59, 0.79),
+    "mock": (0.0, 0.0, 0.0),
+}
+
+# The call being measured in the current task, filled in by the layers it passes through
+# (scheduler -> query_model -> rate limiter). None outside an instrumented call.
+_current_call = contextvars.ContextVar("telemetry_call", default=None)
+
+
+def telemetry_path_for(output_file):
+    """raw_model_responses.json -> raw_model_responses.telemetry.jsonl"""
+    root, _ = os.path.splitext(output_file)
+    return f"{root}.telemetry.jsonl"
+
+
+def note(**fields):
+    """Sets fields on the call being measured, if any."""
+    call = _current_call.get()
+    if call is not None:
+        call.update(fields)
+
+
+def add(field, amount=1):
+    """Adds to a numeric field of the call being measured, if any."""
+    call = _current_call.get()
+    if call is not None:
+        call[field] = (call.get(field) or 0) + amount
+
+
+class Telemetry:
+    """
+    Per-call instrumentation of a generation run, one JSON record per line:
+    {"provider", "model", "model_id", "variant", "queue_wait", "rate_limit_wait", "latency",
+     "total_time", "input_tokens", "cached_input_tokens", "output_tokens", "retries", "error", ...}
+
+    `queue_wait` is the time a job sat in the scheduler queue, `rate_limit_wait` the time spent
+    waiting for rate-limit budget and `latency` the network time of the last attempt.
+    Records are also kept in memory for the end-of-run summary.
+    """
+
+    def __init__(self, path, models=None, resume=False):
+        self.path = path
+        self.models = models or {}
+        self.records = []
+        self.started = time.time()
+        self.file = open(path, "a" if resume else "w", encoding="utf-8")
+
+    async def track(self, job, provider, queue_wait, query):
+        """Awaits query(model_key, prompt, item_id=...) for a scheduler job and records the call."""
+        call = {
+            "time": round(time.time(), 3),
+            "provider": provider,
+            "model": job.model_key,
+            "model_id": self.models.get(job.model_key, job.model_key),
+            "variant": job.variant,
+            "queue_wait": round(queue_wait, 4),
+            "rate_limit_wait": 0.0,
+            "latency": None,
+            "retries": 0,
+            "cache_hit": False,
+            "error": None,
+            "error_class": None,
+        }
+        token = _current_call.set(call)
+        start = time.perf_counter()
+        try:
+            result = await query(job.model_key, job.prompt, item_id=job.item_id)
+        finally:
+            _current_call.reset(token)
+        call["total_time"] = round(time.perf_counter() - start, 4)
+        self.record(call, result)
+        return result
+
+    def record(self, call, completion):
+        """Adds the usage of completion (a providers.Completion, retry.Failure or None) to call and writes it."""
+        if isinstance(completion, Failure):
+            call["error_class"] = completion.error_class
+            call["error"] = call.get("error") or completion.error_class
+        elif completion is not None:
+            call["input_tokens"] = completion.input_tokens
+            call["cached_input_tokens"] = completion.cached_input_tokens
+            call["output_tokens"] = completion.output_tokens
+            if completion.timings:
+                call["ttft"] = completion.timings.get("ttft")
+        elif call.get("error") is None:
+            call["error"] = "NoResponse"
+        call["rate_limit_wait"] = round(call.get("rate_limit_wait") or 0.0, 4)
+        self.records.append(call)
+        self.file.write(json.dumps(call) + "\n")
+        self.file.flush()
+
+    def record_batch_result(self, job, provider, completion):
+        """Batch results have no per-call timing, only usage and success."""
+        self.record({
+            "time": round(time.time(), 3),
+            "provider": provider,
+            "model": job.model_key,
+            "model_id": self.models.get(job.model_key, job.model_key),
+            "variant": job.variant,
+            "batch": True,
+            "retries": 0,
+            "error": None,
+        }, completion)
+
+    def close(self):
+        """Closes the log and writes this run's summary next to it (X.telemetry.summary.json)."""
+        self.file.close()
+        summary = summarize(self.records, time.time() - self.started)
+        root, _ = os.path.splitext(self.path)
+        with open(f"{root}.summary.json", "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+        return summary
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+
+def histogram(values):
+    """Counts of values per LATENCY_BUCKETS bucket."""
+    counts = [0] * len(LATENCY_BUCKETS)
+    for value in values:
+        counts[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+    return counts
+
+
+def estimate_cost(model_id, input_tokens, cached_tokens, output_tokens):
+    """USD for the given usage, or None if the model has no PRICES entry."""
+    prices = PRICES.get(model_id)
+    if prices is None:
+        return None
+    input_price, cached_price, output_price = prices
+    return ((input_tokens - cached_tokens) * input_price + cached_tokens * cached_price
+            + output_tokens * output_price) / 1e6
+
+
+def summarize(records, wall_seconds=None):
+    """
+    Per model: calls, errors by class, retries, throughput, latency percentiles and histogram,
+    token totals and estimated cost. Responses served from the local cache count as calls
+    but not towards latency.
+    """
+    if wall_seconds is None and records:
+        wall_seconds = max(r["time"] for r in records) - min(r["time"] for r in records)
+
+    groups = defaultdict(list)
+    for record in records:
+        groups[(record["provider"], record["model"], record.get("model_id"))].append(record)
+
+    models = {}
+    for (provider, model, model_id), group in groups.items():
+        latencies = [r["latency"] for r in group if r.get("latency") is not None]
+        input_tokens = sum(r.get("input_tokens") or 0 for r in group)
+        cached_tokens = sum(r.get("cached_input_tokens") or 0 for r in group)
+        output_tokens = sum(r.get("output_tokens") or 0 for r in group)
+        models[model] = {
+            "provider": provider,
+            "model_id": model_id,
+            "calls": len(group),
+            "errors": dict(Counter(r.get("error_class") or r["error"] for r in group if r.get("error"))),
+            "retries": sum(r.get("retries") or 0 for r in group),
+            "cache_hits": sum(1 for r in group if r.get("cache_hit")),
+            "throughput_rps": round(len(group) / wall_seconds, 2) if wall_seconds else None,
+            "queue_wait_p50": percentile([r["queue_wait"] for r in group if r.get("queue_wait") is not None], 50),
+            "rate_limit_wait_total": round(sum(r.get("rate_limit_wait") or 0 for r in group), 2),
+            "latency_p50": percentile(latencies, 50),
+            "latency_p95": percentile(latencies, 95),
+            "latency_p99": percentile(latencies, 99),
+            "latency_histogram": histogram(latencies),
+            "input_tokens": input_tokens,
+            "cached_input_tokens": cached_tokens,
+            "output_tokens": output_tokens,
+            # Mock runs keep the real model ids but cost nothing
+            "estimated_cost_usd": estimate_cost("mock" if provider == "mock" else model_id,
+                                                input_tokens, cached_tokens, output_tokens),
+        }
+    return {"wall_seconds": round(wall_seconds or 0, 2), "calls": len(records), "models": models}
+
+
+def _bucket_label(i):
+    low = 0 if i == 0 else LATENCY_BUCKETS[i - 1]
+    high = LATENCY_BUCKETS[i]
+    return f">{low:g}s" if high == float("inf") else f"{low:g}-{high:g}s"
+
+
+def print_summary(summary):
+    print(f"\n=== TELEMETRY ({summary['calls']} calls in {summary['wall_seconds']:.1f}s) ===")
+    for model, stats in summary["models"].items():
+        cost = stats["estimated_cost_usd"]
+        errors = ", ".join(f"{k}: {v}" for k, v in stats["errors"].items()) or "none"
+        print(f"\n{model} ({stats['provider']}, {stats['model_id']})")
+        print(f"  calls {stats['calls']}  ({stats['throughput_rps']} /s)  cache hits {stats['cache_hits']}  "
+              f"retries {stats['retries']}  errors {errors}")
+        if stats["latency_p50"] is not None:
+            print(f"  latency p50 {stats['latency_p50']:.3f}s  p95 {stats['latency_p95']:.3f}s  "
+                  f"p99 {stats['latency_p99']:.3f}s  queue wait p50 {stats['queue_wait_p50'] or 0:.3f}s  "
+                  f"rate-limit wait {stats['rate_limit_wait_total']:.1f}s total")
+            peak = max(stats["latency_histogram"]) or 1
+            for i, count in enumerate(stats["latency_histogram"]):
+                if count:
+                    print(f"    {_bucket_label(i):>10} {'#' * max(1, count * HISTOGRAM_WIDTH // peak)} {count}")
+        print(f"  tokens in {stats['input_tokens']} (cached {stats['cached_input_tokens']})  "
+              f"out {stats['output_tokens']}  est. cost "
+              + (f"${cost:.4f}" if cost is not None else "n/a (no PRICES entry)"))
+
+
+def load_records(path):
+    records = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue    # half-written last line of an interrupted run
+    return records
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarise the per-call telemetry of one or more generation runs.")
+    parser.add_argument("files", nargs="+", help="*.telemetry.jsonl files written by the generators")
+    parser.add_argument("--since", type=float, default=None,
+                        help="only calls from the last N minutes (spot a provider degrading during a sweep)")
+    parser.add_argument("--out", help="also write the summary as JSON")
+    args = parser.parse_args()
+
+    records = [r for path in args.files for r in load_records(path)]
+    if args.since is not None:
+        cutoff = time.time() - args.since * 60
+        records = [r for r in records if r["time"] >= cutoff]
+    summary = summarize(records)
+    print_summary(summary)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
@@ -0,0 +1,11 @@
+from response_classifier import classify_case
+
+def test_first_decisive_case_is_not_overridden_by_a_description():
+    assert classify_case("Case 1. Case 2 would result in more deaths.") == "Case 1"
+
+def test_later_case_given_as_an_answer_is_unclear():
+    assert classify_case("Case 1 saves the passengers. Case 2.") == "Unclear"
+
+def test_case_rejected_by_would_not_be():
+    assert classify_case("Case 2 would not be my choice; Case 1 is.") == "Case 1"
+    assert classify_case("Case 1 wouldn't be right. Case 2 spares more lives.") == "Case 2"
@@ -0,0 +1,24 @@
+import asyncio
+
+from retry import UNKNOWN, Failure
+from scheduler import Job, run_jobs
+
+def test_failing_job_does_not_stop_its_worker():
+    jobs = [Job(i, "gpt-4o", "neutral", f"prompt {i}", f"ID-{i}") for i in range(6)]
+    results = {}
+
+    async def query(model_key, prompt, item_id=None):
+        if item_id == "ID-1":
+            raise ValueError("malformed response")
+        return prompt
+
+    def on_result(job, response):
+        if job.item_id == "ID-3" and not isinstance(response, Failure):
+            raise KeyError("slot")
+        results[job.item_id] = response
+
+    asyncio.run(run_jobs(jobs, query, on_result, concurrency={"openai": 1}))
+
+    assert results["ID-1"] == Failure(UNKNOWN, "malformed response", 1)
+    assert isinstance(results["ID-3"], Failure)
+    assert [results[f"ID-{i}"] for i in (0, 2, 4, 5)] == ["prompt 0", "prompt 2", "prompt 4", "prompt 5"]